@@ -0,0 +1,293 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+import ec2
+import script
+import url_manifest
+from instance_backends import LocalBackend
+
+STDLIB_MODULES = ['os', 'sys', 'json', 're', 'collections', 'itertools', 'logging', 'subprocess', 'datetime', 'math']
+EXTERNAL_MODULES = ['numpy', 'pandas', 'requests', 'django', 'flask', 'scipy', 'yaml', 'boto3', 'sqlalchemy', 'pytest']
+
+class SyntheticRepos:
+  """
+  Generates python repositories with tunable number of files, lines per file, ratio of duplicated blocks,
+  depth of nested for loops, mix of stdlib, local and external imports and size of other files. Every repository
+  is a local git repository which allows partial clones, so it can be cloned with a file:// url.
+  """
+  def __init__(self, directory, files=20, lines=300, duplication=0.1, depth=3, imports=(0.5, 0.2, 0.3), seed=0, assets=0):
+    self.directory = directory
+    self.files = files
+    self.lines = lines
+    self.duplication = duplication
+    self.depth = depth
+    self.imports = imports      # ratio of stdlib, local and external imports
+    self.random = random.Random(seed)
+    self.assets = assets        # bytes of data files which are not python files
+
+  def import_lines(self, local_modules):
+    lines = []
+    for _ in range(self.random.randint(2, 8)):
+      kind = self.random.choices(['stdlib', 'local', 'external'], weights=self.imports)[0]
+      if kind=='stdlib':
+        module = self.random.choice(STDLIB_MODULES)
+      elif kind=='local':
+        module = self.random.choice(local_modules)
+      else:
+        module = self.random.choice(EXTERNAL_MODULES)
+      if self.random.random()<0.5:
+        lines.append(f'import {module}')
+      else:
+        lines.append(f'from {module} import name{self.random.randint(0, 9)}')
+    return lines
+
+  def function_lines(self):
+    """ Returns lines of a function with nested for loops, conditionals and variables """
+    num = self.random.randint(0, 1000)
+    parameters = ', '.join(f'arg{i}' for i in range(self.random.randint(0, 4)))
+    lines = [f'def function{num}({parameters}):', f'  total{num} = 0']
+    indent = '  '
+    for level in range(self.random.randint(1, self.depth)):
+      lines.append(f'{indent}for item{level} in range({self.random.randint(2, 50)}):')
+      indent += '  '
+      lines.append(f'{indent}value{level} = item{level} * {self.random.randint(1, 9)}')
+      if self.random.random()<0.3:
+        lines.append(f'{indent}if value{level} > {self.random.randint(1, 99)}:')
+        lines.append(f'{indent}  total{num} += value{level}  # add value')
+    lines.append(f'  return total{num}')
+    return lines
+
+  def file_content(self, local_modules, shared_blocks):
+    lines = ['"""', 'Generated module', '"""']
+    lines.extend(self.import_lines(local_modules))
+    while len(lines)<self.lines:
+      lines.append('')
+      if len(shared_blocks)>0 and self.random.random()<self.duplication:
+        lines.extend(self.random.choice(shared_blocks))
+      else:
+        block = self.function_lines()
+        shared_blocks.append(block)
+        lines.extend(block)
+    return '\n'.join(lines) + '\n'
+
+  def create(self, name):
+    """ Creates a repository and returns its file:// url """
+    path = os.path.join(self.directory, name)
+    local_modules = [f'module{i}' for i in range(self.files)]
+    shared_blocks = []
+    for i, module in enumerate(local_modules):
+      package = os.path.join(path, 'package' if i%2 else '')
+      os.makedirs(package, exist_ok=True)
+      with open(os.path.join(package, f'{module}.py'), 'w') as f:
+        f.write(self.file_content(local_modules, shared_blocks))
+    if self.assets>0:
+      os.makedirs(os.path.join(path, 'data'), exist_ok=True)
+      with open(os.path.join(path, 'data', 'dataset.bin'), 'wb') as f:
+        # same bytes as random.randbytes of python 3.9
+        f.write(self.random.getrandbits(self.assets*8).to_bytes(self.assets, 'little'))
+    for command in (['git', 'init', '-q'], ['git', 'config', 'uploadpack.allowFilter', 'true'], ['git', 'add', '-A'], ['git', '-c', 'user.name=benchmark', '-c', 'user.email=benchmark@localhost', 'commit', '-q', '-m', 'generated']):
+      subprocess.check_call(command, cwd=path)
+    return f'file://{os.path.abspath(path)}'
+
+def python_files(url):
+  path = url[len('file://'):]
+  return [os.path.join(folder, filename) for folder, _, filenames in os.walk(path) if '.git' not in folder for filename in filenames if filename.endswith('.py')]
+
+def count_lines(files):
+  total = 0
+  for file in files:
+    with open(file, 'rb') as f:
+      total += f.read().count(b'\n')
+  return total
+
+def timed(function, repeat):
+  """ Returns best time of repeat runs of function """
+  best = None
+  for _ in range(repeat):
+    start = perf_counter()
+    function()
+    elapsed = perf_counter()-start
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+def benchmark_functions(urls, repeat):
+  """ Measures lines per second of get_data_for_file with every engine, duplicate pass and external_libraries """
+  with open('libraries.json', 'r') as f:
+    libraries = json.load(f)['modules']
+  files = [file for url in urls for file in python_files(url)]
+  lines = count_lines(files)
+  contents = []
+  for file in files:
+    with open(file, 'r') as f:
+      contents.append(f.read().split('\n'))
+  directories = frozenset(os.path.basename(file)[:-3] for file in files)
+  results = {}
+  for engine in ('lines', 'stream'):
+    analyzer = script.RepoAnalyzer(frozenset(libraries), engine=engine)
+    elapsed = timed(lambda: [analyzer.get_data_for_file(file, directories) for file in files], repeat)
+    results[f'get_data_for_file[{engine}]'] = {'value': lines/elapsed, 'unit': 'lines/sec'}
+  analyzer = script.RepoAnalyzer(frozenset(libraries))
+  elapsed = timed(lambda: [analyzer.count_duplicates(content, len(content)) for content in contents], repeat)
+  results['count_duplicates'] = {'value': lines/elapsed, 'unit': 'lines/sec'}
+  elapsed = timed(lambda: [analyzer.external_libraries(content, directories) for content in contents], repeat)
+  results['external_libraries'] = {'value': lines/elapsed, 'unit': 'lines/sec'}
+  return results
+
+def benchmark_process(urls, threads, pipeline, analyzers, fetch='full', bare=False, async_clones=None):
+  """ Measures repositories per minute of whole process, in a working directory with url_list.csv of urls """
+  workdir = tempfile.mkdtemp(prefix='benchmark-process-')
+  cwd = os.getcwd()
+  try:
+    shutil.copy('libraries.json', workdir)
+    os.chdir(workdir)
+    with open('url_list.csv', 'w') as f:
+      f.write('repository_url\n' + '\n'.join(urls) + '\n')
+    manager = script.ProcessInstance(1, len(urls), threads, fetch=fetch, bare=bare)
+    start = perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+      manager.run(pipeline, analyzers, async_clones)
+    elapsed = perf_counter()-start
+  finally:
+    os.chdir(cwd)
+    shutil.rmtree(workdir, ignore_errors=True)
+  return {'value': len(urls)*60/elapsed, 'unit': 'repos/min'}
+
+def benchmark_fleet(urls, num_instances, batch_size=None, cpus=None, bandwidth=None):
+  """
+  Measures repositories per hour of a fleet of num_instances local instances, run by ManageInstances as on
+  ec2, in a working directory with url_list.csv of urls. cpus and bandwidth limit every instance.
+  """
+  workdir = tempfile.mkdtemp(prefix='benchmark-fleet-')
+  cwd = os.getcwd()
+  try:
+    os.chdir(workdir)
+    with open('url_list.csv', 'w') as f:
+      f.write('repository_url\n' + '\n'.join(urls) + '\n')
+    size = -(-len(urls)//num_instances)
+    manager = ec2.ManageInstances(num_instances, size, backend=LocalBackend('fleet', cpus, bandwidth))
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+      elapsed, count = manager.run(batch_size)
+  finally:
+    os.chdir(cwd)
+    shutil.rmtree(workdir, ignore_errors=True)
+  return {'value': count*3600/elapsed, 'unit': 'repos/hour'}
+
+def benchmark_startup(num_urls, size, repeat):
+  """
+  Measures milliseconds and peak memory of a new process which imports script.py, and of one which also starts
+  ProcessInstance for last size of num_urls urls, reading them from url_list.csv and from a url manifest
+  """
+  workdir = tempfile.mkdtemp(prefix='benchmark-startup-')
+  try:
+    shutil.copy('libraries.json', workdir)
+    csv_path = os.path.join(workdir, 'url_list.csv')
+    with open(csv_path, 'w') as f:
+      f.write('repository_url\n' + ''.join(f'https://github.com/user{i}/repo{i}\n' for i in range(num_urls)))
+    url_manifest.build_manifest(csv_path, os.path.join(workdir, 'url_list.manifest'))
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(script.__file__)))
+    rss = {}
+    def start(name, code):
+      # ru_maxrss is kept across exec on linux, so it can be peak of this process, VmHWM is of new process only
+      code += '''
+import resource, sys
+try:
+  print([line.split()[1] for line in open('/proc/self/status') if line.startswith('VmHWM')][0])
+except OSError:
+  print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss//(1024 if sys.platform=='darwin' else 1))'''
+      output = subprocess.run([sys.executable, '-c', code], cwd=workdir, env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+      rss[name] = int(output.split()[-1])/1024
+    instance = max(1, num_urls//size)
+    results = {}
+    for name, code in (('import', 'import script'), ('csv', f'import script\nscript.ProcessInstance({instance}, {size}, 1)'),
+      ('manifest', f'import script\nscript.ProcessInstance({instance}, {size}, 1, urls_file="url_list.manifest")')):
+      results[f'startup[{name}]'] = {'value': timed(lambda: start(name, code), repeat)*1000, 'unit': 'ms'}
+      results[f'startup_rss[{name}]'] = {'value': rss[name], 'unit': 'MB'}
+  finally:
+    shutil.rmtree(workdir, ignore_errors=True)
+  return results
+
+def peak_rss_mb():
+  """ Peak resident memory of this process and its children in MB """
+  usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+  # ru_maxrss is in bytes on macOS and in kilobytes on linux
+  return usage/(1024*1024) if sys.platform=='darwin' else usage/1024
+
+def regressions(results, baseline, tolerance):
+  """ Returns names of results which are worse than baseline by more than tolerance """
+  worse = []
+  for name, result in results.items():
+    if name not in baseline:
+      continue
+    old = baseline[name]['value']
+    if result['unit'] in ('MB', 'ms'):
+      # lower is better
+      if result['value']>old*(1+tolerance):
+        worse.append(name)
+    elif result['value']<old*(1-tolerance):
+      worse.append(name)
+  return worse
+
+# main program
+if __name__=='__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--repos', type=int, default=5, help='number of repositories')
+  parser.add_argument('--files', type=int, default=20, help='python files per repository')
+  parser.add_argument('--lines', type=int, default=300, help='lines per file')
+  parser.add_argument('--duplication', type=float, default=0.1, help='ratio of duplicated blocks')
+  parser.add_argument('--depth', type=int, default=3, help='maximum depth of nested for loops')
+  parser.add_argument('--imports', type=float, nargs=3, default=[0.5, 0.2, 0.3], metavar=('STDLIB', 'LOCAL', 'EXTERNAL'), help='ratio of import kinds')
+  parser.add_argument('--assets', type=int, default=0, help='bytes of data files in every repository')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--repeat', type=int, default=3, help='runs of every function benchmark, best is used')
+  parser.add_argument('--threads', type=int, default=4)
+  parser.add_argument('--analyzers', type=int, default=os.cpu_count())
+  parser.add_argument('--startup-urls', type=int, default=100000, help='urls in url list of startup benchmark')
+  parser.add_argument('--fleet', type=int, nargs='*', default=[2], help='numbers of local instances of fleet benchmarks')
+  parser.add_argument('--fleet-batch-size', type=int, help='also run fleet benchmarks with batches of this many urls')
+  parser.add_argument('--fleet-cpus', type=int, help='cores of every local instance')
+  parser.add_argument('--fleet-bandwidth', type=int, help='KB per second of clones of every local instance')
+  parser.add_argument('--save', help='save results as baseline json file')
+  parser.add_argument('--compare', help='baseline json file, exits with error if results are worse')
+  parser.add_argument('--tolerance', type=float, default=0.1, help='allowed ratio of regression')
+  args = parser.parse_args()
+
+  directory = tempfile.mkdtemp(prefix='benchmark-repos-')
+  try:
+    generator = SyntheticRepos(directory, args.files, args.lines, args.duplication, args.depth, args.imports, args.seed, args.assets)
+    urls = [generator.create(f'repo{i}') for i in range(args.repos)]
+    results = benchmark_functions(urls, args.repeat)
+    results['process[threads]'] = benchmark_process(urls, args.threads, False, args.analyzers)
+    results['process[pipeline]'] = benchmark_process(urls, args.threads, True, args.analyzers)
+    results['process[sparse]'] = benchmark_process(urls, args.threads, False, args.analyzers, 'sparse')
+    results['process[bare]'] = benchmark_process(urls, args.threads, False, args.analyzers, bare=True)
+    results['process[async]'] = benchmark_process(urls, args.threads, False, args.analyzers, async_clones=args.threads)
+    for num_instances in args.fleet:
+      bandwidth = args.fleet_bandwidth*1024 if args.fleet_bandwidth else None
+      results[f'fleet[{num_instances}]'] = benchmark_fleet(urls, num_instances, None, args.fleet_cpus, bandwidth)
+      if args.fleet_batch_size:
+        results[f'fleet[{num_instances},batch={args.fleet_batch_size}]'] = benchmark_fleet(urls, num_instances, args.fleet_batch_size, args.fleet_cpus, bandwidth)
+    results.update(benchmark_startup(args.startup_urls, 100, args.repeat))
+    results['peak_rss'] = {'value': peak_rss_mb(), 'unit': 'MB'}
+  finally:
+    shutil.rmtree(directory, ignore_errors=True)
+
+  for name, result in results.items():
+    print(f"{name:32} {result['value']:14.1f} {result['unit']}")
+  if args.save:
+    with open(args.save, 'w') as f:
+      json.dump(results, f, indent=2)
+  if args.compare:
+    with open(args.compare, 'r') as f:
+      worse = regressions(results, json.load(f), args.tolerance)
+    if len(worse)>0:
+      print(f"Regressions: {', '.join(worse)}")
+      sys.exit(1)
@@ -0,0 +1,94 @@
+import resource
+import signal
+
+# outcomes of repositories which go over a budget
+DISK_EXCEEDED = 'disk budget exceeded'
+CPU_EXCEEDED = 'cpu budget exceeded'
+MEMORY_EXCEEDED = 'memory budget exceeded'
+ANALYSIS_TIMEOUT = 'analysis timeout'
+
+# default wall time of an analysis with a memory budget only
+ANALYSIS_WALL_SECONDS = 3600
+
+class BudgetExceeded(Exception):
+  def __init__(self, outcome, message):
+    super().__init__(message)
+    self.outcome = outcome
+
+class Budget:
+  """
+  Limits of one repository, None is no limit. disk_bytes is size of clone on disk, cpu_seconds and memory_bytes
+  are cpu time and address space of process analyzing it. Analysis taking wall_seconds is killed, by default
+  twice its cpu time and a minute for waiting on git, or ANALYSIS_WALL_SECONDS with a memory budget only, so
+  that an analysis with a budget never runs unbounded.
+  """
+  def __init__(self, disk_bytes=None, cpu_seconds=None, memory_bytes=None, wall_seconds=None):
+    self.disk_bytes = disk_bytes
+    self.cpu_seconds = cpu_seconds
+    self.memory_bytes = memory_bytes
+    self.wall_seconds = wall_seconds
+    if wall_seconds is None and cpu_seconds:
+      self.wall_seconds = cpu_seconds*2+60
+    elif wall_seconds is None and memory_bytes:
+      self.wall_seconds = ANALYSIS_WALL_SECONDS
+
+  def limits_analysis(self):
+    return bool(self.cpu_seconds or self.memory_bytes or self.wall_seconds)
+
+  def check_disk(self, size):
+    if self.disk_bytes and size>self.disk_bytes:
+      raise BudgetExceeded(DISK_EXCEEDED, f'repository takes {size} bytes on disk, budget is {self.disk_bytes}')
+
+def run_limited_target(connection, cpu_seconds, memory_bytes, function, args):
+  """ Runs in process of run_limited, sends kind of result and result """
+  if cpu_seconds:
+    # SIGXCPU at soft limit, SIGKILL at hard limit if it is ignored
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds+5))
+  if memory_bytes:
+    # address space, resident memory can not be limited on linux
+    resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+  try:
+    result = ('result', function(*args))
+  except MemoryError:
+    result = ('memory', None)
+  except Exception as e:
+    # exception may not be picklable
+    result = ('error', f'{type(e).__name__}: {e}')
+  # sent after memory of traceback is freed
+  connection.send(result)
+
+def run_limited(function, args, budget):
+  """
+  Runs function in a new process with cpu and memory limits of budget and returns its result. Raises
+  BudgetExceeded when process goes over a limit or takes longer than wall_seconds, when it is killed.
+  """
+  # imported here, workers without budgets start faster
+  import multiprocessing
+  context = multiprocessing.get_context('spawn')
+  receiver, sender = context.Pipe(duplex=False)
+  process = context.Process(target=run_limited_target, args=(sender, budget.cpu_seconds, budget.memory_bytes, function, args), daemon=True)
+  process.start()
+  sender.close()
+  try:
+    # also true when process dies without sending
+    if not receiver.poll(budget.wall_seconds):
+      raise BudgetExceeded(ANALYSIS_TIMEOUT, f'analysis took more than {budget.wall_seconds} seconds')
+    try:
+      kind, value = receiver.recv()
+    except EOFError:
+      process.join()
+      if budget.cpu_seconds and process.exitcode in (-signal.SIGXCPU, -signal.SIGKILL):
+        raise BudgetExceeded(CPU_EXCEEDED, f'analysis took more than {budget.cpu_seconds} cpu seconds')
+      if budget.memory_bytes:
+        raise BudgetExceeded(MEMORY_EXCEEDED, f'analysis process died with code {process.exitcode} at memory budget of {budget.memory_bytes} bytes')
+      raise RuntimeError(f'Analysis process died with code {process.exitcode}')
+    if kind=='memory':
+      raise BudgetExceeded(MEMORY_EXCEEDED, f'analysis needed more than {budget.memory_bytes} bytes')
+    if kind=='error':
+      raise RuntimeError(value)
+    return value
+  finally:
+    receiver.close()
+    if process.is_alive():
+      process.kill()
+    process.join()
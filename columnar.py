@@ -0,0 +1,324 @@
+import argparse
+import array
+import glob
+import json
+import math
+import os
+import struct
+import sys
+import threading
+
+MAGIC = b'RCOLUMN1'
+
+# name and type of columns, q is integer, d is float, str is text and libraries is list of library names.
+# Missing values are -1, nan and empty text.
+REPO_COLUMNS = [
+  ('repository_url', 'str'),
+  ('error', 'str'),
+  ('outcome', 'str'),
+  ('number of lines', 'q'),
+  ('nesting factor', 'd'),
+  ('average parameters', 'd'),
+  ('average variables', 'd'),
+  ('code duplication', 'd'),
+  ('cross file duplication', 'd'),
+  ('skipped files', 'q'),
+  ('skipped bytes', 'q'),
+  ('skipped directories', 'q'),
+  ('libraries', 'libraries'),
+]
+
+# repo is row of repository in repos table of same shard
+FILE_COLUMNS = [
+  ('repo', 'q'),
+  ('path', 'str'),
+  ('sha', 'str'),
+  ('number of lines', 'q'),
+  ('function definitions', 'q'),
+  ('parameters', 'q'),
+  ('variables', 'q'),
+  ('forloops', 'q'),
+  ('forloops depth', 'q'),
+  ('code duplication', 'd'),
+  ('libraries', 'libraries'),
+]
+
+TABLES = {'repos': REPO_COLUMNS, 'files': FILE_COLUMNS}
+
+# typecode of offsets and values buffers of every type, offsets of row n are at n and n+1
+BUFFERS = {'q': (None, 'q'), 'd': (None, 'd'), 'str': ('q', 'B'), 'libraries': ('q', 'I')}
+
+MISSING = {'q': -1, 'd': math.nan, 'str': ''}
+
+class Column:
+  """ Values of a column being written, numbers in an array and texts and lists as offsets into values """
+  def __init__(self, kind):
+    self.kind = kind
+    offsets, values = BUFFERS[kind]
+    self.offsets = array.array(offsets, [0]) if offsets else None
+    self.values = array.array(values)
+
+  def append(self, value, dictionary=None):
+    if self.kind=='str':
+      self.values.frombytes((value or '').encode('utf8', errors='surrogateescape'))
+      self.offsets.append(len(self.values))
+    elif self.kind=='libraries':
+      self.values.extend(dictionary.setdefault(library, len(dictionary)) for library in value or ())
+      self.offsets.append(len(self.values))
+    else:
+      self.values.append(MISSING[self.kind] if value is None else value)
+
+  def buffers(self):
+    if self.offsets is None:
+      return {'values': self.values}
+    return {'offsets': self.offsets, 'values': self.values}
+
+def write_shard(path, tables, rows, dictionary):
+  """ Writes columns of tables and library dictionary to path, through a temporary file so that it is never read half written """
+  header = {'byteorder': sys.byteorder, 'dictionary': dictionary, 'tables': {}}
+  buffers = []
+  offset = 0
+  for table, columns in tables.items():
+    header['tables'][table] = {'rows': rows[table], 'columns': {}}
+    for name, column in columns.items():
+      info = {'type': column.kind}
+      for buffer_name, buffer in column.buffers().items():
+        size = len(buffer)*buffer.itemsize
+        info[buffer_name] = [offset, size]
+        buffers.append(buffer)
+        offset += size
+      header['tables'][table]['columns'][name] = info
+  header = json.dumps(header).encode('utf8')
+  with open(path + '.tmp', 'wb') as f:
+    f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+    for buffer in buffers:
+      buffer.tofile(f)
+  os.replace(path + '.tmp', path)
+
+class ColumnWriter:
+  """
+  Buffers result of every repository and data of its files in columns, and writes them to a new shard
+  in directory after every shard_rows repositories and when flushed. It can be shared by threads.
+  """
+  def __init__(self, directory, prefix, shard_rows=10000, resume=False):
+    self.directory = directory
+    self.prefix = prefix
+    self.shard_rows = shard_rows
+    self.lock = threading.Lock()
+    os.makedirs(directory, exist_ok=True)
+    shards = glob.glob(os.path.join(directory, f'{prefix}-*.rcol'))
+    if not resume:
+      for shard in shards:
+        os.remove(shard)
+      shards = []
+    # shards of earlier run are kept with resume
+    self.shard_num = len(shards)
+    self.reset()
+
+  def reset(self):
+    self.tables = {table: {name: Column(kind) for name, kind in columns} for table, columns in TABLES.items()}
+    self.rows = {table: 0 for table in TABLES}
+    self.dictionary = {}
+
+  def add(self, data, files=None):
+    """ Adds a result record, and data of its files as (path, hash, data of get_data_for_file with all imported modules) """
+    with self.lock:
+      repo = self.rows['repos']
+      for name, kind in REPO_COLUMNS:
+        self.tables['repos'][name].append(data.get(name), self.dictionary)
+      self.rows['repos'] += 1
+      # imported modules of a file which are external libraries of repository
+      libraries = set(data.get('libraries') or ())
+      for path, sha, file_data in files or ():
+        values = [repo, path, sha] + list(file_data[1:7]) + [file_data[0], [module for module in file_data[-1] if module in libraries]]
+        for (name, kind), value in zip(FILE_COLUMNS, values):
+          self.tables['files'][name].append(value, self.dictionary)
+        self.rows['files'] += 1
+      if self.rows['repos']>=self.shard_rows:
+        self.write()
+
+  def write(self):
+    if self.rows['repos']==0:
+      return
+    self.shard_num += 1
+    dictionary = sorted(self.dictionary, key=self.dictionary.get)
+    write_shard(os.path.join(self.directory, f'{self.prefix}-{self.shard_num:05d}.rcol'), self.tables, self.rows, dictionary)
+    self.reset()
+
+  def flush(self):
+    """ Writes buffered rows to a shard """
+    with self.lock:
+      self.write()
+
+class ShardReader:
+  """ Reads single columns of a shard, only bytes of a column are read """
+  def __init__(self, path):
+    self.path = path
+    with open(path, 'rb') as f:
+      if f.read(len(MAGIC))!=MAGIC:
+        raise ValueError(f'{path} is not a column shard')
+      size, = struct.unpack('<Q', f.read(8))
+      self.header = json.loads(f.read(size))
+      self.data_start = len(MAGIC)+8+size
+    self.dictionary = self.header['dictionary']
+
+  def rows(self, table):
+    return self.header['tables'][table]['rows']
+
+  def columns(self, table):
+    return list(self.header['tables'][table]['columns'])
+
+  def buffer(self, table, name, buffer_name):
+    """ Returns raw values of a buffer of column as an array """
+    info = self.header['tables'][table]['columns'][name]
+    offset, size = info[buffer_name]
+    values = array.array(BUFFERS[info['type']][0 if buffer_name=='offsets' else 1])
+    with open(self.path, 'rb') as f:
+      f.seek(self.data_start+offset)
+      values.frombytes(f.read(size))
+    if self.header['byteorder']!=sys.byteorder:
+      values.byteswap()
+    return values
+
+  def column(self, table, name):
+    """ Returns values of column, an array of numbers, or list of texts or of lists of library names """
+    kind = self.header['tables'][table]['columns'][name]['type']
+    values = self.buffer(table, name, 'values')
+    if kind in ('q', 'd'):
+      return values
+    offsets = self.buffer(table, name, 'offsets')
+    if kind=='str':
+      data = values.tobytes()
+      return [data[offsets[row]:offsets[row+1]].decode('utf8', errors='surrogateescape') for row in range(len(offsets)-1)]
+    return [[self.dictionary[value] for value in values[offsets[row]:offsets[row+1]]] for row in range(len(offsets)-1)]
+
+def scan(paths, table, name):
+  """ Yields values of a column of table of all shards, one shard in memory at a time """
+  for path in paths:
+    yield from ShardReader(path).column(table, name)
+
+def kept_rows(readers):
+  """
+  Returns rows of repositories and of their files merged from every shard, None is all rows. A repository
+  processed again, like a failed one retried with --resume, has a row in more than one shard, and only its
+  last row in order of shards is kept with its files.
+  """
+  seen = set()
+  kept = [None]*len(readers)
+  for num in range(len(readers)-1, -1, -1):
+    urls = readers[num].column('repos', 'repository_url')
+    repos = []
+    for row in range(len(urls)-1, -1, -1):
+      if urls[row] not in seen:
+        seen.add(urls[row])
+        repos.append(row)
+    if len(repos)==len(urls):
+      continue
+    repos.reverse()
+    positions = {row: position for position, row in enumerate(repos)}
+    files = [row for row, repo in enumerate(readers[num].buffer('files', 'repo', 'values')) if repo in positions]
+    kept[num] = {'repos': repos, 'files': files, 'positions': positions}
+  return kept
+
+def selected_buffer(reader, table, name, buffer_name, rows):
+  """ Returns buffer of a column of shard with values of rows only, rows is None for all rows """
+  values = reader.buffer(table, name, buffer_name)
+  if rows is None:
+    return values
+  kind = reader.header['tables'][table]['columns'][name]['type']
+  if BUFFERS[kind][0] is None:
+    return array.array(values.typecode, (values[row] for row in rows))
+  offsets = values if buffer_name=='offsets' else reader.buffer(table, name, 'offsets')
+  selected = array.array(values.typecode, [0] if buffer_name=='offsets' else [])
+  for row in rows:
+    if buffer_name=='offsets':
+      selected.append(selected[-1]+offsets[row+1]-offsets[row])
+    else:
+      selected.extend(values[offsets[row]:offsets[row+1]])
+  return selected
+
+def selected_size(reader, table, name, buffer_name, rows):
+  """ Returns size in bytes of selected_buffer, reading only offsets of column """
+  info = reader.header['tables'][table]['columns'][name]
+  if rows is None:
+    return info[buffer_name][1]
+  offsets_type, values_type = BUFFERS[info['type']]
+  if buffer_name=='offsets':
+    return (len(rows)+1)*array.array(offsets_type).itemsize
+  if offsets_type is None:
+    return len(rows)*array.array(values_type).itemsize
+  offsets = reader.buffer(table, name, 'offsets')
+  return sum(offsets[row+1]-offsets[row] for row in rows)*array.array(values_type).itemsize
+
+def merge_shards(paths, output):
+  """
+  Writes all shards to one shard, one buffer of one shard in memory at a time. Buffers are copied, only
+  offsets, library ids and repository rows of files are changed. A repository in more than one shard keeps
+  its last row, see kept_rows. Returns number of repositories.
+  """
+  readers = [ShardReader(path) for path in paths]
+  if len(readers)==0:
+    return 0
+  kept = kept_rows(readers)
+  def rows(num, table):
+    return kept[num][table] if kept[num] is not None else None
+  def row_count(num, table):
+    return len(kept[num][table]) if kept[num] is not None else readers[num].rows(table)
+  dictionary = {}
+  translations = []
+  for reader in readers:
+    translations.append([dictionary.setdefault(library, len(dictionary)) for library in reader.dictionary])
+  header = {'byteorder': sys.byteorder, 'dictionary': sorted(dictionary, key=dictionary.get), 'tables': {}}
+  # every buffer has same size in output as sum of sizes of its kept rows in shards, except leading offset of every shard after first
+  buffers = []
+  offset = 0
+  for table, columns in TABLES.items():
+    header['tables'][table] = {'rows': sum(row_count(num, table) for num in range(len(readers))), 'columns': {}}
+    for name, kind in columns:
+      info = {'type': kind}
+      for buffer_name, typecode in zip(('offsets', 'values'), BUFFERS[kind]):
+        if typecode is None:
+          continue
+        size = sum(selected_size(reader, table, name, buffer_name, rows(num, table)) for num, reader in enumerate(readers))
+        if buffer_name=='offsets' and len(readers)>1:
+          size -= (len(readers)-1)*array.array(typecode).itemsize
+        info[buffer_name] = [offset, size]
+        buffers.append((table, name, kind, buffer_name))
+        offset += size
+      header['tables'][table]['columns'][name] = info
+  header_bytes = json.dumps(header).encode('utf8')
+  with open(output + '.tmp', 'wb') as f:
+    f.write(MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes)
+    for table, name, kind, buffer_name in buffers:
+      base = 0
+      for num, (reader, translation) in enumerate(zip(readers, translations)):
+        values = selected_buffer(reader, table, name, buffer_name, rows(num, table))
+        if buffer_name=='offsets':
+          count = values[-1]
+          if num>0:
+            values = array.array(values.typecode, (value+base for value in values[1:]))
+          base += count
+        elif kind=='libraries':
+          values = array.array(values.typecode, (translation[value] for value in values))
+        elif table=='files' and name=='repo':
+          positions = kept[num]['positions'] if kept[num] is not None else None
+          values = array.array(values.typecode, ((positions[value] if positions is not None else value)+base for value in values))
+          base += row_count(num, 'repos')
+        values.tofile(f)
+  os.replace(output + '.tmp', output)
+  return header['tables']['repos']['rows']
+
+# print tables, rows and columns of shards, or values of a column: python3 columnar.py <shards> [--column <table> <name>]
+if __name__=='__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('shards', nargs='+')
+  parser.add_argument('--column', nargs=2, metavar=('TABLE', 'NAME'))
+  args = parser.parse_args()
+  if args.column:
+    for value in scan(args.shards, *args.column):
+      print(json.dumps(value))
+  else:
+    for path in args.shards:
+      reader = ShardReader(path)
+      for table in TABLES:
+        print(f'{path} {table}: {reader.rows(table)} rows, columns {reader.columns(table)}')
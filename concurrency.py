@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+import shutil
+from time import time
+
+class AdaptiveLimit:
+  """ Semaphore of asyncio whose limit can be changed while it is used, and which can be paused """
+  def __init__(self, limit):
+    self.limit = limit
+    self.paused = False
+    self.active = 0
+    self.condition = asyncio.Condition()
+
+  async def acquire(self):
+    async with self.condition:
+      await self.condition.wait_for(lambda: not self.paused and self.active<self.limit)
+      self.active += 1
+
+  async def release(self):
+    async with self.condition:
+      self.active -= 1
+      self.condition.notify_all()
+
+  async def resize(self, limit, paused=False):
+    async with self.condition:
+      self.limit = limit
+      self.paused = paused
+      self.condition.notify_all()
+
+  async def __aenter__(self):
+    await self.acquire()
+    return self
+
+  async def __aexit__(self, *args):
+    await self.release()
+    return False
+
+class SystemSampler:
+  """
+  Returns cpu utilization and network bytes per second since last sample, and free disk space. cpu and
+  network are read from /proc on linux, load average is used for cpu elsewhere and network is None.
+  """
+  def __init__(self, path='.'):
+    self.path = path
+    self.last_cpu = self.cpu_times()
+    self.last_network = self.network_bytes()
+    self.last_time = time()
+
+  def cpu_times(self):
+    """ Returns idle and total cpu time, or None """
+    try:
+      with open('/proc/stat', 'r') as f:
+        values = [int(value) for value in f.readline().split()[1:]]
+    except (OSError, ValueError):
+      return None
+    # idle and iowait
+    return values[3]+values[4], sum(values)
+
+  def network_bytes(self):
+    """ Returns bytes received and sent by all interfaces except loopback, or None """
+    try:
+      with open('/proc/net/dev', 'r') as f:
+        lines = f.readlines()[2:]
+    except OSError:
+      return None
+    total = 0
+    for line in lines:
+      name, values = line.split(':', 1)
+      if name.strip()!='lo':
+        values = values.split()
+        total += int(values[0])+int(values[8])
+    return total
+
+  def sample(self):
+    now = time()
+    elapsed = max(now-self.last_time, 1e-6)
+    cpu_times = self.cpu_times()
+    if cpu_times is not None and self.last_cpu is not None and cpu_times[1]>self.last_cpu[1]:
+      cpu = 1-(cpu_times[0]-self.last_cpu[0])/(cpu_times[1]-self.last_cpu[1])
+    else:
+      cpu = min(1, os.getloadavg()[0]/os.cpu_count())
+    network_bytes = self.network_bytes()
+    network = None
+    if network_bytes is not None and self.last_network is not None:
+      network = (network_bytes-self.last_network)/elapsed
+    self.last_cpu, self.last_network, self.last_time = cpu_times, network_bytes, now
+    return {'cpu': cpu, 'network': network, 'free_disk': shutil.disk_usage(self.path).free}
+
+class ConcurrencyController:
+  """
+  Resizes clone and analysis limits every interval seconds. Cloning is paused while free disk is below
+  min_free_disk or max_pending cloned repositories wait for analysis. Otherwise one clone is added while all
+  clone slots are used and network throughput keeps growing, one is removed when it stops growing and then no
+  clone is added for hold intervals, and clones are halved when cpu is saturated and analysis falls behind.
+  Analyses are added while cpu is not busy and repositories are waiting, and removed when cpu is saturated
+  while no repository is waiting.
+  """
+  def __init__(self, clone_limit, analysis_limit, pending, max_clones, max_analyzers, max_pending, min_free_disk, interval=5, hold=6, path='.'):
+    self.clone_limit = clone_limit
+    self.analysis_limit = analysis_limit
+    self.pending = pending          # function returning number of cloned repositories waiting for analysis
+    self.max_clones = max_clones
+    self.max_analyzers = max_analyzers
+    self.max_pending = max_pending
+    self.min_free_disk = min_free_disk
+    self.interval = interval
+    self.hold = hold
+    self.hold_left = 0
+    self.sampler = SystemSampler(path)
+    self.last_network = None
+    self.increased = False
+
+  def decide(self, stats, pending, clones, active_clones, analyses):
+    """ Returns new clone limit, whether cloning is paused, and new analysis limit """
+    if stats['cpu']>0.95 and pending==0 and analyses>1:
+      # analysis is not behind, cpu is needed by git
+      analyses -= 1
+    elif stats['cpu']<0.8 and pending>0 and analyses<self.max_analyzers:
+      analyses += 1
+    paused = stats['free_disk']<self.min_free_disk or pending>=self.max_pending
+    network = stats['network']
+    if paused:
+      self.increased = False
+    elif pending>analyses and stats['cpu']>0.9:
+      # cloning faster would only fill disk with repositories waiting for cpu
+      clones = max(1, clones//2)
+      self.increased = False
+    elif active_clones>=clones:
+      if self.increased and network is not None and self.last_network is not None and network<self.last_network*1.05:
+        # last added clone did not give more throughput
+        clones = max(1, clones-1)
+        self.increased = False
+        self.hold_left = self.hold
+      elif self.hold_left>0:
+        self.hold_left -= 1
+      elif clones<self.max_clones:
+        clones += 1
+        self.increased = True
+    else:
+      self.increased = False
+    self.last_network = network
+    return clones, paused, analyses
+
+  async def adjust(self):
+    stats = self.sampler.sample()
+    pending = self.pending()
+    clones, paused, analyses = self.decide(stats, pending, self.clone_limit.limit, self.clone_limit.active, self.analysis_limit.limit)
+    if (clones, paused, analyses)!=(self.clone_limit.limit, self.clone_limit.paused, self.analysis_limit.limit):
+      network = 'unknown' if stats['network'] is None else f"{stats['network']/1024/1024:.1f}MB/s"
+      logging.info(f"Concurrency: clones {clones}{' paused' if paused else ''}, analyses {analyses} "
+        f"(cpu {stats['cpu']*100:.0f}%, network {network}, free disk {stats['free_disk']//(1024*1024)}MB, pending {pending})")
+    await self.clone_limit.resize(clones, paused)
+    await self.analysis_limit.resize(analyses)
+
+  async def run(self):
+    """ Adjusts limits till cancelled """
+    while True:
+      await asyncio.sleep(self.interval)
+      await self.adjust()
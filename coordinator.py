@@ -0,0 +1,161 @@
+import argparse
+import collections
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+from time import time
+
+# printed by script.py in batch mode after all results of a batch
+BATCH_DONE = 'batch done'
+
+class Batch:
+  def __init__(self, start, count):
+    self.start = start
+    self.count = count
+    self.workers = {}     # worker -> time when worker started batch
+    self.done = False
+
+class BatchCoordinator:
+  """
+  Hands out batches of urls to workers on demand. A batch of a worker which dies is given to another worker.
+  A batch running longer than straggler_factor times median duration of batches is also given to another worker,
+  and when no batch is left, idle workers run batches which are still running on other workers. Results of
+  whichever worker finishes first are used.
+  Coordinator does not keep which batches are done between runs, workers resume from their own journals, so
+  a batch given to another worker than in an earlier run is processed again in full.
+  """
+  def __init__(self, start, count, batch_size, on_results, max_attempts=2, straggler_factor=3):
+    self.batches = [Batch(i, min(batch_size, start+count-i)) for i in range(start, start+count, batch_size)]
+    self.pending = collections.deque(self.batches)
+    self.on_results = on_results
+    self.max_attempts = max_attempts
+    self.straggler_factor = straggler_factor
+    self.durations = []
+    self.results_count = {}
+    self.condition = threading.Condition()
+
+  def remaining(self):
+    return sum(1 for batch in self.batches if not batch.done)
+
+  def next_batch(self, worker):
+    """ Returns next batch for worker, or None if all batches are done """
+    with self.condition:
+      while True:
+        if self.remaining()==0:
+          return None
+        running = [batch for batch in self.batches if not batch.done and worker not in batch.workers and 0<len(batch.workers)<self.max_attempts]
+        if len(self.durations)>0:
+          limit = time()-self.straggler_factor*statistics.median(self.durations)
+          stragglers = [batch for batch in running if min(batch.workers.values())<limit]
+          if len(stragglers)>0:
+            batch = min(stragglers, key=lambda batch: min(batch.workers.values()))
+            batch.workers[worker] = time()
+            return batch
+        while len(self.pending)>0:
+          batch = self.pending.popleft()
+          if not batch.done:
+            batch.workers[worker] = time()
+            return batch
+        # run longest running batch again on this idle worker
+        if len(running)>0:
+          batch = min(running, key=lambda batch: min(batch.workers.values()))
+          batch.workers[worker] = time()
+          return batch
+        self.condition.wait(timeout=5)
+
+  def complete(self, batch, worker, lines):
+    """ Uses results of worker if batch is not already done by another worker """
+    with self.condition:
+      started = batch.workers.pop(worker, None)
+      if batch.done:
+        return
+      batch.done = True
+      if started is not None:
+        self.durations.append(time()-started)
+      self.results_count[worker] = self.results_count.get(worker, 0)+len(lines)
+      self.condition.notify_all()
+    self.on_results(worker, lines)
+
+  def fail(self, batch, worker):
+    """ Gives batch of a dead worker to other workers """
+    with self.condition:
+      batch.workers.pop(worker, None)
+      if not batch.done and len(batch.workers)==0:
+        self.pending.appendleft(batch)
+      self.condition.notify_all()
+
+  def run_worker(self, worker, stdin, stdout, close_input=None):
+    """ Sends batches to worker through its stdin and reads their results from its stdout till all batches are done """
+    batch = None
+    try:
+      while True:
+        batch = self.next_batch(worker)
+        if batch is None:
+          break
+        stdin.write(f'{batch.start} {batch.count}\n')
+        stdin.flush()
+        lines = []
+        while True:
+          line = stdout.readline()
+          if not line:
+            raise EOFError(f'Worker {worker} exited during batch {batch.start}')
+          if line.strip()==BATCH_DONE:
+            break
+          lines.append(line)
+        self.complete(batch, worker, lines)
+        batch = None
+    except Exception as e:
+      print(f"Worker {worker} failed with error: {e}")
+      if batch is not None:
+        self.fail(batch, worker)
+    finally:
+      try:
+        (close_input or stdin.close)()
+      except Exception:
+        pass
+
+def run_local_workers(num_workers, start, count, batch_size, on_results, script_args=(), directory='workers'):
+  """
+  Runs script.py in batch mode in num_workers local processes in place of instances. Every worker runs in
+  its own directory, which gets url_list.csv and libraries.json of current directory.
+  """
+  coordinator = BatchCoordinator(start, count, batch_size, on_results)
+  script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'script.py')
+  processes = []
+  threads = []
+  for num in range(num_workers):
+    cwd = os.path.join(directory, f'worker{num+1}')
+    os.makedirs(cwd, exist_ok=True)
+    for file in ('url_list.csv', 'libraries.json'):
+      if os.path.exists(file):
+        shutil.copy(file, cwd)
+    process = subprocess.Popen([sys.executable, script, str(num+1), str(batch_size), '--batches', *script_args], cwd=cwd,
+      stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+    processes.append(process)
+    thread = threading.Thread(target=coordinator.run_worker, args=(num+1, process.stdin, process.stdout))
+    thread.start()
+    threads.append(thread)
+  for thread in threads:
+    thread.join()
+  for process in processes:
+    process.wait()
+  return coordinator
+
+# run workers locally and print their results
+if __name__=='__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('num_workers', type=int)
+  parser.add_argument('start', type=int, help='index of first url')
+  parser.add_argument('count', type=int, help='number of urls')
+  parser.add_argument('--batch-size', type=int, default=10)
+  args, script_args = parser.parse_known_args()
+  print_lock = threading.Lock()
+  def print_results(worker, lines):
+    with print_lock:
+      sys.stdout.writelines(lines)
+      sys.stdout.flush()
+  coordinator = run_local_workers(args.num_workers, args.start, args.count, args.batch_size, print_results, script_args)
+  print(coordinator.results_count, file=sys.stderr)
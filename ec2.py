@@ -1,123 +1,315 @@
+import argparse
+import csv
+import glob
+import gzip
 import json
-import sys
+import shlex
+import shutil
 import threading
 import traceback
 import os
+from time import perf_counter
 
-import boto3
-import paramiko
-from scp import SCPClient
+from columnar import merge_shards
+from coordinator import BatchCoordinator
+from instance_backends import Ec2Backend, LocalBackend
+from metrics_cache import MetricsCache
+from repo_state import RepoState
+from result_sink import ResultSink
+from stage_metrics import fleet_summary
+from url_manifest import build_manifest
+
+# sent to every instance from directory of this file
+CODE_FILES = ['script.py', 'metrics_cache.py', 'coordinator.py', 'stage_metrics.py', 'git_store.py', 'repo_state.py', 'concurrency.py',
+  'file_filter.py', 'columnar.py', 'url_manifest.py', 'budget.py', 'profiling.py', 'libraries.json']
+CODE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 
 class ManageInstances:
-  def __init__(self, num_instances, size=100):
+  """ Runs script.py on num_instances instances of backend, ec2 instances by default, and collects their results """
+  def __init__(self, num_instances, size=100, cache=None, sink=None, resume=False, state=None, adaptive_clones=None, filter_files=False, columnar=False, budget=None, backend=None, profile=False):
     self.size = size
+    self.profile = profile
+    # options of script.py limiting every repository, by name without leading dashes
+    self.budget = budget or {}
+    self.columnar = columnar
+    self.filter_files = filter_files
+    self.adaptive_clones = adaptive_clones
+    self.resume = resume
+    self.cache = cache
+    self.state = state
     self.num_instances = num_instances
-    self.instance_ids = []
-    self.result = []
+    self.sink = sink or ResultSink()
     self.results_count = []
     self.lock = threading.Lock()
-    self.ssh_lock = threading.Lock()
-    self.client = boto3.client('ec2')
-    self.ec2 = boto3.resource('ec2')
-    self.get_instances()
-    self.wait_for_checks()
-
-  def get_instances(self):
-    print("Getting instances")
-    reservations = self.client.describe_instances()['Reservations']
-    for reservation in reservations:
-      for instance in reservation['Instances']:
-        if instance['State']['Name']!='terminated':
-          self.instance_ids.append(instance['InstanceId'])
-    self.instance_ids = self.instance_ids[0:self.num_instances]
-    # self.instance_ids = self.instance_ids[0:self.num_instances]
-    print("Got instances")
-
-  def wait_for_checks(self):
-    print("Waiting for checks")
-    self.client.start_instances(InstanceIds=self.instance_ids)
-    waiter = self.client.get_waiter('instance_status_ok')
-    waiter.wait()
-    print("Checks completed")
+    self.url_files = {}     # path and index of first url of file of urls of every instance
+    self.backend = backend if backend is not None else Ec2Backend()
+    self.backend.start(num_instances)
+
+  def write_url_files(self, batches=False):
+    """
+    Writes gzip compressed urls of every instance, which are only urls of its range. With batches any
+    instance can get any url, so all instances get a gzip compressed url manifest of all urls, where they read only urls
+    of their batches.
+    """
+    if batches:
+      # compressed for sending, instances decompress it once
+      build_manifest('url_list.csv', 'url_list.manifest.gz')
+      self.url_files = {instance_num: ('url_list.manifest.gz', 0) for instance_num in range(self.num_instances)}
+      return
+    with open('url_list.csv', 'r') as f:
+      urls = [url for row in csv.reader(f) for url in row]
+    for instance_num in range(self.num_instances):
+      # same range as script.py
+      start = instance_num*self.size+1
+      path = f'url_slice{instance_num+1}.csv.gz'
+      self.write_urls(path, urls[start:start+self.size])
+      self.url_files[instance_num] = (path, start)
+
+  def write_urls(self, path, urls):
+    with gzip.open(path, 'wt', newline='') as f:
+      writer = csv.writer(f)
+      for url in urls:
+        writer.writerow([url])
 
   def create_file(self):
-    print(f"result length: {len(self.result)}")
-    with open('result.json', 'w+') as f:
+    try:
+      print(f"result length: {self.sink.merge('result.json')}")
+    except:
+      print("Unable to dump data")
+      print(traceback.print_exc())
+    if self.columnar:
       try:
-        json.dump(self.result, f)
+        # columns are copied shard by shard, records are not decoded
+        print(f"columnar result length: {merge_shards(sorted(glob.glob('columns/instance*/*.rcol')), 'result.rcol')}")
       except:
-        print("Unable to dump data")
+        print("Unable to merge column shards")
+        print(traceback.print_exc())
 
-  def create_ssh_client(self, dns_name):
-    print("Creating ssh")
-    try:
-      self.ssh_lock.acquire()
-      ssh = paramiko.SSHClient()
-      ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-      ssh.connect(dns_name, username="ubuntu", key_filename="turing-data-processing.pem")
-    finally:
-      self.ssh_lock.release()
-      print("Ssh created")
-    return ssh
-
-  def send_files(self, ssh):
+  def send_files(self, session, instance_num):
     print("Sending files")
-    with SCPClient(ssh.get_transport()) as scp:
-      scp.put('script.py', 'script.py')
-      scp.put('url_list.csv', 'url_list.csv')
+    files = [os.path.join(CODE_DIRECTORY, name) for name in CODE_FILES] + [self.url_files[instance_num][0]]
+    if self.cache is not None:
+      # warm cache from earlier runs
+      files.append((self.cache.path, 'metrics_cache.db'))
+    if self.state is not None:
+      files.append((self.state.path, 'repo_state.db'))
+    session.send(files)
     print("Files sent")
 
-  def receive_files(self, files, ssh):
-    with SCPClient(ssh.get_transport()) as scp:
-      for file in files:
-        scp.get(file)
+  def instance_cache_path(self, instance_num):
+    return f'metrics_cache{instance_num+1}.db'
 
-  def append_to_result(self, result):
-    self.lock.acquire()
-    try:
-      self.result.extend(result)
-    finally:
-      self.lock.release()
-
-  def get_result(self, stdout):
-    result = []
-    while True:
-      line = stdout.readline()
-      if not line:
-        break
-      try:
-        result.append(json.loads(line.replace('\'','"')))
-      except:
-        print(line)
-        print(traceback.print_exc())
-    self.results_count.append(len(result))
-    self.append_to_result(result)
+  def merge_caches(self):
+    """ Adds results cached by every instance to local cache for next runs """
+    for instance_num in range(self.num_instances):
+      path = self.instance_cache_path(instance_num)
+      if os.path.exists(path):
+        try:
+          self.cache.merge(path)
+        except Exception as e:
+          print(f"Unable to merge cache {path}: {e}")
+        os.remove(path)
+    self.cache.checkpoint()
+
+  def instance_state_path(self, instance_num):
+    return f'repo_state{instance_num+1}.db'
+
+  def merge_states(self):
+    """ Updates local repository state with repositories analyzed by every instance """
+    for instance_num in range(self.num_instances):
+      path = self.instance_state_path(instance_num)
+      if os.path.exists(path):
+        try:
+          self.state.merge(path)
+        except Exception as e:
+          print(f"Unable to merge state {path}: {e}")
+        os.remove(path)
+    self.state.checkpoint()
+
+  def metrics_path(self, instance_num):
+    return f'instance{instance_num+1}.metrics.json'
+
+  def create_metrics_summary(self, filename='fleet_metrics.json'):
+    """ Writes summary of stage timings of repositories of all instances, with percentile latencies of every stage """
+    summary = fleet_summary([self.metrics_path(instance_num) for instance_num in range(self.num_instances)])
+    with open(filename, 'w') as f:
+      json.dump(summary, f, indent=2)
+    for stage, stats in summary['stages'].items():
+      print(f"{stage}: p50 {stats['p50']:.2f}s, p90 {stats['p90']:.2f}s, p99 {stats['p99']:.2f}s, total {stats['total']:.1f}s")
+    print(f"repos: {summary['repos']}, failed: {summary['failed']}, over budget: {summary['over budget']}, repos per minute: {summary['repos per minute']:.1f}")
+
+  def write_results(self, source, lines):
+    """ Writes json lines to file of source on disk, returns number of records written """
+    writer = self.sink.writer(source)
+    count = 0
+    for line in lines:
+      if writer.write(line):
+        count += 1
+      elif line.strip()!='':
+        print(f"Invalid result: {line}")
+    return count
+
+  def get_result(self, stdout, instance_num):
+    count = self.write_results(f'instance{instance_num+1}', iter(stdout.readline, ''))
+    with self.lock:
+      self.results_count.append(count)
+
+  def script_command(self, instance_num):
+    urls_file, urls_start = self.url_files[instance_num]
+    # path of python can have spaces, as sys.executable of local backend
+    command = f'{shlex.quote(self.backend.python)} script.py {instance_num+1} {self.size} --urls {urls_file} --urls-start {urls_start}'
+    if self.resume:
+      command += ' --resume'
+    if self.cache is not None:
+      command += f' --cache metrics_cache.db --cache-size {self.cache.max_bytes//(1024*1024)}'
+    if self.state is not None:
+      command += ' --state repo_state.db'
+    if self.adaptive_clones:
+      # instance finds how many clones and analyses it can run
+      command += f' --async-clones {self.adaptive_clones} --adaptive'
+    if self.filter_files:
+      command += ' --filter-files'
+    if self.columnar:
+      command += ' --columnar columns'
+    for name, value in self.budget.items():
+      command += f' --{name} {value}'
+    if self.profile:
+      command += ' --profile'
+    return command
+
+  def receive_instance_files(self, instance_num, session):
+    files = [f'instance{instance_num+1}.log', f'instance{instance_num+1}.journal', self.metrics_path(instance_num), f'instance{instance_num+1}.repos.ndjson',
+      f'instance{instance_num+1}.prom']
+    if self.cache is not None:
+      files.append(('metrics_cache.db', self.instance_cache_path(instance_num)))
+    if self.state is not None:
+      files.append(('repo_state.db', self.instance_state_path(instance_num)))
+    session.receive(files)
+    if self.columnar:
+      self.receive_directory(instance_num, session, 'columns')
+    if self.profile:
+      self.receive_directory(instance_num, session, 'profiles')
+
+  def receive_directory(self, instance_num, session, directory):
+    """ Downloads directory of instance, column shards or profiles, to <directory>/instance<num> """
+    local = os.path.join(directory, f'instance{instance_num+1}')
+    shutil.rmtree(local, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+    session.receive_directory(directory, local)
 
   def start_instance_processsing(self, instance_num):
     try:
-      instance = self.ec2.Instance(self.instance_ids[instance_num])
-      ssh = self.create_ssh_client(instance.public_dns_name)
-      self.send_files(ssh)
-      stdin, stdout, stderr = ssh.exec_command(f'python3 script.py {instance_num+1} {self.size}')
+      self.backend.wait_ready(instance_num)
+      session = self.backend.connect(instance_num)
+      self.send_files(session, instance_num)
+      command = session.run(self.script_command(instance_num))
       print("Command executed")
-      self.get_result(stdout)
-      self.receive_files([f'instance{instance_num+1}.log'], ssh)
-      ssh.close()
+      self.get_result(command.stdout, instance_num)
+      # files of instance are complete when script exits
+      command.wait()
+      self.receive_instance_files(instance_num, session)
+      session.close()
     except Exception as e:
-      print(f"Instance {instance.id} failed with error: {e}")
+      print(f"Instance {self.backend.name(instance_num)} failed with error: {e}")
       print(traceback.print_exc())
-    self.client.stop_instances(InstanceIds=[self.instance_ids[instance_num]])
+    self.backend.stop(instance_num)
+
+  def start_instance_batches(self, instance_num, coordinator):
+    """ Runs script in batch mode on instance, it processes batches given by coordinator till all are done """
+    try:
+      self.backend.wait_ready(instance_num)
+      session = self.backend.connect(instance_num)
+      self.send_files(session, instance_num)
+      command = session.run(self.script_command(instance_num) + ' --batches')
+      print("Command executed")
+      coordinator.run_worker(instance_num+1, command.stdin, command.stdout, command.close_input)
+      # script exits when its stdin is closed
+      command.wait()
+      self.receive_instance_files(instance_num, session)
+      session.close()
+    except Exception as e:
+      print(f"Instance {self.backend.name(instance_num)} failed with error: {e}")
+      print(traceback.print_exc())
+    self.backend.stop(instance_num)
+
+  def run(self, batch_size=None):
+    """
+    Runs script on all instances, with fixed ranges of urls or with batches of batch_size urls handed out by a
+    coordinator, and writes results and metrics summary. Returns seconds taken and number of results.
+    """
+    start = perf_counter()
+    self.write_url_files(bool(batch_size))
+    coordinator = None
+    if batch_size:
+      # same urls as fixed ranges of all instances
+      coordinator = BatchCoordinator(1, self.num_instances*self.size, batch_size, lambda worker, lines: self.write_results(f'instance{worker}', lines))
+    threads = []
+    for i in range(self.num_instances):
+      if coordinator is not None:
+        thread = threading.Thread(target=self.start_instance_batches, args=(i, coordinator))
+      else:
+        thread = threading.Thread(target=self.start_instance_processsing, args=(i,))
+      thread.start()
+      threads.append(thread)
+    for thread in threads:
+      thread.join()
+    elapsed = perf_counter()-start
+    self.create_file()
+    self.create_metrics_summary()
+    if self.cache is not None:
+      self.merge_caches()
+    if self.state is not None:
+      self.merge_states()
+    if coordinator is not None:
+      print(coordinator.results_count)
+      count = sum(coordinator.results_count.values())
+    else:
+      print(self.results_count)
+      count = sum(self.results_count)
+    print(f"{count} results in {elapsed:.1f}s, {count*3600/elapsed if elapsed>0 else 0:.0f} repos per hour")
+    return elapsed, count
 
 if __name__=='__main__':
-  num_instances = int(sys.argv[1])
-  size = int(sys.argv[2])
-  manager = ManageInstances(num_instances, size)
-  threads = []
-  for i in range(num_instances):
-    thread = threading.Thread(target=manager.start_instance_processsing, args=(i,))
-    thread.start()
-    threads.append(thread)
-  for thread in threads:
-    thread.join()
-  manager.create_file()
-  print(manager.results_count)
\ No newline at end of file
+  parser = argparse.ArgumentParser()
+  parser.add_argument('num_instances', type=int)
+  parser.add_argument('size', type=int)
+  parser.add_argument('--batch-size', type=int, help='hand out batches of this many urls to instances on demand in place of fixed ranges')
+  parser.add_argument('--resume', action='store_true', help='instances skip urls done in earlier run and retry failed ones')
+  parser.add_argument('--compression', choices=['gzip', 'zstd'], help='compress result files, zstd needs zstandard package')
+  parser.add_argument('--cache', help='file of metrics cache, sent to every instance and updated with their results')
+  parser.add_argument('--cache-size', type=int, default=1024, help='maximum size of metrics cache in MB')
+  parser.add_argument('--adaptive-clones', type=int, help='instances clone with asyncio and change concurrency while running, up to this many clones')
+  parser.add_argument('--state', help='file of repository state, sent to every instance and updated with their results')
+  parser.add_argument('--columnar', action='store_true', help='instances also write column shards with data of every file, merged into result.rcol')
+  parser.add_argument('--filter-files', action='store_true', help='instances leave out vendored directories, virtual environments, big and generated python files')
+  parser.add_argument('--max-repo-size', type=int, help='instances skip repositories taking more than this many MB on disk')
+  parser.add_argument('--analysis-cpu', type=int, help='instances skip repositories whose analysis takes more than this many cpu seconds')
+  parser.add_argument('--analysis-memory', type=int, help='instances skip repositories whose analysis needs more than this many MB of memory')
+  parser.add_argument('--analysis-timeout', type=int, help='instances skip repositories whose analysis takes more than this many seconds')
+  parser.add_argument('--profile', action='store_true', help='instances profile analysis, profiles of slowest repositories and files are downloaded to profiles/instance<num>')
+  parser.add_argument('--backend', choices=['ec2', 'local'], default='ec2', help='local runs instances as local processes, url_list.csv can have file:// urls')
+  parser.add_argument('--local-dir', default='fleet', help='with --backend local, directory of instances')
+  parser.add_argument('--local-cpus', type=int, help='with --backend local, cores of every instance')
+  parser.add_argument('--local-bandwidth', type=int, help='with --backend local, KB per second shared by clones of file:// urls of every instance')
+  args = parser.parse_args()
+  for name in ('max_repo_size', 'analysis_cpu', 'analysis_memory', 'analysis_timeout'):
+    # zero would silently turn a limit off
+    if getattr(args, name) is not None and getattr(args, name)<=0:
+      parser.error(f"--{name.replace('_', '-')} must be positive")
+  num_instances = args.num_instances
+  size = args.size
+  cache = None
+  if args.cache:
+    cache = MetricsCache(args.cache, args.cache_size*1024*1024)
+    cache.checkpoint()
+  state = None
+  if args.state:
+    state = RepoState(args.state)
+    state.checkpoint()
+  backend = None
+  if args.backend=='local':
+    backend = LocalBackend(args.local_dir, args.local_cpus, args.local_bandwidth*1024 if args.local_bandwidth else None)
+  manager = ManageInstances(num_instances, size, cache, ResultSink(compression=args.compression), args.resume, state, args.adaptive_clones, args.filter_files, args.columnar,
+    {name: value for name, value in [('max-repo-size', args.max_repo_size), ('analysis-cpu', args.analysis_cpu), ('analysis-memory', args.analysis_memory),
+      ('analysis-timeout', args.analysis_timeout)] if value is not None}, backend, args.profile)
+  manager.run(args.batch_size)
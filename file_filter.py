@@ -0,0 +1,63 @@
+import os
+
+# vendored code, virtual environments, build output and version control directories
+SKIP_DIRECTORIES = frozenset(['.git', '.hg', '.svn', '.tox', '.nox', '.venv', 'venv', 'virtualenv', 'site-packages', 'dist-packages',
+  'node_modules', 'bower_components', '__pycache__', '.eggs', 'build', 'dist', 'vendor', 'vendored', '_vendor', 'third_party'])
+
+# searched in first lines of a file, in lower case
+GENERATED_MARKERS = (b'do not edit', b'@generated', b'autogenerated', b'auto-generated', b'automatically generated', b'generated by')
+
+def skipped_counts():
+  """
+  Returns counts of files and directories left out of a repository by a filter. .git of a clone is left out but
+  not counted, so that counts are same for checked out and bare clones.
+  """
+  return {'files': 0, 'bytes': 0, 'directories': 0}
+
+class FileFilter:
+  """
+  Leaves out vendored directories and virtual environments, python files bigger than max_bytes, and generated
+  files, which have a marker in their first header_lines lines or a line longer than max_line_length in
+  their first head_bytes bytes. Only head of a file is read to find if it is generated.
+  """
+  def __init__(self, skip_directories=SKIP_DIRECTORIES, max_bytes=1024*1024, max_line_length=1000, header_lines=10, head_bytes=8192):
+    self.skip_directories = frozenset(skip_directories)
+    self.max_bytes = max_bytes
+    self.max_line_length = max_line_length
+    self.header_lines = header_lines
+    self.head_bytes = head_bytes
+
+  def skip_directory(self, name, path=None):
+    """ Returns True if directory is left out, path is given for directories on disk to find virtual environments of any name """
+    if name in self.skip_directories:
+      return True
+    return path is not None and os.path.exists(os.path.join(path, 'pyvenv.cfg'))
+
+  def too_large(self, size):
+    return self.max_bytes is not None and size>self.max_bytes
+
+  def generated(self, head):
+    """ Returns True if head, which is first bytes of a file, looks like a generated or minified file """
+    lines = head.split(b'\n')
+    header = b'\n'.join(lines[:self.header_lines]).lower()
+    if any(marker in header for marker in GENERATED_MARKERS):
+      return True
+    # last line may be cut, but it is only longer in whole file
+    return any(len(line)>self.max_line_length for line in lines)
+
+  def read_head(self, path):
+    with open(path, 'rb') as f:
+      return f.read(self.head_bytes)
+
+  def skip_file(self, path, size, skipped=None):
+    """ Returns True if python file on disk is left out, and adds it to skipped counts """
+    skip = self.too_large(size)
+    if not skip:
+      try:
+        skip = self.generated(self.read_head(path))
+      except OSError:
+        skip = False
+    if skip and skipped is not None:
+      skipped['files'] += 1
+      skipped['bytes'] += size
+    return skip
@@ -0,0 +1,112 @@
+import subprocess
+
+class BlobTooLarge(Exception):
+  def __init__(self, sha, size):
+    super().__init__(f'Object {sha} has {size} bytes')
+    self.size = size
+
+class BlobReader:
+  """ Reads contents of objects of a git repository through one long running git cat-file --batch process """
+  def __init__(self, git_dir):
+    self.process = subprocess.Popen(['git', '--git-dir', git_dir, 'cat-file', '--batch'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+  def read(self, sha, max_size=None):
+    """ Returns content of object, raises BlobTooLarge if it is bigger than max_size """
+    self.process.stdin.write(sha.encode() + b'\n')
+    self.process.stdin.flush()
+    # <hash> <type> <size>, or <hash> missing
+    header = self.process.stdout.readline().split()
+    if len(header)!=3:
+      raise ValueError(f'Object {sha} is not in repository')
+    size = int(header[2])
+    if max_size is not None and size>max_size:
+      # content is skipped in chunks, so that it is never in memory at once
+      left = size+1
+      while left>0:
+        left -= len(self.process.stdout.read(min(left, 1024*1024)))
+      raise BlobTooLarge(sha, size)
+    content = self.process.stdout.read(size)
+    # newline after content
+    self.process.stdout.read(1)
+    return content
+
+  def close(self):
+    self.process.stdin.close()
+    self.process.wait()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+    return False
+
+class GitBlob:
+  """ Python file of a git repository, read from object store when its content is needed """
+  def __init__(self, path, sha, reader):
+    self.path = path
+    self.sha = sha
+    self.reader = reader
+    self.content = None     # set while content which is already read is analyzed
+    self.size = None        # bytes of content, known after it is read
+
+  def read(self, max_size=None):
+    content = self.content
+    if content is None:
+      content = self.reader.read(self.sha, max_size)
+    self.size = len(content)
+    return content
+
+  def __str__(self):
+    return self.path
+
+def tree_files(git_dir, file_filter=None, skipped=None):
+  """
+  Returns path and hash of python files of last commit, and names of all directories and python files
+  without extension. Symbolic links and submodules are left out, and directories left out by file_filter,
+  which are counted in skipped.
+  """
+  output = subprocess.check_output(['git', '--git-dir', git_dir, 'ls-tree', '-r', '-z', 'HEAD'])
+  entries = []
+  for entry in output.split(b'\0'):
+    if not entry:
+      continue
+    # <mode> <type> <hash>\t<path>
+    info, path = entry.split(b'\t', 1)
+    mode, kind, sha = info.split()
+    entries.append((mode, kind, sha.decode(), path.decode('utf8', errors='surrogateescape').split('/')))
+  skipped_folders = set()
+  if file_filter is not None:
+    # virtual environments have pyvenv.cfg
+    skipped_folders = set('/'.join(parts[:-1]) for _, _, _, parts in entries if parts[-1]=='pyvenv.cfg' and len(parts)>1)
+  python_files = []
+  directories = set()
+  skipped_directories = set()
+  for mode, kind, sha, parts in entries:
+    folders = len(parts)-1
+    if file_filter is not None:
+      for depth in range(len(parts)-1):
+        folder = '/'.join(parts[:depth+1])
+        if folder in skipped_folders or file_filter.skip_directory(parts[depth]):
+          skipped_directories.add(folder)
+          folders = depth
+          break
+    directories.update(parts[:folders])
+    if folders<len(parts)-1:
+      continue
+    if kind==b'blob' and mode!=b'120000' and parts[-1].endswith('.py'):
+      python_files.append(('/'.join(parts), sha))
+      directories.add(parts[-1][:-3])
+  if skipped is not None:
+    skipped['directories'] += len(skipped_directories)
+  return python_files, directories
+
+def fetch_blobs(git_dir, shas):
+  """
+  Downloads objects of a partial clone in one request, instead of one request per object when they are read.
+  Returns return code of git.
+  """
+  process = subprocess.Popen(['git', '--git-dir', git_dir, '-c', 'fetch.negotiationAlgorithm=noop', 'fetch', '-q', '--no-tags',
+    '--no-write-fetch-head', '--recurse-submodules=no', '--filter=blob:none', 'origin', '--stdin'], stdin=subprocess.PIPE)
+  process.communicate(''.join(f'{sha}\n' for sha in shas).encode())
+  return process.returncode
@@ -0,0 +1,234 @@
+import fcntl
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+from time import sleep, time
+
+class Command:
+  """ script.py running on an instance, stdin and stdout are text files, close_input closes stdin and wait returns exit code """
+  def __init__(self, stdin, stdout, close_input, wait):
+    self.stdin = stdin
+    self.stdout = stdout
+    self.close_input = close_input
+    self.wait = wait
+
+class SshSession:
+  """ Connection to an instance, files, command and downloads all use channels of one ssh connection """
+  def __init__(self, ssh):
+    self.ssh = ssh
+
+  def send(self, files):
+    """ files is list of local paths, which keep their names, or (local path, remote path) """
+    from scp import SCPClient
+    with SCPClient(self.ssh.get_transport()) as scp:
+      # one transfer for all files which keep their names
+      scp.put([file for file in files if not isinstance(file, tuple)])
+      for file in files:
+        if isinstance(file, tuple):
+          scp.put(file[0], file[1])
+
+  def receive(self, files):
+    """ files is list of remote paths or (remote path, local path) """
+    from scp import SCPClient
+    with SCPClient(self.ssh.get_transport()) as scp:
+      for file in files:
+        if isinstance(file, tuple):
+          scp.get(file[0], file[1])
+        else:
+          scp.get(file)
+
+  def receive_directory(self, remote, local):
+    from scp import SCPClient
+    with SCPClient(self.ssh.get_transport()) as scp:
+      scp.get(remote, local, recursive=True)
+
+  def run(self, command):
+    stdin, stdout, stderr = self.ssh.exec_command(command)
+    return Command(stdin, stdout, stdin.channel.shutdown_write, stdout.channel.recv_exit_status)
+
+  def close(self):
+    self.ssh.close()
+
+class Ec2Backend:
+  """ Runs instances on ec2 instances of account which are not terminated, and connects to them with ssh """
+  python = 'python3'
+
+  def __init__(self, key_filename='turing-data-processing.pem', username='ubuntu'):
+    # optional dependencies, not needed by local backend
+    import boto3
+    self.key_filename = key_filename
+    self.username = username
+    self.client = boto3.client('ec2')
+    self.ec2 = boto3.resource('ec2')
+    self.instance_ids = []
+
+  def start(self, num_instances):
+    """ Starts num_instances instances at once, without waiting for them """
+    print("Getting instances")
+    reservations = self.client.describe_instances()['Reservations']
+    for reservation in reservations:
+      for instance in reservation['Instances']:
+        if instance['State']['Name']!='terminated':
+          self.instance_ids.append(instance['InstanceId'])
+    self.instance_ids = self.instance_ids[0:num_instances]
+    print("Got instances")
+    print("Starting instances")
+    self.client.start_instances(InstanceIds=self.instance_ids)
+
+  def name(self, instance_num):
+    return self.instance_ids[instance_num]
+
+  def wait_ready(self, instance_num):
+    """ Waits till status checks of one instance pass, so that work starts on every instance as soon as it is ready """
+    instance_id = self.instance_ids[instance_num]
+    waiter = self.client.get_waiter('instance_status_ok')
+    waiter.wait(InstanceIds=[instance_id])
+    print(f"Checks completed for {instance_id}")
+
+  def connect(self, instance_num, attempts=5):
+    """ Connects to instance, retrying while its ssh server is starting """
+    import paramiko
+    dns_name = self.ec2.Instance(self.instance_ids[instance_num]).public_dns_name
+    print(f"Creating ssh to {dns_name}")
+    for attempt in range(attempts):
+      try:
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect(dns_name, username=self.username, key_filename=self.key_filename, timeout=30)
+        # long runs send no data on connection while script works, keep it open through firewalls
+        ssh.get_transport().set_keepalive(60)
+        print(f"Ssh created to {dns_name}")
+        return SshSession(ssh)
+      except (paramiko.SSHException, OSError) as e:
+        if attempt==attempts-1:
+          raise
+        print(f"Unable to connect to {dns_name}: {e}, retrying")
+        sleep(10)
+
+  def stop(self, instance_num):
+    self.client.stop_instances(InstanceIds=[self.instance_ids[instance_num]])
+
+class LocalSession:
+  """ Instance of local backend, a directory where script.py runs as a local process """
+  def __init__(self, directory, env=None, cpus=None):
+    self.directory = directory
+    self.env = env
+    self.cpus = cpus
+    self.process = None
+
+  def send(self, files):
+    for file in files:
+      local, remote = file if isinstance(file, tuple) else (file, os.path.basename(file))
+      shutil.copy(local, os.path.join(self.directory, remote))
+
+  def receive(self, files):
+    for file in files:
+      remote, local = file if isinstance(file, tuple) else (file, os.path.basename(file))
+      shutil.copy(os.path.join(self.directory, remote), local)
+
+  def receive_directory(self, remote, local):
+    shutil.copytree(os.path.join(self.directory, remote), local)
+
+  def run(self, command):
+    # same command as on an instance, split as shell of instance splits it but run without shell
+    with open(os.path.join(self.directory, 'stderr.log'), 'a') as stderr:
+      self.process = subprocess.Popen(shlex.split(command), cwd=self.directory, env=self.env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=stderr, universal_newlines=True)
+    if self.cpus is not None:
+      # git and analyzer processes started by script inherit it
+      os.sched_setaffinity(self.process.pid, self.cpus)
+    return Command(self.process.stdin, self.process.stdout, self.process.stdin.close, self.process.wait)
+
+  def close(self):
+    if self.process is not None and self.process.poll() is None:
+      self.process.kill()
+      self.process.wait()
+
+class LocalBackend:
+  """
+  Runs instances as local processes, every one in directory/instance<num>, for capacity planning and tests
+  without ec2. url_list.csv can have file:// urls of local repositories. Every instance can be limited
+  to cpus cores, and clones of file:// urls of an instance to share bandwidth bytes per second.
+  """
+  python = sys.executable
+
+  def __init__(self, directory='fleet', cpus=None, bandwidth=None):
+    self.directory = os.path.abspath(directory)
+    self.cpus = cpus
+    self.bandwidth = bandwidth
+    self.num_instances = 0
+
+  def start(self, num_instances):
+    self.num_instances = num_instances
+    for instance_num in range(num_instances):
+      os.makedirs(self.instance_directory(instance_num), exist_ok=True)
+
+  def name(self, instance_num):
+    return f'local instance {instance_num+1}'
+
+  def instance_directory(self, instance_num):
+    return os.path.join(self.directory, f'instance{instance_num+1}')
+
+  def wait_ready(self, instance_num):
+    pass
+
+  def instance_cpus(self, instance_num):
+    """ Returns cores of instance, instances get next cores in turn """
+    if self.cpus is None or not hasattr(os, 'sched_setaffinity'):
+      return None
+    cores = sorted(os.sched_getaffinity(0))
+    return {cores[(instance_num*self.cpus+num)%len(cores)] for num in range(self.cpus)}
+
+  def instance_env(self, instance_num):
+    """
+    Returns environment of script of instance. With bandwidth, git reads file:// urls through ext:: transport
+    of throttle, where all clones of instance wait for their turn on one link.
+    """
+    if self.bandwidth is None:
+      return None
+    link = os.path.join(self.instance_directory(instance_num), 'bandwidth.link')
+    # ext:: splits command on spaces, '% ' is a space, %S is git-upload-pack, and rest of url is path of repository
+    helper = ' '.join(part.replace('%', '%%').replace(' ', '% ') for part in (self.python, os.path.abspath(__file__), 'throttle', str(self.bandwidth), link))
+    return dict(os.environ, GIT_CONFIG_COUNT='2', GIT_CONFIG_KEY_0=f'url.ext::{helper} %S /.insteadOf', GIT_CONFIG_VALUE_0='file:///',
+      GIT_CONFIG_KEY_1='protocol.ext.allow', GIT_CONFIG_VALUE_1='always')
+
+  def connect(self, instance_num):
+    return LocalSession(self.instance_directory(instance_num), self.instance_env(instance_num), self.instance_cpus(instance_num))
+
+  def stop(self, instance_num):
+    pass
+
+def throttle(bandwidth, link, command):
+  """
+  Runs command, which is git-upload-pack, and copies its output to stdout at bandwidth bytes per second
+  shared by all throttles of link. Link file has time when link is free, and every chunk reserves its time.
+  """
+  process = subprocess.Popen(command, stdout=subprocess.PIPE)
+  output = sys.stdout.buffer
+  with open(link, 'a+') as f:
+    while True:
+      data = process.stdout.read1(65536)
+      if not data:
+        break
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+        f.seek(0)
+        free = max(float(f.read() or 0), time())+len(data)/bandwidth
+        f.seek(0)
+        f.truncate()
+        f.write(str(free))
+        f.flush()
+      finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+      sleep(max(0, free-time()))
+      output.write(data)
+      output.flush()
+  return process.wait()
+
+# run by git as ext:: transport of local backend: python3 instance_backends.py throttle <bytes per second> <link file> <command>
+if __name__=='__main__':
+  if len(sys.argv)<5 or sys.argv[1]!='throttle':
+    sys.exit('usage: instance_backends.py throttle <bytes per second> <link file> <command>')
+  sys.exit(throttle(int(sys.argv[2]), sys.argv[3], sys.argv[4:]))
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+# change it whenever results of get_data_for_file change, so that old entries are not used
+CACHE_VERSION = 2
+
+def file_sha(path, chunk_size=1024*1024):
+  """ Returns git blob hash of a file, reading it in chunks """
+  sha = hashlib.sha1(b'blob %d\0' % os.path.getsize(path))
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+      sha.update(chunk)
+  return sha.hexdigest()
+
+class MetricsCache:
+  """
+  Cache of get_data_for_file results on disk, keyed by git blob hash of file. Least recently used entries are
+  evicted when size of cache goes above max_bytes. It can be shared by threads and processes. Last use of an
+  entry is written once per process, when it is flushed after its first hit, so that hits do not write.
+  """
+  def __init__(self, path, max_bytes=1024*1024*1024):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.version = str(CACHE_VERSION)
+    self.puts = 0
+    self.hits = 0
+    self.misses = 0
+    self.local = threading.local()
+    self.stats_lock = threading.Lock()
+    self.used = set()       # hashes of hits whose last use is not written yet
+    self.written = set()    # hashes whose last use is written by this process
+    self.create_tables()
+
+  def __getstate__(self):
+    # connections can not be sent to other processes
+    state = self.__dict__.copy()
+    del state['local']
+    del state['stats_lock']
+    del state['used']
+    del state['written']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.local = threading.local()
+    self.stats_lock = threading.Lock()
+    self.used = set()
+    self.written = set()
+
+  def connection(self):
+    """ Returns connection of current thread """
+    if getattr(self.local, 'connection', None) is None:
+      connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+      connection.execute('PRAGMA journal_mode=WAL')
+      connection.execute('PRAGMA synchronous=NORMAL')
+      self.local.connection = connection
+    return self.local.connection
+
+  def create_tables(self):
+    connection = self.connection()
+    connection.execute('CREATE TABLE IF NOT EXISTS metrics (sha TEXT PRIMARY KEY, data TEXT, size INTEGER, last_used INTEGER)')
+    connection.execute('CREATE INDEX IF NOT EXISTS metrics_last_used ON metrics (last_used)')
+    connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+    connection.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)')
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+      row = connection.execute("SELECT value FROM meta WHERE name='version'").fetchone()
+      if row is None or row[0]!=self.version:
+        # results of older analyzer can not be used
+        connection.execute('DELETE FROM metrics')
+        connection.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.version,))
+      connection.execute('COMMIT')
+    except:
+      connection.execute('ROLLBACK')
+      raise
+
+  def next_use(self, connection):
+    """ Returns a number larger than last_used of every entry """
+    row = connection.execute('SELECT MAX(last_used) FROM metrics').fetchone()
+    return (row[0] or 0)+1
+
+  def get(self, sha):
+    """ Returns cached result for blob hash or None """
+    connection = self.connection()
+    row = connection.execute('SELECT data FROM metrics WHERE sha=?', (sha,)).fetchone()
+    with self.stats_lock:
+      if row is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      if sha not in self.written:
+        self.used.add(sha)
+    return json.loads(row[0])
+
+  def put(self, sha, data):
+    data = json.dumps(data)
+    connection = self.connection()
+    connection.execute('INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?)', (sha, data, len(sha)+len(data), self.next_use(connection)))
+    self.puts += 1
+    if self.puts%1000==0:
+      self.evict()
+
+  def size(self):
+    """ Returns total size of entries in bytes """
+    return self.connection().execute('SELECT COALESCE(SUM(size), 0) FROM metrics').fetchone()[0]
+
+  def evict(self):
+    """ Deletes least recently used entries till size of cache is below 90% of max_bytes """
+    connection = self.connection()
+    size = self.size()
+    if size<=self.max_bytes:
+      return
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+      for sha, entry_size in connection.execute('SELECT sha, size FROM metrics ORDER BY last_used').fetchall():
+        if size<=self.max_bytes*0.9:
+          break
+        connection.execute('DELETE FROM metrics WHERE sha=?', (sha,))
+        size -= entry_size
+      connection.execute('COMMIT')
+    except:
+      connection.execute('ROLLBACK')
+      raise
+
+  def flush(self):
+    """ Writes last use of entries first used since last flush, and adds hits and misses counted in this process to totals in cache file """
+    with self.stats_lock:
+      hits, misses = self.hits, self.misses
+      self.hits = self.misses = 0
+      used = self.used
+      self.written.update(used)
+      self.used = set()
+    connection = self.connection()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+      if used:
+        last_used = self.next_use(connection)
+        connection.executemany('UPDATE metrics SET last_used=? WHERE sha=?', ((last_used, sha) for sha in used))
+      for name, value in (('hits', hits), ('misses', misses)):
+        connection.execute('INSERT OR IGNORE INTO stats VALUES (?, 0)', (name,))
+        connection.execute('UPDATE stats SET value=value+? WHERE name=?', (value, name))
+      connection.execute('COMMIT')
+    except:
+      connection.execute('ROLLBACK')
+      raise
+
+  def stats(self):
+    """ Returns total hits and misses of all processes using cache file """
+    stats = dict(self.connection().execute('SELECT name, value FROM stats').fetchall())
+    return stats.get('hits', 0), stats.get('misses', 0)
+
+  def reset_stats(self):
+    self.connection().execute('DELETE FROM stats')
+
+  def merge(self, path):
+    """ Adds entries of another cache file which are not in this cache """
+    connection = self.connection()
+    connection.execute('ATTACH DATABASE ? AS other', (path,))
+    try:
+      row = connection.execute("SELECT value FROM other.meta WHERE name='version'").fetchone()
+      if row is not None and row[0]==self.version:
+        last_used = self.next_use(connection)
+        connection.execute('INSERT OR IGNORE INTO metrics SELECT sha, data, size, last_used+? FROM other.metrics', (last_used,))
+    finally:
+      connection.execute('DETACH DATABASE other')
+    self.evict()
+
+  def checkpoint(self):
+    """ Moves write ahead log into cache file, so that file can be copied alone """
+    self.connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+  def close(self):
+    self.flush()
+    if getattr(self.local, 'connection', None) is not None:
+      self.local.connection.close()
+      self.local.connection = None
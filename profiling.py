@@ -0,0 +1,173 @@
+import argparse
+import cProfile
+import glob
+import heapq
+import itertools
+import json
+import marshal
+import os
+import pstats
+import threading
+from time import thread_time
+
+# one profiler can be active in a process from python 3.12, so threads profile one repository at a time
+profiler_lock = threading.Lock()
+
+class RepoProfile:
+  """
+  cProfile stats of analysis of one repository, and of its k slowest files with their sizes. Every file has its
+  own profiler, whose stats are also added to stats of repository. Stats are kept as marshal data of pstats,
+  which is the format of pstats files, so that a profile can be sent from an analyzer process. Repositories and
+  files are ranked by cpu time of their thread, which does not include waiting for other threads. A repository
+  analyzed while another thread profiles is only timed, and has no stats.
+  """
+  def __init__(self, url, k=10):
+    self.url = url
+    self.k = k
+    self.seconds = 0
+    self.files_count = 0
+    self.lines = 0
+    self.bytes = 0
+    self.stats = None
+    self.files = []     # heap of (seconds, number of file, info, stats or None) of slowest files
+    self.profiler = None
+    self.merged = None
+
+  def repo(self, function, *args):
+    """ Runs function analyzing repository with a profiler, or only timing it if another thread profiles, returns its result """
+    if not profiler_lock.acquire(blocking=False):
+      start = thread_time()
+      try:
+        return function(*args)
+      finally:
+        self.seconds = thread_time()-start
+    try:
+      self.profiler = cProfile.Profile()
+      start = thread_time()
+      self.profiler.enable()
+      try:
+        return function(*args)
+      finally:
+        self.profiler.disable()
+        self.seconds = thread_time()-start
+        self.add_stats(self.profiler)
+        self.stats = marshal.dumps(self.merged.stats)
+        self.profiler = None
+        self.merged = None
+    finally:
+      profiler_lock.release()
+
+  def file(self, path, size, function, *args):
+    """ Runs function analyzing file at path with its own profiler and returns its result, which is data of file. size is bytes of file or a function returning it """
+    profiler = None
+    if self.profiler is not None:
+      # one profiler is active at a time
+      self.profiler.disable()
+      profiler = cProfile.Profile()
+    start = thread_time()
+    if profiler is not None:
+      profiler.enable()
+    try:
+      data = function(*args)
+    finally:
+      if profiler is not None:
+        profiler.disable()
+      seconds = thread_time()-start
+      if profiler is not None:
+        self.profiler.enable()
+    size = size() if callable(size) else size
+    self.files_count += 1
+    self.lines += data[1]
+    self.bytes += size or 0
+    stats = self.add_stats(profiler) if profiler is not None else None
+    if len(self.files)<self.k or seconds>self.files[0][0]:
+      info = {'url': self.url, 'path': str(path), 'seconds': seconds, 'bytes': size, 'lines': data[1]}
+      entry = (seconds, self.files_count, info, marshal.dumps(stats.stats) if stats is not None else None)
+      if len(self.files)<self.k:
+        heapq.heappush(self.files, entry)
+      else:
+        heapq.heapreplace(self.files, entry)
+    return data
+
+  def add_stats(self, profiler):
+    """ Adds stats of profiler to stats of repository, returns stats of profiler """
+    stats = pstats.Stats(profiler)
+    if self.merged is None:
+      self.merged = pstats.Stats(profiler)
+    else:
+      self.merged.add(stats)
+    return stats
+
+  def info(self):
+    return {'url': self.url, 'seconds': self.seconds, 'files': self.files_count, 'lines': self.lines, 'bytes': self.bytes}
+
+class SlowestProfiles:
+  """
+  Keeps profiles of k slowest repositories and k slowest files of all repositories, and writes them to
+  directory as pstats files, with profiles.json listing them from slowest with their cpu time and sizes.
+  Entries which were only timed have no pstats file.
+  It can be shared by threads.
+  """
+  def __init__(self, directory, k=10):
+    self.directory = directory
+    self.k = k
+    self.repos = []
+    self.files = []
+    self.counter = itertools.count()
+    self.lock = threading.Lock()
+
+  def push(self, heap, seconds, info, stats):
+    entry = (seconds, next(self.counter), info, stats)
+    if len(heap)<self.k:
+      heapq.heappush(heap, entry)
+    elif seconds>heap[0][0]:
+      heapq.heapreplace(heap, entry)
+
+  def add(self, profile, info=None):
+    """ Adds profile of a repository, info is added to its entry """
+    with self.lock:
+      self.push(self.repos, profile.seconds, dict(profile.info(), **(info or {})), profile.stats)
+      for seconds, _, file_info, stats in profile.files:
+        self.push(self.files, seconds, file_info, stats)
+
+  def write(self):
+    """ Replaces profiles written before in directory with profiles kept """
+    with self.lock:
+      repos = sorted(self.repos, reverse=True)
+      files = sorted(self.files, reverse=True)
+    os.makedirs(self.directory, exist_ok=True)
+    for path in glob.glob(os.path.join(self.directory, 'repo[0-9]*.prof')) + glob.glob(os.path.join(self.directory, 'file[0-9]*.prof')):
+      os.remove(path)
+    index = {}
+    for kind, entries in (('repos', repos), ('files', files)):
+      index[kind] = []
+      for rank, (seconds, _, info, stats) in enumerate(entries):
+        name = None
+        if stats is not None:
+          name = f'{kind[:-1]}{rank+1:03d}.prof'
+          with open(os.path.join(self.directory, name), 'wb') as f:
+            f.write(stats)
+        index[kind].append(dict(info, profile=name))
+    with open(os.path.join(self.directory, 'profiles.json'), 'w') as f:
+      json.dump(index, f, indent=2)
+
+def print_profiles(directory, top=10):
+  """ Prints slowest repositories and files of a profiles directory with functions taking most time in each """
+  with open(os.path.join(directory, 'profiles.json'), 'r') as f:
+    index = json.load(f)
+  for kind in ('repos', 'files'):
+    for info in index[kind]:
+      name = info['url'] if kind=='repos' else f"{info['url']} {info['path']}"
+      print(f"{info['seconds']:.3f}s {info['lines']} lines {info['bytes']} bytes {name}")
+      if info['profile'] is None:
+        print('only timed, analyzed while another repository was profiled\n')
+        continue
+      pstats.Stats(os.path.join(directory, info['profile'])).sort_stats('cumulative').print_stats(top)
+
+# print profiles of script.py --profile: python3 profiling.py <directory> [--top 10]
+if __name__=='__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('directory')
+  parser.add_argument('--top', type=int, default=10, help='functions printed of every profile')
+  args = parser.parse_args()
+  print_profiles(args.directory, args.top)
@@ -0,0 +1,103 @@
+import json
+import sqlite3
+import threading
+from time import time
+
+from metrics_cache import CACHE_VERSION
+
+class RepoState:
+  """
+  Last analyzed commit of every repository with its result and data of its python files. Later runs skip
+  repositories whose last commit is not changed, and analyze only changed files of other repositories.
+  """
+  def __init__(self, path):
+    self.path = path
+    self.version = str(CACHE_VERSION)
+    self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+    self.connection.execute('PRAGMA journal_mode=WAL')
+    self.lock = threading.Lock()
+    self.create_tables()
+
+  def create_tables(self):
+    with self.lock:
+      self.connection.execute('CREATE TABLE IF NOT EXISTS repos (url TEXT PRIMARY KEY, commit_sha TEXT, data TEXT, analyzed REAL)')
+      self.connection.execute('CREATE TABLE IF NOT EXISTS files (url TEXT, path TEXT, sha TEXT, data TEXT, PRIMARY KEY (url, path))')
+      self.connection.execute('CREATE INDEX IF NOT EXISTS files_sha ON files (url, sha)')
+      self.connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+      self.connection.execute('BEGIN IMMEDIATE')
+      try:
+        row = self.connection.execute("SELECT value FROM meta WHERE name='version'").fetchone()
+        if row is None or row[0]!=self.version:
+          # data of files from older analyzer can not be used
+          self.connection.execute('DELETE FROM repos')
+          self.connection.execute('DELETE FROM files')
+          self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.version,))
+        self.connection.execute('COMMIT')
+      except:
+        self.connection.execute('ROLLBACK')
+        raise
+
+  def repo(self, url):
+    """ Returns analyzed commit and result of repository, or None if it is not analyzed before """
+    with self.lock:
+      row = self.connection.execute('SELECT commit_sha, data FROM repos WHERE url=?', (url,)).fetchone()
+    if row is None:
+      return None
+    return row[0], json.loads(row[1])
+
+  def files(self, url):
+    """ Returns data of python files of repository by their blob hash """
+    with self.lock:
+      rows = self.connection.execute('SELECT sha, data FROM files WHERE url=?', (url,)).fetchall()
+    return {sha: json.loads(data) for sha, data in rows}
+
+  def file_rows(self, url):
+    """ Returns path, hash and data of every python file of repository """
+    with self.lock:
+      rows = self.connection.execute('SELECT path, sha, data FROM files WHERE url=?', (url,)).fetchall()
+    return [(path, sha, json.loads(data)) for path, sha, data in rows]
+
+  def save(self, url, commit, data, rows):
+    """ Replaces state of repository, rows are (hash, data) of its python files by path """
+    with self.lock:
+      self.connection.execute('BEGIN IMMEDIATE')
+      try:
+        self.connection.execute('INSERT OR REPLACE INTO repos VALUES (?, ?, ?, ?)', (url, commit, json.dumps(data), time()))
+        self.connection.execute('DELETE FROM files WHERE url=?', (url,))
+        self.connection.executemany('INSERT INTO files VALUES (?, ?, ?, ?)', ((url, path, sha, json.dumps(file_data)) for path, (sha, file_data) in rows.items()))
+        self.connection.execute('COMMIT')
+      except:
+        self.connection.execute('ROLLBACK')
+        raise
+
+  def merge(self, path):
+    """ Replaces state of repositories with their state in another state file where it is analyzed later """
+    with self.lock:
+      self.connection.execute('ATTACH DATABASE ? AS other', (path,))
+      try:
+        row = self.connection.execute("SELECT value FROM other.meta WHERE name='version'").fetchone()
+        if row is not None and row[0]==self.version:
+          self.connection.execute('BEGIN IMMEDIATE')
+          try:
+            # other file also has unchanged copies of repositories which it got from this file
+            self.connection.execute('''CREATE TEMP TABLE newer AS SELECT other.repos.url FROM other.repos LEFT JOIN main.repos
+              ON main.repos.url=other.repos.url WHERE main.repos.url IS NULL OR other.repos.analyzed>main.repos.analyzed''')
+            self.connection.execute('DELETE FROM files WHERE url IN (SELECT url FROM temp.newer)')
+            self.connection.execute('INSERT OR REPLACE INTO repos SELECT * FROM other.repos WHERE url IN (SELECT url FROM temp.newer)')
+            self.connection.execute('INSERT INTO files SELECT * FROM other.files WHERE url IN (SELECT url FROM temp.newer)')
+            self.connection.execute('DROP TABLE temp.newer')
+            self.connection.execute('COMMIT')
+          except:
+            self.connection.execute('ROLLBACK')
+            raise
+      finally:
+        self.connection.execute('DETACH DATABASE other')
+
+  def checkpoint(self):
+    """ Moves write ahead log into state file, so that file can be copied alone """
+    with self.lock:
+      self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+  def close(self):
+    with self.lock:
+      self.connection.close()
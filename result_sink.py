@@ -0,0 +1,139 @@
+import gzip
+import json
+import os
+import threading
+from time import time
+
+EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+def open_file(path, mode, compression):
+  """ Opens file for writing ('wb') or reading ('rb'), compressed with gzip or zstd if given """
+  raw = open(path, mode)
+  if compression=='gzip':
+    return raw, gzip.GzipFile(fileobj=raw, mode=mode)
+  if compression=='zstd':
+    # optional dependency, only needed when zstd compression is used
+    import zstandard
+    if 'w' in mode:
+      return raw, zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+    return raw, zstandard.ZstdDecompressor().stream_reader(raw, closefd=False)
+  return raw, raw
+
+def read_lines(file, chunk_size=1024*1024):
+  """
+  Yields complete lines of a binary file object, also of zstd readers which do not support readline. A part
+  left by a crashed writer ends in a truncated stream or record, lines before them are yielded.
+  """
+  # read1 returns data decompressed so far, read loses whole chunk when stream is truncated
+  read = getattr(file, 'read1', file.read)
+  rest = b''
+  while True:
+    try:
+      chunk = read(chunk_size)
+    except EOFError:
+      break
+    if not chunk:
+      break
+    lines = (rest + chunk).split(b'\n')
+    rest = lines.pop()
+    for line in lines:
+      yield line
+
+class PartWriter:
+  """ Writes results of one source to its own file. It should be used by one thread """
+  def __init__(self, path, compression, fsync_every, fsync_interval):
+    self.path = path
+    self.raw, self.file = open_file(path, 'wb', compression)
+    self.fsync_every = fsync_every
+    self.fsync_interval = fsync_interval
+    self.count = 0
+    self.unsynced = 0
+    self.last_sync = time()
+
+  def write(self, line):
+    """ Writes line if it is a json record. Returns False for invalid lines """
+    line = line.strip()
+    try:
+      json.loads(line)
+    except ValueError:
+      return False
+    self.file.write(line.encode('utf8') + b'\n')
+    self.count += 1
+    self.unsynced += 1
+    if self.unsynced>=self.fsync_every or time()-self.last_sync>=self.fsync_interval:
+      self.sync()
+    return True
+
+  def sync(self):
+    """ Makes written records durable on disk """
+    if self.file is not self.raw:
+      self.file.flush()
+    self.raw.flush()
+    os.fsync(self.raw.fileno())
+    self.unsynced = 0
+    self.last_sync = time()
+
+  def close(self):
+    if self.raw.closed:
+      return
+    if self.file is not self.raw:
+      self.file.close()
+    self.raw.flush()
+    os.fsync(self.raw.fileno())
+    self.raw.close()
+
+class ResultSink:
+  """
+  Streams json lines of results to files on disk, one file per source. Records are not kept in memory, and
+  files are synced to disk after every fsync_every records or fsync_interval seconds.
+  """
+  def __init__(self, directory='results', compression=None, fsync_every=100, fsync_interval=5):
+    if compression not in EXTENSIONS:
+      raise ValueError(f'Unknown compression: {compression}')
+    self.directory = directory
+    self.compression = compression
+    self.fsync_every = fsync_every
+    self.fsync_interval = fsync_interval
+    self.writers = {}
+    self.lock = threading.Lock()
+    os.makedirs(directory, exist_ok=True)
+
+  def writer(self, source):
+    """ Returns writer of source, creating its file on first use """
+    with self.lock:
+      if source not in self.writers:
+        path = os.path.join(self.directory, f'part-{source}.ndjson{EXTENSIONS[self.compression]}')
+        self.writers[source] = PartWriter(path, self.compression, self.fsync_every, self.fsync_interval)
+      return self.writers[source]
+
+  def close(self):
+    with self.lock:
+      for writer in self.writers.values():
+        writer.close()
+
+  def merge(self, filename='result.json'):
+    """
+    Writes records of all sources to filename as a json array, one file at a time and one record at a time.
+    Returns number of records.
+    """
+    self.close()
+    count = 0
+    raw, out = open_file(filename + EXTENSIONS[self.compression], 'wb', self.compression)
+    try:
+      out.write(b'[')
+      for source in sorted(self.writers, key=str):
+        part_raw, part = open_file(self.writers[source].path, 'rb', self.compression)
+        try:
+          for line in read_lines(part):
+            line = line.strip()
+            if line:
+              out.write((b',\n' if count>0 else b'') + line)
+              count += 1
+        finally:
+          part_raw.close()
+      out.write(b']\n')
+    finally:
+      if out is not raw:
+        out.close()
+      raw.close()
+    return count
@@ -1,66 +1,193 @@
+import argparse
+import ast
+import bisect
+import collections
+import contextlib
 import csv
+import functools
+import io
 import os
+import queue
 import glob
+import gzip
 import shutil
-from time import process_time, clock, time
+import signal
+import tempfile
+from time import perf_counter, process_time, time
 import threading
 import sys
 import re
 import json
-from modulefinder import ModuleFinder
 import logging
 import subprocess
-from bs4 import BeautifulSoup
-import requests
 
-class ProcessInstance:
-  def __init__(self, instance, size, num_threads):
-    self.instance = instance
-    self.size = size
-    self.urls = []
-    self.count = 0
-    self.result = []
-    self.num_threads = num_threads
-    logging.basicConfig(filename=f'instance{instance}.log')
-    self.lock = threading.Lock()
-    self.get_urls()
-    self.get_python_libraries()
+from budget import Budget, BudgetExceeded, DISK_EXCEEDED, run_limited
+from columnar import ColumnWriter
+from file_filter import FileFilter, SKIP_DIRECTORIES, skipped_counts
+from git_store import BlobReader, BlobTooLarge, GitBlob, fetch_blobs, tree_files
+from stage_metrics import InstanceMetrics, RepoTimer, directory_size
+from url_manifest import UrlManifest, is_manifest, unpack_manifest
 
-  def get_urls(self):
-    """get list of urls"""
-    with open('url_list.csv','r') as f:
-      data = csv.reader(f)
-      for row in data:
-        self.urls.extend(row)
+FROM_IMPORT = re.compile(r'from\s+(\.*)\s*([\w.]*)\s+import\b')
+IMPORT = re.compile(r'import\s+(.+)')
 
-  def get_python_libraries(self):
-    try:
-      with open('libraries.json','r') as f:
-        self.python_libraries = json.load(f)
-    except:
-      res = requests.get('https://docs.python.org/3/py-modindex.html')
-      elems = BeautifulSoup(res.content, 'lxml').find_all('code')
-      libraries = []
-      for el in elems:
-        libraries.append(el.text)
-      with open('libraries.json', 'w+') as f:
-        json.dump(libraries, f)
-      self.python_libraries = libraries
+# printed after results of every batch in batch mode
+BATCH_DONE = 'batch done'
+# return code of clone which took longer than clone timeout
+CLONE_TIMEOUT = -1
+# return code of clone which went over disk budget
+DISK_EXCEEDED_CODE = -2
+
+def running_python_libraries():
+  """ Returns top level names of standard library modules of running python """
+  if hasattr(sys, 'stdlib_module_names'):
+    return frozenset(sys.stdlib_module_names)
+  # before python 3.10, modules built in python and in directories of standard library and its extensions
+  import pkgutil
+  import sysconfig
+  stdlib = sysconfig.get_paths()['stdlib']
+  directories = [stdlib, os.path.join(stdlib, 'lib-dynload'), sysconfig.get_paths()['platstdlib']]
+  return frozenset(sys.builtin_module_names) | frozenset(module.name for module in pkgutil.iter_modules(directories))
+
+class DuplicateIndex:
+  """ Index of blocks of 4 lines of all files in a repository to find blocks duplicated across files """
+  def __init__(self):
+    self.first_file = {}    # hash of block -> first file containing it, or -1 if more than one file contains it
+    self.files = []         # hashes of blocks and number of lines of every file added
+
+  def add_file(self, lines, num_lines):
+    file_num = len(self.files)
+    hashes = [hash((lines[i].strip(), lines[i+1], lines[i+2], lines[i+3])) for i in range(num_lines-3)]
+    for block in set(hashes):
+      if self.first_file.setdefault(block, file_num)!=file_num:
+        self.first_file[block] = -1
+    self.files.append((hashes, num_lines))
+
+  def duplicate_percent(self):
+    """ Returns percentage of lines of repository which are in a block that also exists in another file """
+    duplicates = 0
+    total_lines = 0
+    for hashes, num_lines in self.files:
+      total_lines += num_lines
+      covered_till = 0    # lines before it are already counted
+      for i, block in enumerate(hashes):
+        if self.first_file[block]==-1:
+          duplicates += i+4-max(i, covered_till)
+          covered_till = i+4
+    return (duplicates*100)/total_lines if total_lines!=0 else 0
+
+class VariableScopes:
+  """ Variables defined in a file, kept in a stack of scopes ordered by indentation """
+  def __init__(self):
+    self.levels = []        # indentation of every scope in stack, increasing
+    self.scopes = []        # variables defined in scope at same position in levels
+    self.variables = set()
 
-  def all_required_files(self, folderName):
+  def leave_scopes(self, indentation):
+    """ Delete variables defined in scopes deeper than indentation """
+    while len(self.levels)>0 and self.levels[-1]>indentation:
+      self.levels.pop()
+      self.variables.difference_update(self.scopes.pop())
+
+  def add(self, word, indentation):
+    """ Adds variable to scope of given indentation. Returns False if variable is already defined """
+    if word in self.variables:
+      return False
+    if len(self.levels)==0 or self.levels[-1]<indentation:
+      self.levels.append(indentation)
+      self.scopes.append([word])
+    else:
+      position = bisect.bisect_left(self.levels, indentation)
+      if self.levels[position]!=indentation:
+        self.levels.insert(position, indentation)
+        self.scopes.insert(position, [])
+      self.scopes[position].append(word)
+    self.variables.add(word)
+    return True
+
+class RepoAnalyzer:
+  """ Analyzes python files of a cloned repository. Holds no thread state so it can run in worker processes """
+  def __init__(self, python_libraries, cross_file_duplicates=False, engine='lines', cache=None, file_filter=None, profile_top=None):
+    self.python_libraries = python_libraries
+    self.profile_top = profile_top
+    self.cross_file_duplicates = cross_file_duplicates
+    self.engine = engine
+    self.cache = cache
+    self.file_filter = file_filter
+
+  def all_required_files(self, folderName, skipped=None):
     """
-    Returns relative path of all python files and files containing dependencies in a folder
+    Returns relative path of all python files in a folder and set of local modules, which are names of
+    all directories and python files without extension. Directories and files left out by file filter are
+    counted in skipped.
     """
     python_files = []
-    directories = []
-    for folderName, _ , filenames in os.walk(folderName):
-      directories.append(folderName.split('/')[-1])
-      for filename in filenames:
-        extension = filename.split('.')[-1]
-        if extension=='py':
-          python_files.append(os.path.join(folderName,filename))
-          directories.append(filename)
-    return python_files, directories
+    directories = set()
+    # same order as os.walk, files of a folder and then its subfolders one by one
+    folders = [folderName]
+    while folders:
+      folderName = folders.pop()
+      directories.add(folderName.split('/')[-1])
+      subfolders = []
+      try:
+        entries = os.scandir(folderName)
+      except OSError:
+        continue
+      with entries:
+        for entry in entries:
+          try:
+            is_dir = entry.is_dir()
+          except OSError:
+            is_dir = False
+          if is_dir:
+            # symbolic links to folders are not followed
+            if entry.is_symlink():
+              continue
+            if self.file_filter is not None and self.file_filter.skip_directory(entry.name, entry.path):
+              # .git of clone is not a directory of repository, bare clones have none
+              if skipped is not None and entry.name!='.git':
+                skipped['directories'] += 1
+              continue
+            subfolders.append(entry.path)
+          elif entry.name.split('.')[-1]=='py':
+            if self.file_filter is not None:
+              try:
+                size = entry.stat().st_size
+              except OSError:
+                continue
+              if self.file_filter.skip_file(entry.path, size, skipped):
+                continue
+            python_files.append(entry.path)
+            directories.add(entry.name[:-3])
+      folders.extend(reversed(subfolders))
+    return python_files, frozenset(directories)
+
+  def all_required_blobs(self, git_dir, skipped=None):
+    """ Same as all_required_files for a bare repository, python files are path and hash of files in last commit """
+    python_files, directories = tree_files(git_dir, self.file_filter, skipped)
+    # os.walk also gives name of repository folder
+    directories.add(os.path.basename(os.path.normpath(git_dir)))
+    return python_files, frozenset(directories)
+
+  def filtered_content(self, blob, skipped):
+    """ Returns content of a python file of git, or None if it is left out by file filter, counting it in skipped """
+    try:
+      content = blob.read(self.file_filter.max_bytes)
+    except BlobTooLarge as e:
+      skipped['files'] += 1
+      skipped['bytes'] += e.size
+      return None
+    if self.file_filter.generated(content[:self.file_filter.head_bytes]):
+      skipped['files'] += 1
+      skipped['bytes'] += len(content)
+      return None
+    return content
+
+  def open_source(self, filename):
+    """ Opens python file, filename is a path or a GitBlob """
+    if isinstance(filename, GitBlob):
+      return io.TextIOWrapper(io.BytesIO(filename.read()), encoding="utf8", errors='ignore')
+    return open(filename, 'r', encoding="utf8", errors='ignore')
 
   def delete_scope_variables(self, indentation, all_variables):
     """ Delete varialbes defined in given scope """
@@ -185,46 +312,120 @@ class ProcessInstance:
           return line[:i]
     return line
 
+  def imported_modules(self, lines):
+    """ Returns top level name of every module imported with absolute import in lines """
+    imported = []
+    for line in lines:
+      if 'import' not in line:
+        continue
+      for statement in line.split(';'):
+        statement = statement.strip()
+        if statement.startswith('import') or statement.startswith('from'):
+          imported.extend(self.statement_modules(statement))
+    return imported
+
+  def statement_modules(self, statement):
+    """ Returns top level name of modules imported in an import statement. Relative imports are local, so skipped """
+    try:
+      nodes = ast.parse(statement).body
+    except Exception:
+      # not valid python 3, for example python 2 code
+      match = FROM_IMPORT.match(statement)
+      if match:
+        return [match.group(2).split('.')[0]] if match.group(1)=='' and match.group(2)!='' else []
+      match = IMPORT.match(statement)
+      if match:
+        modules = [module.split()[0].split('.')[0] for module in match.group(1).split(',') if module.strip()!='']
+        return [module for module in modules if module.isidentifier()]
+      return []
+    modules = []
+    for node in nodes:
+      if isinstance(node, ast.Import):
+        modules.extend(alias.name.split('.')[0] for alias in node.names)
+      elif isinstance(node, ast.ImportFrom) and node.level==0 and node.module:
+        modules.append(node.module.split('.')[0])
+    return modules
+
+  def filter_libraries(self, modules, directories):
+    """ Returns external modules, which are not python modules and not local modules """
+    return [module for module in modules if module not in self.python_libraries and module not in directories and module!='settings']
+
   def external_libraries(self, lines, directories):
     """ Returns all external libraries used """
-    libraries = []
-    for line in lines:
-      line = line.replace("'","").replace('"','')
-      try:
-        modules = []
-        split_line = line.strip().split('\n')[0].split()
-        if len(split_line)==0:
-          continue
-        if split_line[0]=='from':
-          module = line.split(';')[0].split('import')[0].split('from')[1]
-          if '/' in module:
-            continue
-          if len(module.split('.'))>1:
-            if module.split('.')[0].strip()!='':
-              modules = [module.split('.')[0].strip()]
-          else:
-            modules = [module.strip()]
-        elif split_line[0]=='import':
-          line = line.split(';')[0]
-          modules = [module.strip().split('.')[0] for module in line.split('import')[1].split(',')]
-        else:
-          continue
-        for module in modules:
-          if module=='':
-            continue
-          module = module.split(' as ')[0]
-          # external module which is not python module and not local module
-          if module not in self.python_libraries and module not in directories and module!='settings':
-            libraries.append(module)
-      except Exception as e:
-        logging.exception(str(e))
-    return libraries
+    return self.filter_libraries(self.imported_modules(lines), directories)
+
+  def block_fingerprints(self, lines, num_lines):
+    """
+    Returns fingerprint of every block of 4 lines in first num_lines lines. First line of block is compared
+    without indentation and next three lines as they are.
+    """
+    return [(lines[i].strip(), lines[i+1], lines[i+2], lines[i+3]) for i in range(num_lines-3)]
+
+  def count_duplicates(self, lines, num_lines):
+    """
+    Returns number of duplicate lines, which are in a block of 4 lines that occurs more than once in file. Every
+    line is counted once, so it is at most num_lines. Original pairwise count added a line again for every pair
+    of same blocks, and went over 100 percent in files repeating a block.
+    """
+    fingerprints = self.block_fingerprints(lines, num_lines)
+    occurrences = {}
+    for fingerprint in fingerprints:
+      occurrences[fingerprint] = occurrences.get(fingerprint, 0)+1
+    duplicates = 0
+    covered_till = 0    # lines before it are already counted
+    for i, fingerprint in enumerate(fingerprints):
+      if occurrences[fingerprint]>1:
+        duplicates += i+4-max(i, covered_till)
+        covered_till = i+4
+    return duplicates
 
-  def get_data_for_file(self, filename, directories):
+  def get_data_for_file(self, filename, directories, duplicate_index=None):
     """
     Returns total for loops and their nested depth, total functions defined and their total parameters,
-    total variables deined, total lines and number of duplicates in a file
+    total variables deined, total lines and number of duplicates in a file. If duplicate_index is given,
+    blocks of file are added to it to find duplicates across files.
     """
+    data = self.file_data(filename, duplicate_index)
+    return tuple(data[:-1]) + (self.filter_libraries(data[-1], directories),)
+
+  def file_data(self, filename, duplicate_index=None):
+    """ Returns data of file from cache or analyzer, with all imported modules in place of external libraries """
+    # results of file do not depend on repository, except local modules which are filtered from libraries later
+    if self.cache is not None and duplicate_index is None:
+      if isinstance(filename, GitBlob):
+        # hash of a blob is already known, and its content is read only if it is not in cache
+        sha = filename.sha
+      else:
+        from metrics_cache import file_sha
+        sha = file_sha(filename)
+      data = self.cache.get(sha)
+      if data is None:
+        data = self.analyze_file(filename)
+        self.cache.put(sha, data)
+    else:
+      data = self.analyze_file(filename, duplicate_index)
+    return data
+
+  def profiled_file_data(self, filename, duplicate_index, profile):
+    """ Returns data of file, profiled by profile of repository if it is given """
+    if profile is None:
+      return self.file_data(filename, duplicate_index)
+    # size of a blob is known once it is read, blobs found in cache are not read
+    size = (lambda: filename.size) if isinstance(filename, GitBlob) else (lambda: os.path.getsize(filename))
+    return profile.file(filename, size, self.file_data, filename, duplicate_index)
+
+  def analyze_file(self, filename, duplicate_index=None):
+    """ Returns data of file using selected engine, with all imported modules in place of external libraries """
+    if self.engine=='stream':
+      return self.get_data_for_file_stream(filename, duplicate_index)
+    if self.engine=='compare':
+      data = self.get_data_for_file_stream(filename)
+      if data!=self.get_data_for_file_lines(filename):
+        logging.warning(f'Engines do not match for file {filename}')
+    return self.get_data_for_file_lines(filename, duplicate_index)
+
+  def get_data_for_file_lines(self, filename, duplicate_index=None):
+    """ Line by line engine of get_data_for_file """
     total_forloops = 0
     total_depth = 0
     inside_forloop = False
@@ -241,9 +442,7 @@ class ProcessInstance:
     tab_size = 0
     if_else_depth = 0
     
-    hash_map = {}
     lines = []
-    match_hash = {}
     index = -1
     
     mlc_start = False # multi line comment
@@ -251,8 +450,8 @@ class ProcessInstance:
     slash_bracket = False
     opening_brackets = 0
     
-    with open(filename, 'r', encoding="utf8", errors='ignore') as f:
-      for line in f.readlines():
+    with self.open_source(filename) as f:
+      for line in f:
         try:
           stripped_line = line.strip()
           # check for multi line comments
@@ -300,13 +499,6 @@ class ProcessInstance:
 
           line = lines[-1]
           index += 1
-          
-          # hash_map contains list of indexes of line in lines list
-          # for ex: if line "continue" is at indexes 23 and 76 in lines then hash_map["continue"]=[23,76]
-          stripped_line = line.strip()
-          if stripped_line not in hash_map:
-            hash_map[stripped_line] = []
-          hash_map[stripped_line].append(index)
 
           # calculate while tab size is not zero
           if tab_size == 0:
@@ -349,38 +541,378 @@ class ProcessInstance:
           new_variables, all_variables = self.num_variables(line, all_variables, last_indentation, indentation)
           total_variables += new_variables
           last_indentation = line_indentation
+        except MemoryError:
+          raise
         except Exception as e:
           logging.error(f"Error in line {line}: {e}")
     
-    duplicates = 0
-    # traverse hash_map and check for duplicates
-    for line in hash_map:
-      n = len(hash_map[line])
-      # if a line occurs more than once in file
-      if n>1:
-        indexes = hash_map[line]
-        # check every possible pair in list
-        for i in range(n):
-          for j in range(i+1,n):
-            is_duplicate = True
-            # check next three lines if exists
-            for k in range(1,4):
-              if indexes[i]+k>index or indexes[j]+k>index or lines[indexes[i]+k]!=lines[indexes[j]+k]:
-                is_duplicate=False
-                break
-            if is_duplicate:
-              for k in range(0,4):
-                exists = indexes[i]+k in match_hash
-                if not exists or (exists and match_hash[indexes[i]+k]!=indexes[j]+k):
-                  duplicates += 1
-                  match_hash[indexes[i]+k]=indexes[j]+k
-    
+    duplicates = self.count_duplicates(lines, index+1)
+    if duplicate_index is not None:
+      duplicate_index.add_file(lines, index+1)
+
     if index>-1:
       dup_percent = (duplicates*100)/(index+1)
     else:
       dup_percent = 0 # avoid zero division error
     
-    return dup_percent, index+1, total_function_definitions, parameters_used, total_variables, total_forloops, total_depth, self.external_libraries(lines, directories)
+    return dup_percent, index+1, total_function_definitions, parameters_used, total_variables, total_forloops, total_depth, self.imported_modules(lines)
+
+  def new_variables_in_scopes(self, line, first_word, scopes, indentation):
+    """ Same as num_variables but uses stack of scopes. line should be stripped """
+    new_variables = 0
+    if first_word=='for':
+      words = self.forloop_parameters(line)
+      scopes.leave_scopes(indentation)
+      for word in words:
+        new_variables += 1
+        if scopes.add(word, indentation+1):
+          new_variables += 1
+    elif first_word not in ('if','def','elif','while','assert','print','return'):
+      scopes.leave_scopes(indentation)
+      split_line = line.split("=")
+      if len(split_line)>1:   # check if it contains "="
+        if '(' in split_line[0]:
+          return 0
+        for word in split_line[0].strip().split(','):
+          word_split = word.strip().split('[')[0].split('.')    # check for dict and object
+          if len(word_split)>1:
+            if word_split[0]=='self':   # check for object attributes
+              word = word_split[1]
+              indentation = 1
+            else:
+              continue
+          else:
+            word = word_split[0]
+          if scopes.add(word, indentation):
+            new_variables += 1
+    else:
+      scopes.leave_scopes(indentation)
+    return new_variables
+
+  def get_data_for_file_stream(self, filename, duplicate_index=None):
+    """
+    Single pass engine of get_data_for_file. Reads file as a stream, classifies every logical line once
+    and keeps variables in a stack of scopes instead of rebuilding them on every line.
+    """
+    total_forloops = 0
+    total_depth = 0
+    current_forloop_indent = 0
+    current_forloop_depth = 0
+    forloop_start_indent = 0
+
+    total_function_definitions = 0
+    parameters_used = 0
+
+    scopes = VariableScopes()
+    total_variables = 0
+    last_indentation = 0
+    tab_size = 0
+    if_else_depth = 0
+
+    lines = []
+    index = -1
+
+    mlc_start = False # multi line comment
+
+    slash_bracket = False
+    opening_brackets = 0
+
+    with self.open_source(filename) as f:
+      for line in f:
+        try:
+          stripped_line = line.strip()
+          # check for multi line comments
+          if len(stripped_line)>2:
+            if stripped_line[:3]=='"""':
+              mlc_start = not mlc_start
+            if len(stripped_line)>3 and stripped_line[-3:]=='"""':
+              mlc_start = False
+              continue
+            if mlc_start:
+              continue
+          # remove empty lines and commented lines
+          if stripped_line=="" or (opening_brackets==0 and stripped_line[0]=='"') or stripped_line[0]=='#':
+            continue
+
+          if '#' in line:
+            line = self.remove_comment_from_last(line)
+
+          line = line[0:-1]       # remove \n from last
+
+          # check for statements spanning over multiple lines and bring them to one
+          starting_value = opening_brackets
+          opening_brackets += line.count('(')+line.count('[')+line.count('{')-line.count(')')-line.count(']')-line.count('}')
+          if opening_brackets!=0:  # if not balanced
+            if starting_value==0:
+              lines.append(line)
+            else:
+              lines[-1]+=line
+            continue
+          elif starting_value!=0: # if it is end of bracket
+            lines[-1]+=line
+          elif line[-1]=='\\':    # check for line ending with \
+            line = line[0:-1]
+            if not slash_bracket: # if previous line does not have slash, it is a new line
+              lines.append(line)
+              slash_bracket=True
+            else:
+              lines[-1]+=line
+            continue
+          else:
+            if slash_bracket:     # if previous line has slash then this line is last of previous line
+              lines[-1]+=line
+              slash_bracket=False
+            else:
+              lines.append(line)
+
+          line = lines[-1]
+          index += 1
+
+          if tab_size == 0:
+            tab_size = self.calc_tab_size(line)
+          line_indentation = self.count_indentation(line, tab_size)
+
+          # conditionals do not have scope
+          if if_else_depth>0:
+            if line_indentation<last_indentation:
+              if_else_depth -= last_indentation - line_indentation
+              if if_else_depth<0:
+                if_else_depth = 0
+          indentation = line_indentation - if_else_depth
+
+          # classify line once
+          stripped_line = line.strip()
+          first_word = stripped_line.split()[0].split('(')[0].split(':')[0]
+          if first_word=='if' or first_word=='else' or first_word=='elif':
+            if_else_depth += 1
+
+          if stripped_line[:4]=="def ":
+            parameters = self.function_parameters(stripped_line)
+            if parameters>=0:
+              total_function_definitions += 1
+              parameters_used += parameters
+          if first_word=='for':
+            if current_forloop_depth == 0:      # new root for loop
+              current_forloop_depth = 1
+              current_forloop_indent = indentation
+              forloop_start_indent = indentation
+              total_forloops += 1
+            elif indentation>current_forloop_indent:    # child for loop
+              current_forloop_indent = indentation
+              current_forloop_depth += 1
+          elif current_forloop_depth>0 and indentation<=forloop_start_indent:   # root for loop has ended
+            total_depth += current_forloop_depth
+            current_forloop_depth = 0
+            current_forloop_indent = 0
+            forloop_start_indent = 0
+
+          total_variables += self.new_variables_in_scopes(stripped_line, first_word, scopes, indentation)
+          last_indentation = line_indentation
+        except MemoryError:
+          raise
+        except Exception as e:
+          logging.error(f"Error in line {line}: {e}")
+
+    duplicates = self.count_duplicates(lines, index+1)
+    if duplicate_index is not None:
+      duplicate_index.add_file(lines, index+1)
+
+    if index>-1:
+      dup_percent = (duplicates*100)/(index+1)
+    else:
+      dup_percent = 0 # avoid zero division error
+
+    return dup_percent, index+1, total_function_definitions, parameters_used, total_variables, total_forloops, total_depth, self.imported_modules(lines)
+
+  def analyze_repo_files(self, url, python_files, directories, git_dir=None, known_files=None, skipped=None, profile=None):
+    """
+    Runs get_data_for_file on every python file of a repository and returns aggregated data of repository, and
+    hash and data of every python file by its path, hash is None for files on disk. If git_dir is given,
+    python_files are path and hash of files, which are read from git objects of git_dir.
+    known_files is data of files by their hash from an earlier run, these files are not read again.
+    skipped is counts of files left out by file filter while listing them. profile is a RepoProfile which profiles analysis.
+    """
+    if self.cross_file_duplicates:
+      # blocks of every file are needed to find duplicates across files
+      known_files = None
+    reader = None
+    if git_dir is not None:
+      reader = BlobReader(git_dir)
+      python_files = [GitBlob(path, sha, reader) for path, sha in python_files]
+    try:
+      if profile is not None:
+        return profile.repo(self.aggregate_files, url, python_files, directories, known_files or {}, dict(skipped or skipped_counts()), profile)
+      return self.aggregate_files(url, python_files, directories, known_files or {}, dict(skipped or skipped_counts()))
+    finally:
+      if reader is not None:
+        reader.close()
+
+  def aggregate_files(self, url, python_files, directories, known_files, skipped, profile=None):
+    """ Returns aggregated data of python files of a repository, and hash and data of every file by its path """
+    total_function_definitions = 0
+    total_parameters_used = 0
+    total_variables_used = 0
+    total_lines = 0
+    total_forloops = 0
+    total_depth_of_forloops = 0
+    external_libraries_used = []
+    duplicates = []
+    duplicate_index = DuplicateIndex() if self.cross_file_duplicates else None
+    rows = {}
+    for file in python_files:
+      try:
+        if isinstance(file, GitBlob):
+          file_data = known_files.get(file.sha)
+          if file_data is None:
+            if self.file_filter is not None:
+              # content is kept for analyzer, so that it is read once
+              file.content = self.filtered_content(file, skipped)
+              if file.content is None:
+                continue
+            file_data = self.profiled_file_data(file, duplicate_index, profile)
+            file.content = None
+          rows[file.path] = (file.sha, file_data)
+        else:
+          file_data = self.profiled_file_data(file, duplicate_index, profile)
+          rows[file] = (None, file_data)
+        duplication_data, lines, function_definitions, parameters_used, variables_used, forloops, forloops_depth = file_data[:-1]
+        libraries = self.filter_libraries(file_data[-1], directories)
+        duplicates.append(duplication_data)
+        total_function_definitions += function_definitions
+        total_parameters_used += parameters_used
+        total_variables_used += variables_used
+        total_lines += lines
+        total_forloops += forloops
+        total_depth_of_forloops += forloops_depth
+        external_libraries_used.extend(libraries)
+      except MemoryError:
+        # analysis over memory budget is stopped, not reported with files left out
+        raise
+      except Exception as e:
+        logging.exception(str(e))
+    data = {
+      'repository_url': url,
+      'number of lines': total_lines,
+      'libraries': list(set(external_libraries_used)),
+      'nesting factor': total_depth_of_forloops/total_forloops if total_forloops>0 else 0,
+      'average parameters': total_parameters_used/total_function_definitions if total_function_definitions!=0 else 0,
+      'average variables': total_variables_used/total_lines if total_lines!=0 else 0,
+      'code duplication': sum(duplicates)/len(duplicates) if len(duplicates)!=0 else 0 #average of all files
+    }
+    if duplicate_index is not None:
+      data['cross file duplication'] = duplicate_index.duplicate_percent()
+    if self.file_filter is not None:
+      data['skipped files'] = skipped['files']
+      data['skipped bytes'] = skipped['bytes']
+      data['skipped directories'] = skipped['directories']
+    if self.cache is not None:
+      self.cache.flush()
+    return data, rows
+
+class Journal:
+  """
+  Append only journal of urls which are done, failed or skipped with their result. It is used to resume an
+  interrupted run, results of done and skipped urls are printed again from journal and failed urls are retried.
+  """
+  def __init__(self, path, resume=False):
+    self.entries = {}
+    if resume and os.path.exists(path):
+      with open(path, 'r') as f:
+        for line in f:
+          try:
+            entry = json.loads(line)
+            self.entries[entry['url']] = entry
+          except ValueError:
+            # last line may be incomplete if process was killed while writing it
+            pass
+    self.file = open(path, 'a' if resume else 'w')
+    self.lock = threading.Lock()
+
+  def write(self, url, status, data, reason=None):
+    line = json.dumps({'url': url, 'status': status, 'reason': reason, 'data': data})
+    with self.lock:
+      self.file.write(line + '\n')
+      self.file.flush()
+      os.fsync(self.file.fileno())
+
+  def completed(self, url):
+    """ Returns entry of url if it is done or skipped in an earlier run, else None """
+    entry = self.entries.get(url)
+    if entry is not None and entry['status'] in ('done', 'skipped'):
+      return entry
+    return None
+
+class ProcessInstance(RepoAnalyzer):
+  def __init__(self, instance, size, num_threads, *, cross_file_duplicates=False, engine='lines', cache=None, sizes_file=None, journal=None, fetch='full', bare=False, state=None, clone_timeout=None, adaptive=None, file_filter=None, columns=None, urls_file='url_list.csv', urls_start=0, budget=None, profiles=None):
+    self.instance = instance
+    self.size = size
+    self.urls = []
+    self.urls_file = urls_file
+    self.urls_start = urls_start
+    self.count = 0
+    self.result = []
+    self.num_threads = num_threads
+    self.columns = columns
+    self.journal = journal
+    self.fetch = fetch
+    self.bare = bare
+    self.state = state
+    self.clone_timeout = clone_timeout
+    # None, or limits of every repository
+    self.budget = budget
+    # None, or SlowestProfiles of slowest repositories and files
+    self.profiles = profiles
+    # None, or max_pending and min_free_disk of concurrency controller of asyncio mode
+    self.adaptive = adaptive
+    self.pending_analysis = 0
+    if state is not None:
+      # files are listed before their contents are fetched, so that only changed files are downloaded
+      self.bare = True
+      self.fetch = 'sparse'
+    logging.basicConfig(filename=f'instance{instance}.log', level=logging.INFO)
+    super().__init__(self.get_python_libraries(), cross_file_duplicates, engine, cache, file_filter, profiles.k if profiles is not None else None)
+    self.lock = threading.Lock()
+    self.metrics = InstanceMetrics(instance)
+    self.get_urls()
+    self.repo_sizes = self.get_repo_sizes(sizes_file) if sizes_file else None
+    self.fill_work_queue(range((self.instance-1)*self.size+1, (self.instance-1)*self.size+self.size+1))
+
+  def get_urls(self):
+    """get list of urls, file can be gzip compressed and have urls from index urls_start only, or a url manifest"""
+    if is_manifest(self.urls_file):
+      # urls of work queue are read when it is filled, compressed manifest sent by ec2.py is decompressed first
+      self.urls = UrlManifest(unpack_manifest(self.urls_file) if self.urls_file.endswith('.gz') else self.urls_file)
+      return
+    # urls before a slice are not known
+    self.urls = [None]*self.urls_start
+    with (gzip.open(self.urls_file, 'rt', newline='') if self.urls_file.endswith('.gz') else open(self.urls_file, 'r')) as f:
+      data = csv.reader(f)
+      for row in data:
+        self.urls.extend(row)
+
+  def get_repo_sizes(self, filename):
+    """ Returns size of repositories from csv file with rows of url and size """
+    repo_sizes = {}
+    with open(filename,'r') as f:
+      for row in csv.reader(f):
+        try:
+          repo_sizes[row[0]] = float(row[1])
+        except (IndexError, ValueError):
+          pass
+    return repo_sizes
+
+  def get_python_libraries(self):
+    """ Returns top level names of standard library modules of all python versions from bundled libraries.json """
+    try:
+      with open('libraries.json','r') as f:
+        libraries = json.load(f)
+      if isinstance(libraries, dict):
+        libraries = libraries['modules']
+      return frozenset(library.split('.')[0] for library in libraries)
+    except Exception as e:
+      # modules of running python only
+      logging.error(f'Unable to load libraries.json: {e}')
+      return running_python_libraries()
 
   def add_data(self, data):
     self.lock.acquire()
@@ -392,85 +924,873 @@ class ProcessInstance:
   def print_data(self, data):
     self.lock.acquire()
     try:
-      print(data)
+      # one json record per line
+      print(json.dumps(data))
       self.count+=1
     finally:
       self.lock.release()
 
+  def fill_work_queue(self, indexes):
+    """
+    Puts indexes of urls in a queue shared by threads. If sizes of repositories are known, biggest
+    repositories are put first so that they do not end up at the end of batch.
+    """
+    indexes = list(indexes)
+    if isinstance(self.urls, UrlManifest) and len(indexes)>0:
+      self.urls.load(min(indexes), max(indexes)+1)
+    if self.repo_sizes:
+      # repositories of unknown size go last in their original order
+      indexes.sort(key=lambda i: -self.repo_sizes.get(self.urls[i], -1))
+    self.work_queue = queue.Queue()
+    for i in indexes:
+      self.work_queue.put(i)
+    self.thread_stats = {}
+    self.start_time = time()
+
+  def repo_indexes(self, num):
+    """ Returns indexes of urls taken by thread num from shared queue till it is empty """
+    stats = {'repos': 0, 'busy': 0, 'finished': None}
+    self.thread_stats[num] = stats
+    while True:
+      try:
+        i = self.work_queue.get_nowait()
+      except queue.Empty:
+        break
+      if self.skip_repo(i):
+        continue
+      start = time()
+      yield i
+      stats['busy'] += time()-start
+      stats['repos'] += 1
+    stats['finished'] = time()
+
+  def log_thread_stats(self):
+    """ Logs utilization of every thread and time between first and last thread finishing """
+    total = time()-self.start_time
+    for num, stats in sorted(self.thread_stats.items()):
+      logging.info(f"Thread {num}: repos {stats['repos']}, busy {stats['busy']:.1f}s, utilization {stats['busy']*100/total if total>0 else 0:.1f}%, finished after {stats['finished']-self.start_time:.1f}s")
+    finished = [stats['finished'] for stats in self.thread_stats.values()]
+    if len(finished)>0:
+      logging.info(f'Tail: {max(finished)-min(finished):.1f}s between first and last thread finishing, total {total:.1f}s')
+
+  def report(self, i, data, status='done', reason=None, files=None):
+    """ Prints result of repository at index i and records it in journal and column shards with data of its files """
+    self.print_data(data)
+    if self.columns is not None:
+      self.columns.add(data, files)
+    if self.journal is not None:
+      self.journal.write(self.urls[i], status, data, reason)
+
+  def file_rows(self, folderName, rows):
+    """ Returns path in repository, hash and data of every analyzed file, from rows of analyze_repo_files """
+    if self.columns is None:
+      return None
+    if self.bare:
+      return [(path, sha, file_data) for path, (sha, file_data) in rows.items()]
+    return [(os.path.relpath(path, folderName), sha, file_data) for path, (sha, file_data) in rows.items()]
+
+  def report_failure(self, i, reason, status='failed', outcome='error'):
+    """ Reports repository at index i which was not analyzed, outcome tells why """
+    self.report(i, {'repository_url': self.urls[i], 'error': reason, 'outcome': outcome}, status, reason)
+
+  def report_error(self, i, e):
+    """ Reports repository at index i which raised exception e, a repository over budget is skipped. Returns its status in metrics """
+    if isinstance(e, BudgetExceeded):
+      logging.warning(f"Repo {self.urls[i]} is over budget: {str(e)}")
+      self.report_failure(i, str(e), 'skipped', e.outcome)
+      return 'over budget'
+    # exc_info is given, this can run in another thread than the one which caught it
+    logging.error(f"Unable to process repo: {self.urls[i]}. Error: {str(e)}", exc_info=e)
+    self.report_failure(i, str(e))
+    return 'failed'
+
+  def report_clone_failure(self, i, res):
+    """ Reports repository at index i whose clone failed with return code res. Returns its status in metrics """
+    if res==DISK_EXCEEDED_CODE:
+      self.report_failure(i, self.clone_failure(res), 'skipped', DISK_EXCEEDED)
+      return 'over budget'
+    self.report_failure(i, self.clone_failure(res), outcome='clone timeout' if res==CLONE_TIMEOUT else 'clone failed')
+    return 'failed'
+
+  def skip_repo(self, i):
+    """ Returns True if repository at index i should not be processed, after printing its result if it has one """
+    if i>=len(self.urls) or self.urls[i] is None:
+      logging.error(f'No url at index {i}')
+      return True
+    if self.journal is not None:
+      entry = self.journal.completed(self.urls[i])
+      if entry is not None:
+        # done in an earlier run
+        self.print_data(entry['data'])
+        return True
+    if '//' not in self.urls[i]:
+      self.report_failure(i, 'invalid url', 'skipped', 'invalid url')
+      return True
+    return False
+
+  def clone_url(self, i):
+    url = self.urls[i]
+    if url.startswith('https://'):
+      # dummy credentials so that git fails instead of asking for them on private repositories
+      url = f"https://ksjdhf:kdjh@{url.split('//')[1]}.git"
+    return url
+
+  def clone_plans(self, url, folderName):
+    """
+    Returns ways to clone repository, tried in order till one succeeds. Every way is a list of steps, which are
+    git commands run without shell or functions returning 0 on success.
+    """
+    if self.bare:
+      # last commit without working tree, with sparse fetch python files are fetched after listing them
+      command = ['git', 'clone', '-q', '--bare', '--depth', '1']
+      if self.fetch=='sparse':
+        return [[command + ['--filter=blob:none', url, folderName]], [command + [url, folderName]]]
+      return [[command + [url, folderName]]]
+    full = [['git', 'clone', url, folderName]]
+    if self.fetch=='sparse':
+      # last commit without file contents, and then python files only are checked out, so that git downloads
+      # contents of python files and nothing else. Servers without partial clone send all files of last commit,
+      # but only python files are written to disk.
+      sparse = [
+        ['git', 'clone', '-q', '--depth', '1', '--filter=blob:none', '--no-checkout', url, folderName],
+        ['git', '-C', folderName, 'config', 'core.sparseCheckout', 'true'],
+        functools.partial(self.write_sparse_patterns, folderName),
+        ['git', '-C', folderName, 'checkout', '-q'],
+      ]
+      return [sparse, full]
+    return [full]
+
+  def write_sparse_patterns(self, folderName):
+    with open(os.path.join(folderName, '.git', 'info', 'sparse-checkout'), 'w') as f:
+      f.write('*.py\n')
+    return 0
+
+  def clone_deadline(self):
+    return time()+self.clone_timeout if self.clone_timeout else None
+
+  def over_disk_budget(self, folderName):
+    return self.budget is not None and self.budget.disk_bytes is not None and directory_size(folderName)>self.budget.disk_bytes
+
+  def disk_check_interval(self):
+    """ Returns seconds between checks of size of a clone while git runs, or None if it has no disk budget """
+    return 1 if self.budget is not None and self.budget.disk_bytes is not None else None
+
+  def run_steps(self, steps, deadline, folderName):
+    """
+    Runs steps of a clone plan. Returns return code of first failed step, or 0. Git is killed when it runs
+    past deadline, raising TimeoutExpired, or when folder goes over disk budget, returning DISK_EXCEEDED_CODE.
+    """
+    interval = self.disk_check_interval()
+    for step in steps:
+      if callable(step):
+        res = step()
+      else:
+        # stdout of script is used for results
+        process = subprocess.Popen(step, stdout=subprocess.DEVNULL)
+        try:
+          while True:
+            timeout = None if deadline is None else max(0, deadline-time())
+            if interval is not None:
+              timeout = interval if timeout is None else min(interval, timeout)
+            try:
+              res = process.wait(timeout)
+              break
+            except subprocess.TimeoutExpired:
+              if deadline is not None and time()>=deadline:
+                raise
+            if self.over_disk_budget(folderName):
+              res = DISK_EXCEEDED_CODE
+              break
+        finally:
+          if process.poll() is None:
+            process.kill()
+            process.wait()
+      if res!=0:
+        return res
+    return 0
+
+  def clone_folder(self, i):
+    """
+    Returns path of clone of repository at index i, a folder named as repository in a new folder of its own, so
+    that repositories of same name of different owners can be cloned at once
+    """
+    name = self.urls[i].split('/')[-1]
+    return os.path.join(tempfile.mkdtemp(prefix=f'{name}-', dir='.'), name)
+
+  def clone_repo(self, i, folderName):
+    """ Clones repository at index i to folderName. Returns return code of git clone, CLONE_TIMEOUT if it took too long """
+    url = self.clone_url(i)
+    deadline = self.clone_deadline()
+    plans = self.clone_plans(url, folderName)
+    for num, plan in enumerate(plans):
+      try:
+        res = self.run_steps(plan, deadline, folderName)
+      except subprocess.TimeoutExpired:
+        # git is killed by run_steps
+        return CLONE_TIMEOUT
+      # other plans would not take less disk
+      if res in (0, DISK_EXCEEDED_CODE) or num==len(plans)-1:
+        return res
+      logging.warning(f'Clone of {self.urls[i]} failed with code {res}, trying without partial clone')
+      # folder of clone is kept, so that it stays unique
+      shutil.rmtree(folderName, ignore_errors=True)
+
+  async def run_steps_async(self, steps, deadline, folderName):
+    """ Same as run_steps, but git runs as asyncio child process which is killed on timeout, cancellation or going over disk budget """
+    import asyncio
+    interval = self.disk_check_interval()
+    loop = asyncio.get_running_loop()
+    for step in steps:
+      if callable(step):
+        res = step()
+      else:
+        process = await asyncio.create_subprocess_exec(*step, stdout=asyncio.subprocess.DEVNULL)
+        try:
+          while True:
+            timeout = None if deadline is None else max(0, deadline-time())
+            if interval is not None and (timeout is None or interval<timeout):
+              try:
+                # shielded, so that process.wait is not cancelled at every check
+                res = await asyncio.wait_for(asyncio.shield(process.wait()), interval)
+                break
+              except asyncio.TimeoutError:
+                pass
+              if await loop.run_in_executor(None, self.over_disk_budget, folderName):
+                res = DISK_EXCEEDED_CODE
+                process.kill()
+                await process.wait()
+                break
+            else:
+              res = await asyncio.wait_for(process.wait(), timeout)
+              break
+        except BaseException:
+          if process.returncode is None:
+            process.kill()
+            await process.wait()
+          raise
+      if res!=0:
+        return res
+    return 0
+
+  async def clone_repo_async(self, i, folderName):
+    """ Same as clone_repo without blocking event loop """
+    import asyncio
+    url = self.clone_url(i)
+    deadline = self.clone_deadline()
+    plans = self.clone_plans(url, folderName)
+    for num, plan in enumerate(plans):
+      try:
+        res = await self.run_steps_async(plan, deadline, folderName)
+      except asyncio.TimeoutError:
+        return CLONE_TIMEOUT
+      if res in (0, DISK_EXCEEDED_CODE) or num==len(plans)-1:
+        return res
+      logging.warning(f'Clone of {self.urls[i]} failed with code {res}, trying without partial clone')
+      await asyncio.get_running_loop().run_in_executor(None, functools.partial(shutil.rmtree, folderName, ignore_errors=True))
+
+  def clone_failure(self, res):
+    """ Returns reason of failure of clone with return code res """
+    if res==CLONE_TIMEOUT:
+      return f'git clone timed out after {self.clone_timeout} seconds'
+    if res==DISK_EXCEEDED_CODE:
+      return f'git clone went over disk budget of {self.budget.disk_bytes} bytes'
+    return f'git clone failed with code {res}'
+
+  def remote_head(self, i):
+    """ Returns hash of last commit of repository at index i without cloning it, or None if it is unknown """
+    try:
+      output = subprocess.check_output(['git', 'ls-remote', self.clone_url(i), 'HEAD'], universal_newlines=True, timeout=60)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+      return None
+    return output.split()[0] if output.strip() else None
+
+  def known_files(self, i):
+    """ Returns data of python files of repository at index i from an earlier run by their hash """
+    if self.state is None:
+      return {}
+    return self.state.files(self.urls[i])
+
+  def report_unchanged(self, i, timer):
+    """ Prints result of an earlier run if last commit of repository at index i is already analyzed. Returns True if printed """
+    if self.state is None:
+      return False
+    stored = self.state.repo(self.urls[i])
+    if stored is None:
+      return False
+    with timer.stage('clone'):
+      commit = self.remote_head(i)
+    if commit!=stored[0]:
+      return False
+    self.report(i, stored[1], files=self.state.file_rows(self.urls[i]) if self.columns is not None else None)
+    self.metrics.add(timer, 'unchanged')
+    return True
+
+  def count_analyzed(self, timer, data):
+    """ Adds number of lines, and files left out by file filter, of analyzed repository to its metrics """
+    timer.lines = data['number of lines']
+    if 'skipped files' in data:
+      timer.skipped = {'files': data['skipped files'], 'bytes': data['skipped bytes'], 'directories': data['skipped directories']}
+
+  def save_state(self, i, folderName, data, rows):
+    """ Stores analyzed commit of repository at index i with data of its files for later runs """
+    if self.state is None:
+      return
+    commit = subprocess.check_output(['git', '--git-dir', folderName, 'rev-parse', 'HEAD'], universal_newlines=True).strip()
+    self.state.save(self.urls[i], commit, data, rows)
+
+  def git_dir(self, folderName):
+    """ Returns git directory to read python files from, or None if they are checked out """
+    return folderName if self.bare else None
+
+  def skipped_files(self, folderName):
+    """
+    Returns number of files of last commit whose contents were not downloaded by sparse clone. Their size is not
+    recorded, as git reads size of a missing object of partial clone by downloading it, even in ls-tree -l.
+    """
+    try:
+      tree = subprocess.check_output(['git', '-C', folderName, 'ls-tree', '-r', '-z', 'HEAD'])
+      # objects on disk only, listing them does not download missing ones
+      objects = subprocess.check_output(['git', '-C', folderName, 'cat-file', '--batch-check', '--batch-all-objects'], stderr=subprocess.DEVNULL, universal_newlines=True)
+    except subprocess.CalledProcessError:
+      return 0
+    # <hash> <type> <size>
+    present = {line.split()[0] for line in objects.splitlines()}
+    files = 0
+    for entry in tree.split(b'\0'):
+      if not entry:
+        continue
+      # <mode> <type> <hash>\t<path>
+      info, _ = entry.split(b'\t', 1)
+      _, kind, sha = info.decode().split()
+      if kind=='blob' and sha not in present:
+        files += 1
+    return files
+
+  def delete_repo(self, folderName):
+    """ Deletes repository with its folder from clone_folder if exists """
+    try:
+      shutil.rmtree(os.path.dirname(folderName))
+    except:
+      pass
+
+  def clone_and_walk(self, i, folderName, timer):
+    """ Clones repository at index i to folderName and finds its python files, timing both. Returns None for python files if clone failed """
+    with timer.stage('clone'):
+      res = self.clone_repo(i, folderName)
+    if res!=0:
+      return res, None, None
+    python_files, directories = self.walk_repo(i, folderName, timer)
+    return res, python_files, directories
+
+  def walk_repo(self, i, folderName, timer):
+    """ Finds python files of cloned repository at index i and fetches them if needed, and measures size of clone """
+    with timer.stage('walk'):
+      if self.bare:
+        python_files, directories = self.all_required_blobs(folderName, timer.skipped)
+      else:
+        python_files, directories = self.all_required_files(folderName, timer.skipped)
+    if self.bare and self.fetch=='sparse':
+      with timer.stage('clone'):
+        # one request for all python files, instead of one request per file when it is read
+        known_files = self.known_files(i)
+        fetch_res = fetch_blobs(folderName, [sha for _, sha in python_files if sha not in known_files])
+        if fetch_res!=0:
+          logging.warning(f'Unable to fetch python files of {self.urls[i]} at once, code {fetch_res}')
+    with timer.stage('size'):
+      timer.bytes = directory_size(folderName)
+      if self.budget is not None:
+        self.budget.check_disk(timer.bytes)
+      if self.fetch=='sparse':
+        timer.files_saved = self.skipped_files(folderName)
+    timer.files = len(python_files)
+    return python_files, directories
+
   def process(self, num):
     """ Passes through all urls and select some from it. Downloads those repo, process them and then delete. """
-    for i in range((self.instance-1)*self.size+1, (self.instance-1)*self.size+size+1):
-      # evenly distribute load among threads
-      if (i-1)%self.num_threads==num:
-        # clone repository
-        url = f"https://ksjdhf:kdjh@{self.urls[i].split('//')[1]}"
-        # self.print_data(f'Getting response from {self.urls[i]}')
-        res = subprocess.call(f"git clone {url}.git", shell=True)
-        folderName = self.urls[i].split('/')[-1]
-        # self.print_data(f'Got response from {self.urls[i]}')
+    for i in self.repo_indexes(num):
+      timer = RepoTimer(self.urls[i])
+      if self.report_unchanged(i, timer):
+        continue
+      status = 'failed'
+      folderName = self.clone_folder(i)
+      try:
+        res, python_files, directories = self.clone_and_walk(i, folderName, timer)
+        if res==0:
+          with timer.stage('analyze'):
+            data, rows = self.analyze(i, folderName, python_files, directories, timer)
+          self.count_analyzed(timer, data)
+          self.save_state(i, folderName, data, rows)
+          self.report(i, data, files=self.file_rows(folderName, rows))
+          status = 'done'
+        else:
+          status = self.report_clone_failure(i, res)
+      except Exception as e:
+        # log errors
+        status = self.report_error(i, e)
+      finally:
+        # finally delete repository if exists
+        with timer.stage('rmtree'):
+          self.delete_repo(folderName)
+        self.metrics.add(timer, status)
+
+  def clone_worker(self, num, work_queue, stop):
+    """ Clones repositories taken by thread num and puts them in work queue for analyzers, till stop is set """
+    try:
+      for i in self.repo_indexes(num):
+        if stop.is_set():
+          break
+        timer = RepoTimer(self.urls[i])
+        if self.report_unchanged(i, timer):
+          continue
+        folderName = self.clone_folder(i)
         try:
+          res, python_files, directories = self.clone_and_walk(i, folderName, timer)
           if res==0:
-            python_files, directories = self.all_required_files(folderName)
-            total_function_definitions = 0
-            total_parameters_used = 0
-            total_variables_used = 0
-            total_lines = 0
-            total_forloops = 0
-            total_depth_of_forloops = 0
-            external_libraries_used = []
-            duplicates = []
-            for file in python_files:
-              try:
-                duplication_data, lines, function_definitions, parameters_used, variables_used, forloops, forloops_depth, libraries = self.get_data_for_file(file, directories)
-                duplicates.append(duplication_data)
-                total_function_definitions += function_definitions
-                total_parameters_used += parameters_used
-                total_variables_used += variables_used
-                total_lines += lines
-                total_forloops += forloops
-                total_depth_of_forloops += forloops_depth
-                external_libraries_used.extend(libraries)
-              except Exception as e:
-                logging.exception(str(e))
-            self.print_data({
-              'repository_url': self.urls[i],
-              'number of lines': total_lines,
-              'libraries': list(set(external_libraries_used)),
-              'nesting factor': total_depth_of_forloops/total_forloops if total_forloops>0 else 0,
-              'average parameters': total_parameters_used/total_function_definitions if total_function_definitions!=0 else 0,
-              'average variables': total_variables_used/total_lines if total_lines!=0 else 0,
-              'code duplication': sum(duplicates)/len(duplicates) if len(duplicates)!=0 else 0 #average of all files
-            })
-          else:
-            self.print_data("null")
+            if self.put_work(work_queue, (i, folderName, python_files, directories, timer), stop):
+              continue
+            # not reported, so that it is processed again with --resume
+            self.delete_repo(folderName)
+            break
+          status = self.report_clone_failure(i, res)
         except Exception as e:
-          # log errors
-          logging.exception(f"Unable to process repo: {self.urls[i]}. Error: {str(e)}")
-        finally:
-          # finally delete repository if exists
+          status = self.report_error(i, e)
+        with timer.stage('rmtree'):
+          self.delete_repo(folderName)
+        self.metrics.add(timer, status)
+    finally:
+      # tell analyzer that this thread is done
+      self.put_work(work_queue, None, stop)
+
+  def put_work(self, work_queue, item, stop):
+    """ Puts item in bounded work queue, waiting for room till stop is set. Returns False if stopped """
+    while not stop.is_set():
+      try:
+        work_queue.put(item, timeout=1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def process_pipeline(self, num_clone_threads, num_analyzers, analysis=None):
+    """
+    Clones repositories in threads and analyzes them in a pool of processes. Cloning is I/O bound
+    and analysis is CPU bound, so analysis is not limited to one core by GIL. analysis is executor
+    and function of analysis_executor shared by batches, else they are created for this run. Returns
+    analysis used at end, which is a new one if an analyzer process died.
+
+    When an analyzer process dies, every analysis running in pool fails. Pool is created again and those
+    repositories are analyzed again one at a time, so that only repository whose analysis kills a process
+    again is reported as failed. Results are reported and clones deleted in this thread.
+    """
+    from concurrent.futures import FIRST_COMPLETED, wait
+    from concurrent.futures.process import BrokenProcessPool
+    max_pending = num_analyzers*2
+    # bounded queue so that clones do not pile up on disk while analyzers are busy
+    work_queue = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+    threads = []
+    for num in range(num_clone_threads):
+      thread = threading.Thread(target=self.clone_worker, args=(num, work_queue, stop))
+      thread.start()
+      threads.append(thread)
+
+    def finish(item, future):
+      i, folderName, python_files, directories, timer = item
+      status = 'failed'
+      try:
+        data, rows, timer.durations['analyze'], profile = future.result()
+        self.add_profile(profile, timer)
+        self.count_analyzed(timer, data)
+        self.save_state(i, folderName, data, rows)
+        self.report(i, data, files=self.file_rows(folderName, rows))
+        status = 'done'
+      except Exception as e:
+        status = self.report_error(i, e)
+      finally:
+        with timer.stage('rmtree'):
+          self.delete_repo(folderName)
+        self.metrics.add(timer, status)
+
+    own = analysis is None
+    executor, analyze = analysis or self.analysis_executor(num_analyzers)
+    pending = {}                    # future -> cloned repository and whether it runs alone
+    suspects = collections.deque()  # repositories whose analysis was running when a process died
+    broken = False
+
+    def submit(item, alone=False):
+      nonlocal broken
+      i, folderName, python_files, directories, timer = item
+      try:
+        future = executor.submit(analyze, self.analyzer_args(), self.urls[i], python_files, directories, self.git_dir(folderName), self.known_files(i), timer.skipped)
+      except BrokenProcessPool:
+        # a process died before a failed analysis told it
+        broken = True
+        if alone:
+          suspects.appendleft(item)
+        else:
+          suspects.append(item)
+        return
+      pending[future] = (item, alone)
+
+    finished_threads = 0
+    try:
+      while finished_threads<num_clone_threads or pending or suspects:
+        if broken and not pending:
+          logging.error('Analyzer process died, starting analyzer processes again')
+          executor.shutdown()
+          executor = self.process_pool(num_analyzers)
+          broken = False
+        if suspects and not pending:
+          submit(suspects.popleft(), alone=True)
+        if not suspects and not broken and finished_threads<num_clone_threads and len(pending)<max_pending:
           try:
-            shutil.rmtree(folderName)
-          except:
-            pass
+            # analyses which finish meanwhile are handled after waiting
+            item = work_queue.get(timeout=0.1 if pending else None)
+          except queue.Empty:
+            item = False
+          if item is None:
+            finished_threads += 1
+          elif item:
+            submit(item)
+          done = [future for future in pending if future.done()]
+        else:
+          done = wait(pending, return_when=FIRST_COMPLETED).done
+        for future in done:
+          item, alone = pending.pop(future)
+          if isinstance(future.exception(), BrokenProcessPool):
+            broken = True
+            if not alone:
+              suspects.append(item)
+              continue
+            logging.error(f'Analysis of {self.urls[item[0]]} killed analyzer process')
+          finish(item, future)
+    finally:
+      # clone threads stop waiting for room in work queue when analysis is aborted
+      stop.set()
+      for thread in threads:
+        while thread.is_alive():
+          try:
+            item = work_queue.get(timeout=1)
+          except queue.Empty:
+            continue
+          if item is not None:
+            self.delete_repo(item[1])
+        thread.join()
+      if own:
+        executor.shutdown()
+    return executor, analyze
+
+  def analyzer_args(self):
+    """ Returns arguments of RepoAnalyzer of analyzer processes """
+    return (self.python_libraries, self.cross_file_duplicates, self.engine, self.cache, self.file_filter, self.profile_top)
+
+  def limits_analysis(self):
+    return self.budget is not None and self.budget.limits_analysis()
+
+  def analyze(self, i, folderName, python_files, directories, timer):
+    """ Analyzes cloned repository at index i in this process, or in a new process when analysis has a budget """
+    args = (self.urls[i], python_files, directories, self.git_dir(folderName), self.known_files(i), timer.skipped)
+    if self.limits_analysis():
+      data, rows, _, profile = analyze_repo_limited(self.budget, self.analyzer_args(), *args)
+    else:
+      profile = None
+      if self.profiles is not None:
+        from profiling import RepoProfile
+        profile = RepoProfile(self.urls[i], self.profile_top)
+      data, rows = self.analyze_repo_files(*args, profile)
+    self.add_profile(profile, timer)
+    return data, rows
+
+  def add_profile(self, profile, timer):
+    """ Keeps profile of analyzed repository if it is one of slowest """
+    if self.profiles is not None and profile is not None:
+      self.profiles.add(profile, {'disk bytes': timer.bytes})
+
+  def analysis_executor(self, num_analyzers):
+    """
+    Returns executor of analyses of pipeline and asyncio modes, and function run in it with arguments of
+    analyze_repo_in_worker. With an analysis budget every analysis runs in a new process, which can be
+    killed, started by a thread of executor.
+    """
+    if self.limits_analysis():
+      from concurrent.futures import ThreadPoolExecutor
+      return ThreadPoolExecutor(max_workers=num_analyzers), functools.partial(analyze_repo_limited, self.budget)
+    return self.process_pool(num_analyzers), analyze_repo_in_worker
+
+  def process_pool(self, num_analyzers):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    # spawn analyzers instead of forking them, forking while clone threads hold locks can deadlock children
+    return ProcessPoolExecutor(max_workers=num_analyzers, mp_context=multiprocessing.get_context('spawn'))
+
+  async def async_worker(self, num, clone_slots, analysis_slots, executor, analyze):
+    """ Clones repositories taken by worker num when a clone slot is free, and analyzes them in executor when an analysis slot is free """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    for i in self.repo_indexes(num):
+      timer = RepoTimer(self.urls[i])
+      if await loop.run_in_executor(None, self.report_unchanged, i, timer):
+        continue
+      status = 'failed'
+      folderName = self.clone_folder(i)
+      try:
+        async with clone_slots:
+          with timer.stage('clone'):
+            res = await self.clone_repo_async(i, folderName)
+        if res==0:
+          python_files, directories = await loop.run_in_executor(None, self.walk_repo, i, folderName, timer)
+          self.pending_analysis += 1
+          try:
+            await analysis_slots.acquire()
+          finally:
+            self.pending_analysis -= 1
+          try:
+            data, rows, timer.durations['analyze'], profile = await loop.run_in_executor(executor, analyze, self.analyzer_args(),
+              self.urls[i], python_files, directories, self.git_dir(folderName), self.known_files(i), timer.skipped)
+          finally:
+            await analysis_slots.release()
+          self.add_profile(profile, timer)
+          self.count_analyzed(timer, data)
+          await loop.run_in_executor(None, self.save_state, i, folderName, data, rows)
+          await loop.run_in_executor(None, functools.partial(self.report, i, data, files=self.file_rows(folderName, rows)))
+          status = 'done'
+        else:
+          status = await loop.run_in_executor(None, self.report_clone_failure, i, res)
+      except asyncio.CancelledError:
+        # not reported, so that it is processed again with --resume
+        status = None
+        raise
+      except Exception as e:
+        status = await loop.run_in_executor(None, self.report_error, i, e)
+      finally:
+        with timer.stage('rmtree'):
+          await loop.run_in_executor(None, self.delete_repo, folderName)
+        if status is not None:
+          self.metrics.add(timer, status)
+
+  async def process_async(self, max_clones, num_analyzers, analysis=None):
+    """
+    Clones up to max_clones repositories at once as asyncio child processes, without a thread per clone, and
+    analyzes them in a pool of processes. SIGTERM cancels all clones, killing git and deleting their folders.
+    With adaptive concurrency, number of clones and analyses is changed while running by a controller.
+    analysis is as in process_pipeline.
+    """
+    import asyncio
+    from concurrency import AdaptiveLimit, ConcurrencyController
+    loop = asyncio.get_running_loop()
+    max_pending = num_analyzers*2
+    controller = None
+    if self.adaptive is not None:
+      max_pending = self.adaptive['max_pending'] or max_pending
+      clone_slots = AdaptiveLimit(min(max_clones, os.cpu_count()))
+      analysis_slots = AdaptiveLimit(num_analyzers)
+      controller = ConcurrencyController(clone_slots, analysis_slots, lambda: self.pending_analysis, max_clones, num_analyzers,
+        max_pending, self.adaptive['min_free_disk'])
+    else:
+      clone_slots = AdaptiveLimit(max_clones)
+      analysis_slots = AdaptiveLimit(num_analyzers)
+    executor, analyze = analysis or self.analysis_executor(num_analyzers)
+    with executor if analysis is None else contextlib.nullcontext():
+      # more workers than clone slots, so that cloning goes on while cloned repositories wait for analyzers,
+      # and at most this many repositories are on disk
+      workers = asyncio.gather(*(self.async_worker(num, clone_slots, analysis_slots, executor, analyze) for num in range(max_clones+max_pending+num_analyzers)))
+      controller_task = loop.create_task(controller.run()) if controller is not None else None
+      try:
+        loop.add_signal_handler(signal.SIGTERM, workers.cancel)
+      except (NotImplementedError, RuntimeError):
+        # signals can be handled in main thread only
+        pass
+      try:
+        await workers
+      finally:
+        if controller_task is not None:
+          controller_task.cancel()
+        try:
+          loop.remove_signal_handler(signal.SIGTERM)
+        except (NotImplementedError, RuntimeError):
           pass
 
+  def run(self, pipeline, num_analyzers, async_clones=None):
+    """ Processes all urls in work queue and writes outputs """
+    self.process_queue(pipeline, num_analyzers, async_clones)
+    self.write_outputs()
+
+  def process_queue(self, pipeline, num_analyzers, async_clones=None, analysis=None):
+    """ Processes all urls in work queue, analysis is as in process_pipeline. Returns analysis to use for next queue """
+    if async_clones:
+      # asyncio and process pool are imported only by modes which use them, so that workers start fast
+      import asyncio
+      try:
+        asyncio.run(self.process_async(async_clones, num_analyzers, analysis))
+      except asyncio.CancelledError:
+        logging.error('Cancelled, repositories which were being processed are processed again with --resume')
+        self.write_outputs()
+        sys.exit(1)
+    elif pipeline:
+      analysis = self.process_pipeline(self.num_threads, num_analyzers, analysis)
+    else:
+      threads = []
+      # create threads
+      for num in range(self.num_threads):
+        thread = threading.Thread(target=self.process, args=(num,))
+        thread.start()
+        threads.append(thread)
+      # wait for threads to complete
+      for thread in threads:
+        thread.join()
+    self.log_thread_stats()
+    return analysis
+
+  def write_outputs(self, flush_columns=True):
+    """ Writes metrics, buffered column shards and profiles of run """
+    self.metrics.write()
+    if self.columns is not None and flush_columns:
+      self.columns.flush()
+    if self.profiles is not None:
+      self.profiles.write()
+
+  def process_batches(self, pipeline, num_analyzers, async_clones=None):
+    """
+    Reads batches of urls from stdin till it is closed. Every line is index of first url and number of urls.
+    BATCH_DONE is printed after results of every batch. Batches share analyzer processes, and column shards
+    are written every shard_rows repositories and at end, not after every batch.
+    """
+    analysis = self.analysis_executor(num_analyzers) if pipeline or async_clones else None
+    try:
+      for line in sys.stdin:
+        try:
+          start, count = [int(value) for value in line.split()]
+        except ValueError:
+          logging.error(f'Invalid batch: {line}')
+          continue
+        self.fill_work_queue(range(start, start+count))
+        analysis = self.process_queue(pipeline, num_analyzers, async_clones, analysis)
+        self.write_outputs(flush_columns=False)
+        with self.lock:
+          print(BATCH_DONE, flush=True)
+    finally:
+      if analysis is not None:
+        analysis[0].shutdown()
+    self.write_outputs()
+
+# analyzer of current worker process, created on first use
+worker_analyzer = None
+
+def analyze_repo_in_worker(analyzer_args, url, python_files, directories, git_dir=None, known_files=None, skipped=None):
+  """
+  Runs in analyzer process of pipeline mode. analyzer_args are arguments of RepoAnalyzer. Returns data
+  of repository, data of its files read from git, time taken to analyze it, which does not include
+  waiting for a free process, and its RepoProfile when analyzer profiles, else None.
+  """
+  global worker_analyzer
+  if worker_analyzer is None:
+    worker_analyzer = RepoAnalyzer(*analyzer_args)
+  profile = None
+  if worker_analyzer.profile_top:
+    from profiling import RepoProfile
+    profile = RepoProfile(url, worker_analyzer.profile_top)
+  start = perf_counter()
+  data, rows = worker_analyzer.analyze_repo_files(url, python_files, directories, git_dir, known_files, skipped, profile)
+  return data, rows, perf_counter()-start, profile
+
+def analyze_repo_limited(budget, analyzer_args, url, python_files, directories, git_dir=None, known_files=None, skipped=None):
+  """
+  Same as analyze_repo_in_worker, but in a new process with cpu and memory limits of budget, which is killed
+  when it goes over them. Raises BudgetExceeded then. Time taken includes starting the process.
+  """
+  start = perf_counter()
+  data, rows, _, profile = run_limited(analyze_repo_in_worker, (analyzer_args, url, python_files, directories, git_dir, known_files, skipped), budget)
+  return data, rows, perf_counter()-start, profile
+
 # main program
 if __name__=='__main__':
-  threads = []
-  num_threads = 20
-  instance = int(sys.argv[1])
-  size = int(sys.argv[2])
-  try:
-    subprocess.call(f'rm instance{instance}.log', shell=True)
-  except:
-    pass
-  manager = ProcessInstance(instance, size, num_threads)
-  # create threads
-  for _ in range(num_threads):
-    thread = threading.Thread(target=manager.process, args=(_,))
-    thread.start()
-    threads.append(thread)
-  # wait for threads to complete
-  for thread in threads:
-    thread.join()
-  # print(manager.result)
\ No newline at end of file
+  parser = argparse.ArgumentParser()
+  parser.add_argument('instance', type=int)
+  parser.add_argument('size', type=int)
+  parser.add_argument('--threads', type=int, default=20, help='number of threads (clone threads in pipeline mode)')
+  parser.add_argument('--pipeline', action='store_true', help='clone in threads and analyze in a pool of processes')
+  parser.add_argument('--analyzers', type=int, default=os.cpu_count(), help='number of analyzer processes in pipeline mode')
+  parser.add_argument('--cross-file-duplicates', action='store_true', help='also report percentage of lines duplicated across files of repository')
+  parser.add_argument('--engine', choices=['lines', 'stream', 'compare'], default='lines', help='file analyzer engine, compare runs both and logs files where they differ')
+  parser.add_argument('--cache', help='file of metrics cache, files analyzed before are not analyzed again')
+  parser.add_argument('--cache-size', type=int, default=1024, help='maximum size of metrics cache in MB')
+  parser.add_argument('--batches', action='store_true', help='read batches of urls from stdin in place of range of instance')
+  parser.add_argument('--resume', action='store_true', help='print results of urls done in earlier run from journal and retry failed urls')
+  parser.add_argument('--fetch', choices=['full', 'sparse'], default='full', help='sparse downloads only python files of last commit')
+  parser.add_argument('--bare', action='store_true', help='analyze python files from git objects of a bare clone of last commit, without checking them out')
+  parser.add_argument('--state', help='file of repository state, unchanged repositories are skipped and only changed files are analyzed')
+  parser.add_argument('--async-clones', type=int, help='clone up to this many repositories at once with asyncio in place of threads, and analyze them in a pool of processes')
+  parser.add_argument('--adaptive', action='store_true', help='with --async-clones, change number of clones and analyses while running based on cpu, network, free disk and repositories waiting for analysis')
+  parser.add_argument('--max-pending', type=int, help='with --adaptive, cloning is paused when this many cloned repositories wait for analysis (default 2 per analyzer)')
+  parser.add_argument('--min-free-disk', type=int, default=2048, help='with --adaptive, cloning is paused when free disk is below this many MB')
+  parser.add_argument('--clone-timeout', type=int, default=1800, help='seconds after which a clone is killed and reported as failed')
+  parser.add_argument('--filter-files', action='store_true', help='leave out vendored directories, virtual environments, big and generated python files, and report how many are left out')
+  parser.add_argument('--skip-dirs', help='with --filter-files, comma separated names of directories to leave out in place of default list')
+  parser.add_argument('--max-file-size', type=int, default=1024, help='with --filter-files, python files bigger than this many KB are left out')
+  parser.add_argument('--max-line-length', type=int, default=1000, help='with --filter-files, python files with a longer line near their start are left out as generated or minified')
+  parser.add_argument('--columnar', help='also write results and data of every python file to column shards in this directory')
+  parser.add_argument('--shard-rows', type=int, default=10000, help='with --columnar, repositories in a shard')
+  parser.add_argument('--urls', default='url_list.csv', help='csv file of urls, gzip compressed if it ends with .gz, or url manifest of url_manifest.py')
+  parser.add_argument('--urls-start', type=int, default=0, help='index of first url of --urls, when it has a slice of all urls')
+  parser.add_argument('--max-repo-size', type=int, help='repositories taking more than this many MB on disk are killed while cloning and skipped')
+  parser.add_argument('--analysis-cpu', type=int, help='analysis of a repository taking more than this many cpu seconds is killed and repository is skipped, every analysis runs in a new process with a budget')
+  parser.add_argument('--analysis-memory', type=int, help='analysis of a repository needing more than this many MB of memory is killed and repository is skipped')
+  parser.add_argument('--analysis-timeout', type=int, help='analysis of a repository taking more than this many seconds is killed and repository is skipped (default twice --analysis-cpu and a minute, or an hour with --analysis-memory only)')
+  parser.add_argument('--profile', action='store_true', help='profile analysis of every repository and file, and write cProfile stats of slowest ones with their sizes to --profile-dir')
+  parser.add_argument('--profile-top', type=int, default=10, help='with --profile, number of slowest repositories and of slowest files kept')
+  parser.add_argument('--profile-dir', default='profiles', help='with --profile, directory of profiles')
+  parser.add_argument('--sizes', help='csv file with url and size of repositories, biggest repositories are processed first')
+  args = parser.parse_args()
+  if args.adaptive and not args.async_clones:
+    parser.error('--adaptive needs --async-clones, which is maximum number of clones')
+  for name in ('clone_timeout', 'max_repo_size', 'analysis_cpu', 'analysis_memory', 'analysis_timeout'):
+    # zero would silently turn a limit off
+    if getattr(args, name) is not None and getattr(args, name)<=0:
+      parser.error(f"--{name.replace('_', '-')} must be positive")
+  instance = args.instance
+  size = args.size
+  num_threads = args.threads
+  if not args.resume:
+    try:
+      os.remove(f'instance{instance}.log')
+    except OSError:
+      pass
+  journal = Journal(f'instance{instance}.journal', args.resume)
+  cache = None
+  if args.cache:
+    from metrics_cache import MetricsCache
+    cache = MetricsCache(args.cache, args.cache_size*1024*1024)
+    cache.reset_stats()
+  state = None
+  if args.state:
+    from repo_state import RepoState
+    state = RepoState(args.state)
+  columns = ColumnWriter(args.columnar, f'instance{instance}', args.shard_rows, args.resume) if args.columnar else None
+  file_filter = None
+  if args.filter_files:
+    skip_directories = args.skip_dirs.split(',') if args.skip_dirs is not None else SKIP_DIRECTORIES
+    file_filter = FileFilter(skip_directories, args.max_file_size*1024, args.max_line_length)
+  budget = None
+  if any(value is not None for value in (args.max_repo_size, args.analysis_cpu, args.analysis_memory, args.analysis_timeout)):
+    budget = Budget(args.max_repo_size*1024*1024 if args.max_repo_size is not None else None, args.analysis_cpu,
+      args.analysis_memory*1024*1024 if args.analysis_memory is not None else None, args.analysis_timeout)
+  profiles = None
+  if args.profile:
+    from profiling import SlowestProfiles
+    profiles = SlowestProfiles(args.profile_dir, args.profile_top)
+  adaptive = {'max_pending': args.max_pending, 'min_free_disk': args.min_free_disk*1024*1024} if args.adaptive else None
+  manager = ProcessInstance(instance, size, num_threads, cross_file_duplicates=args.cross_file_duplicates, engine=args.engine, cache=cache,
+    sizes_file=args.sizes, journal=journal, fetch=args.fetch, bare=args.bare, state=state, clone_timeout=args.clone_timeout, adaptive=adaptive,
+    file_filter=file_filter, columns=columns, urls_file=args.urls, urls_start=args.urls_start, budget=budget, profiles=profiles)
+  if args.batches:
+    manager.process_batches(args.pipeline, args.analyzers, args.async_clones)
+  else:
+    manager.run(args.pipeline, args.analyzers, args.async_clones)
+  if cache is not None:
+    cache.evict()
+    cache.checkpoint()
+    hits, misses = cache.stats()
+    logging.info(f'Metrics cache hits: {hits}, misses: {misses}')
+  if state is not None:
+    state.checkpoint()
+  # print(manager.result)
@@ -0,0 +1,250 @@
+import collections
+import glob
+import json
+import math
+import os
+import threading
+from time import perf_counter, time
+
+STAGES = ['clone', 'walk', 'size', 'analyze', 'rmtree']
+
+def directory_size(path):
+  """ Returns total size in bytes of files in a directory, including .git """
+  total = 0
+  for folder, _, filenames in os.walk(path):
+    for filename in filenames:
+      try:
+        total += os.lstat(os.path.join(folder, filename)).st_size
+      except OSError:
+        pass
+  return total
+
+# durations of a stage are counted in buckets growing by this ratio from BUCKET_START seconds, so that
+# percentiles are within 5% and memory does not grow with number of repositories
+BUCKET_RATIO = 2**(1/16)
+BUCKET_START = 0.001
+
+def duration_bucket(duration):
+  """ Returns bucket of duration, upper bound of bucket b is BUCKET_START*BUCKET_RATIO**b """
+  if duration<=BUCKET_START:
+    return 0
+  return math.ceil(math.log(duration/BUCKET_START, BUCKET_RATIO))
+
+class RepoTimer:
+  """ Durations of stages of one repository and its size """
+  def __init__(self, url):
+    self.url = url
+    self.durations = {}
+    self.bytes = 0
+    self.files = 0
+    self.lines = 0
+    self.files_saved = 0
+    self.skipped = {'files': 0, 'bytes': 0, 'directories': 0}     # left out by file filter
+
+  def stage(self, name):
+    return StageTimer(self, name)
+
+  def record(self):
+    return {'url': self.url, 'stages': self.durations, 'bytes': self.bytes, 'files saved': self.files_saved,
+      'files': self.files, 'lines': self.lines, 'skipped files': self.skipped['files'], 'skipped bytes': self.skipped['bytes']}
+
+class StageTimer:
+  def __init__(self, repo_timer, name):
+    self.repo_timer = repo_timer
+    self.name = name
+
+  def __enter__(self):
+    self.start = perf_counter()
+    return self
+
+  def __exit__(self, *args):
+    durations = self.repo_timer.durations
+    durations[self.name] = durations.get(self.name, 0)+perf_counter()-self.start
+    return False
+
+class InstanceMetrics:
+  """
+  Collects stage durations of every repository processed by an instance and keeps throughput of last window
+  seconds. Records of repositories are appended to a json lines file, and summary is written as json and as
+  a prometheus textfile. Only totals of records and records not yet written are kept in memory.
+  """
+  def __init__(self, instance, window=60, write_interval=30):
+    self.instance = instance
+    self.json_path = f'instance{instance}.metrics.json'
+    self.records_path = f'instance{instance}.repos.ndjson'
+    self.prometheus_path = f'instance{instance}.prom'
+    self.window = window
+    self.write_interval = write_interval
+    self.totals = RunningSummary()
+    self.pending = []     # records not yet appended to records file
+    self.records_written = False
+    self.recent = collections.deque()     # (finish time, lines) of repositories in window
+    self.start_time = time()
+    self.last_write = time()
+    self.lock = threading.Lock()
+    self.write_lock = threading.Lock()
+
+  def add(self, timer, status):
+    """ Adds metrics of a processed repository, status is done, failed, over budget or unchanged """
+    record = timer.record()
+    record['status'] = status
+    now = time()
+    with self.lock:
+      self.totals.add(record)
+      self.pending.append(record)
+      self.recent.append((now, timer.lines))
+      write = now-self.last_write>=self.write_interval
+    if write:
+      self.write()
+
+  def throughput(self):
+    """ Returns repositories per minute and lines per second of last window seconds """
+    now = time()
+    with self.lock:
+      while len(self.recent)>0 and self.recent[0][0]<now-self.window:
+        self.recent.popleft()
+      window = min(self.window, now-self.start_time) or 1
+      return len(self.recent)*60/window, sum(lines for _, lines in self.recent)/window
+
+  def summary(self):
+    with self.lock:
+      summary = self.totals.summary()
+    summary['repos per minute'], summary['lines per second'] = self.throughput()
+    summary['elapsed'] = time()-self.start_time
+    summary['average repos per minute'] = summary['repos']*60/summary['elapsed'] if summary['elapsed']>0 else 0
+    return summary
+
+  def write(self):
+    """
+    Appends new records to records file, which is replaced by first write of a run, and writes summary files,
+    first to temporary files so that they are never read half written
+    """
+    with self.write_lock:
+      summary = self.summary()
+      with self.lock:
+        pending, self.pending = self.pending, []
+        self.last_write = time()
+      with open(self.records_path, 'a' if self.records_written else 'w') as f:
+        for record in pending:
+          f.write(json.dumps(record) + '\n')
+      self.records_written = True
+      with open(self.json_path + '.tmp', 'w') as f:
+        json.dump({'instance': self.instance, 'summary': summary, 'repos file': os.path.basename(self.records_path)}, f)
+      os.replace(self.json_path + '.tmp', self.json_path)
+      with open(self.prometheus_path + '.tmp', 'w') as f:
+        f.write(prometheus_text(summary, {'instance': str(self.instance)}))
+      os.replace(self.prometheus_path + '.tmp', self.prometheus_path)
+
+class RunningSummary:
+  """ Totals of repository records and histograms of durations of every stage, updated one record at a time """
+  def __init__(self):
+    self.totals = dict.fromkeys(['repos', 'failed', 'unchanged', 'over budget', 'bytes', 'files saved', 'skipped files', 'skipped bytes', 'files', 'lines'], 0)
+    self.stages = {stage: {'count': 0, 'total': 0, 'max': 0, 'buckets': collections.Counter()} for stage in STAGES}
+
+  def add(self, repo):
+    totals = self.totals
+    totals['repos'] += 1
+    if repo['status'] in ('failed', 'unchanged', 'over budget'):
+      totals[repo['status']] += 1
+    for name in ('bytes', 'files', 'lines'):
+      totals[name] += repo[name]
+    for name in ('files saved', 'skipped files', 'skipped bytes'):
+      totals[name] += repo.get(name, 0)
+    for stage, duration in repo['stages'].items():
+      if stage in self.stages:
+        stats = self.stages[stage]
+        stats['count'] += 1
+        stats['total'] += duration
+        stats['max'] = max(stats['max'], duration)
+        stats['buckets'][duration_bucket(duration)] += 1
+
+  def percentile(self, stats, fraction):
+    """ Returns upper bound of bucket of duration at fraction of durations of a stage, using nearest rank """
+    if stats['count']==0:
+      return 0
+    rank = min(stats['count'], max(1, math.ceil(fraction*stats['count'])))
+    seen = 0
+    for bucket in sorted(stats['buckets']):
+      seen += stats['buckets'][bucket]
+      if seen>=rank:
+        return min(BUCKET_START*BUCKET_RATIO**bucket, stats['max'])
+
+  def summary(self):
+    """ Returns totals and percentile durations of every stage """
+    summary = dict(self.totals)
+    summary['stages'] = {}
+    for stage, stats in self.stages.items():
+      summary['stages'][stage] = {
+        'count': stats['count'],
+        'total': stats['total'],
+        'p50': self.percentile(stats, 0.5),
+        'p90': self.percentile(stats, 0.9),
+        'p99': self.percentile(stats, 0.99),
+        'max': stats['max'],
+      }
+    return summary
+
+def prometheus_text(summary, labels):
+  """ Returns summary in prometheus text exposition format """
+  label_text = ','.join(f'{name}="{value}"' for name, value in sorted(labels.items()))
+  lines = []
+  def metric(name, kind, value):
+    lines.append(f'# TYPE {name} {kind}')
+    lines.append(f'{name}{{{label_text}}} {value}')
+  metric('repo_analysis_repos_total', 'counter', summary['repos'])
+  metric('repo_analysis_failed_total', 'counter', summary['failed'])
+  metric('repo_analysis_unchanged_total', 'counter', summary['unchanged'])
+  metric('repo_analysis_over_budget_total', 'counter', summary['over budget'])
+  metric('repo_analysis_bytes_total', 'counter', summary['bytes'])
+  metric('repo_analysis_files_saved_total', 'counter', summary['files saved'])
+  metric('repo_analysis_skipped_files_total', 'counter', summary['skipped files'])
+  metric('repo_analysis_skipped_bytes_total', 'counter', summary['skipped bytes'])
+  metric('repo_analysis_files_total', 'counter', summary['files'])
+  metric('repo_analysis_lines_total', 'counter', summary['lines'])
+  if 'repos per minute' in summary:
+    metric('repo_analysis_repos_per_minute', 'gauge', summary['repos per minute'])
+    metric('repo_analysis_lines_per_second', 'gauge', summary['lines per second'])
+  lines.append('# TYPE repo_analysis_stage_seconds summary')
+  for stage, stats in summary['stages'].items():
+    for name, quantile in (('p50', '0.5'), ('p90', '0.9'), ('p99', '0.99')):
+      lines.append(f'repo_analysis_stage_seconds{{{label_text},stage="{stage}",quantile="{quantile}"}} {stats[name]}')
+    lines.append(f'repo_analysis_stage_seconds_sum{{{label_text},stage="{stage}"}} {stats["total"]}')
+    lines.append(f'repo_analysis_stage_seconds_count{{{label_text},stage="{stage}"}} {stats["count"]}')
+  return '\n'.join(lines) + '\n'
+
+def read_records(path):
+  """ Yields repository records of a records file, a record cut off by a crash is left out """
+  try:
+    with open(path, 'r') as f:
+      for line in f:
+        try:
+          yield json.loads(line)
+        except ValueError:
+          pass
+  except OSError:
+    pass
+
+def fleet_summary(paths):
+  """ Returns summary of repositories of all instance metrics files, with summary of every instance """
+  running = RunningSummary()
+  instances = {}
+  for path in paths:
+    try:
+      with open(path, 'r') as f:
+        metrics = json.load(f)
+    except (OSError, ValueError):
+      continue
+    # records file is next to metrics file
+    for repo in read_records(os.path.join(os.path.dirname(path), metrics['repos file'])):
+      running.add(repo)
+    instances[metrics['instance']] = metrics['summary']
+  summary = running.summary()
+  summary['instances'] = instances
+  # instances run at the same time, so their average throughputs add up
+  summary['repos per minute'] = sum(instance['average repos per minute'] for instance in instances.values())
+  summary['lines per second'] = sum(instance['lines']/instance['elapsed'] for instance in instances.values() if instance['elapsed']>0)
+  return summary
+
+# print fleet summary of metrics files in current directory
+if __name__=='__main__':
+  print(json.dumps(fleet_summary(sorted(glob.glob('instance*.metrics.json'))), indent=2))
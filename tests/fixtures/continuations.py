@@ -0,0 +1,37 @@
+import re
+import sys, os.path
+
+
+first = 1 + \
+  2 + \
+  3
+
+values = [
+  1,
+  2,
+  3,
+]
+
+mapping = {'a': (1,
+  2), 'b': [3,
+  4]}
+
+def call(a,
+    b,
+    c=3):
+  total = a + \
+    b
+  for x in (a,
+      b):
+    total += x
+  return total
+
+result = call(1,
+  2,
+  c=[4,
+    5])
+
+if first and \
+    values:
+  joined = ', '.join(str(value)
+    for value in values)
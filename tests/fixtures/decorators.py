@@ -0,0 +1,40 @@
+import functools
+import json as js
+
+
+def trace(function):
+  @functools.wraps(function)
+  def wrapper(*args, **kwargs):
+    result = function(*args, **kwargs)
+    return result
+  return wrapper
+
+@trace
+def decorated(a, b):
+  value = a+b
+  return value
+
+@trace
+@functools.lru_cache(maxsize=None)
+def cached(n):
+  if n<2:
+    return n
+  return cached(n-1)+cached(n-2)
+
+class Service:
+  @staticmethod
+  def build(config, *, strict=False):
+    data = js.dumps(config)
+    return data
+
+  @property
+  def name(self):
+    name = 'service'
+    return name
+
+  @classmethod
+  def create(cls, **options):
+    instance = cls()
+    for key in options:
+      setattr(instance, key, options[key])
+    return instance
@@ -0,0 +1,17 @@
+def first(a):
+  b = a+1
+  c = b*2
+  d = c-1
+  return d
+
+def second(a):
+  b = a+1
+  c = b*2
+  d = c-1
+  return d
+
+def third(a):
+  b = a+1
+  c = b*2
+  d = c-1
+  return d
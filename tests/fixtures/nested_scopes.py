@@ -0,0 +1,53 @@
+import os
+from collections import OrderedDict
+
+
+counter = 0
+names = []
+
+def outer(a, b=2, *args, **kwargs):
+  total = a+b
+  for x in args:
+    for y in range(x):
+      total += y
+      if y>2:
+        inner_value = y*2
+        for z in range(inner_value):
+          total -= z
+  def inner(c):
+    total = c
+    value = total*2
+    return value
+  class Local:
+    field = 1
+    def method(self, d):
+      field = d
+      return field
+  return inner(total)
+
+def second(a):
+  total = a
+  for i in range(a):
+    names.append(i)
+  else:
+    counter = 1
+  return total, counter
+
+class Outer:
+  count = 0
+
+  def __init__(self, name):
+    self.name = name
+    size = len(name)
+    for char in name:
+      size += 1
+
+  def run(self):
+    while True:
+      result = self.name
+      break
+    return result
+
+for item in names:
+  item_value = item
+result = OrderedDict()
@@ -0,0 +1,30 @@
+"""
+Module docstring with # which is not a comment
+for x in range(10):
+  import fake
+"""
+import string
+
+HASH = '#'
+URL = "http://example.com/#anchor"   # comment after a string
+pattern = r'#\d+'
+
+def quoted(a, b='#'):
+  """ docstring with # and def f(x): """
+  text = a + '# not a comment'
+  other = "it's # still a string"
+  for char in text:
+    if char=='#':
+      count = 1
+  return text
+
+def multiline():
+  '''
+  for y in range(3):
+    pass
+  '''
+  value = 1   # x = 2
+  # comment = 3
+  return value
+
+formatted = f'{HASH} #{URL}'
@@ -0,0 +1,25 @@
+import os
+import subprocess
+
+GIT = ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+
+def write_files(path, files):
+  """ Writes files, a dict of content by path relative to path """
+  for name, content in files.items():
+    file_path = os.path.join(path, name)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w') as f:
+      f.write(content)
+
+def make_repo(path, files):
+  """ Creates a git repository at path with files in one commit, which can be cloned with partial clone """
+  subprocess.run(['git', 'init', '-q', path], check=True)
+  commit(path, files)
+  subprocess.run(['git', '-C', path, 'config', 'uploadpack.allowFilter', 'true'], check=True)
+  return 'file://' + os.path.abspath(path)
+
+def commit(path, files, message='files'):
+  """ Writes files and commits them """
+  write_files(path, files)
+  subprocess.run(GIT + ['-C', path, 'add', '-A'], check=True)
+  subprocess.run(GIT + ['-C', path, 'commit', '-q', '-m', message], check=True)
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from budget import ANALYSIS_WALL_SECONDS, Budget, BudgetExceeded, DISK_EXCEEDED
+
+class BudgetTest(unittest.TestCase):
+  def test_no_analysis_budget(self):
+    budget = Budget(disk_bytes=100)
+    self.assertIsNone(budget.wall_seconds)
+    self.assertFalse(budget.limits_analysis())
+
+  def test_wall_time_of_cpu_budget(self):
+    self.assertEqual(Budget(cpu_seconds=10).wall_seconds, 80)
+    self.assertEqual(Budget(cpu_seconds=10, memory_bytes=1024).wall_seconds, 80)
+
+  def test_memory_budget_has_wall_time(self):
+    budget = Budget(memory_bytes=1024)
+    self.assertEqual(budget.wall_seconds, ANALYSIS_WALL_SECONDS)
+    self.assertTrue(budget.limits_analysis())
+
+  def test_given_wall_time(self):
+    self.assertEqual(Budget(cpu_seconds=10, memory_bytes=1024, wall_seconds=5).wall_seconds, 5)
+    self.assertTrue(Budget(wall_seconds=5).limits_analysis())
+
+  def test_disk_budget(self):
+    budget = Budget(disk_bytes=100)
+    budget.check_disk(100)
+    with self.assertRaises(BudgetExceeded) as context:
+      budget.check_disk(101)
+    self.assertEqual(context.exception.outcome, DISK_EXCEEDED)
+
+  def test_limits_must_be_positive(self):
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'script.py')
+    with tempfile.TemporaryDirectory() as directory:
+      for option in ('--clone-timeout', '--max-repo-size', '--analysis-cpu', '--analysis-memory', '--analysis-timeout'):
+        with self.subTest(option=option):
+          process = subprocess.run([sys.executable, script, '1', '1', option, '0'], cwd=directory, stderr=subprocess.PIPE, universal_newlines=True)
+          self.assertEqual(process.returncode, 2)
+          self.assertIn(f'{option} must be positive', process.stderr)
+
+if __name__=='__main__':
+  unittest.main()
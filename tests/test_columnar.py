@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+
+from columnar import ColumnWriter, ShardReader, merge_shards
+
+def repo(url, libraries=(), error=None):
+  data = {'repository_url': url, 'number of lines': 10, 'code duplication': 0.5, 'libraries': list(libraries)}
+  if error is not None:
+    data = {'repository_url': url, 'error': error, 'outcome': 'error'}
+  return data
+
+def file(path, lines, modules):
+  return (path, 'sha-' + path, (0.0, lines, 1, 2, 3, 0, 0, list(modules)))
+
+class MergeShardsTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+    self.writer = ColumnWriter(self.directory.name, 'instance1')
+
+  def shard(self, *repos):
+    """ Writes repositories, each (data, files), to a new shard and returns its path """
+    for data, files in repos:
+      self.writer.add(data, files)
+    self.writer.flush()
+    return os.path.join(self.directory.name, f'instance1-{self.writer.shard_num:05d}.rcol')
+
+  def merge(self, paths):
+    output = os.path.join(self.directory.name, 'result.rcol')
+    count = merge_shards(paths, output)
+    reader = ShardReader(output)
+    self.assertEqual(reader.rows('repos'), count)
+    return reader
+
+  def files_of(self, reader):
+    """ Returns url of repository of every file with path and libraries of file """
+    urls = reader.column('repos', 'repository_url')
+    return [(urls[row], path, libraries) for row, path, libraries in
+      zip(reader.column('files', 'repo'), reader.column('files', 'path'), reader.column('files', 'libraries'))]
+
+  def test_no_shards(self):
+    self.assertEqual(merge_shards([], os.path.join(self.directory.name, 'result.rcol')), 0)
+
+  def test_merge(self):
+    first = self.shard((repo('a', ['numpy']), [file('a.py', 5, ['numpy', 'os'])]),
+      (repo('b', ['requests']), [file('b.py', 6, ['requests']), file('c.py', 7, [])]))
+    second = self.shard((repo('c', ['requests', 'flask']), [file('d.py', 8, ['flask', 'requests'])]))
+    reader = self.merge([first, second])
+    self.assertEqual(reader.column('repos', 'repository_url'), ['a', 'b', 'c'])
+    self.assertEqual(reader.column('repos', 'libraries'), [['numpy'], ['requests'], ['requests', 'flask']])
+    self.assertEqual(list(reader.column('files', 'number of lines')), [5, 6, 7, 8])
+    self.assertEqual(self.files_of(reader), [('a', 'a.py', ['numpy']), ('b', 'b.py', ['requests']), ('b', 'c.py', []),
+      ('c', 'd.py', ['flask', 'requests'])])
+
+  def test_retried_repository_keeps_last_row(self):
+    first = self.shard((repo('a', ['numpy']), [file('a.py', 5, ['numpy'])]), (repo('b', error='clone failed'), None))
+    second = self.shard((repo('c', ['flask']), [file('c.py', 7, ['flask'])]), (repo('b', ['requests']), [file('b.py', 6, ['requests'])]))
+    reader = self.merge([first, second])
+    self.assertEqual(reader.column('repos', 'repository_url'), ['a', 'c', 'b'])
+    self.assertEqual(reader.column('repos', 'error'), ['', '', ''])
+    self.assertEqual(list(reader.column('repos', 'number of lines')), [10, 10, 10])
+    self.assertEqual(self.files_of(reader), [('a', 'a.py', ['numpy']), ('c', 'c.py', ['flask']), ('b', 'b.py', ['requests'])])
+
+  def test_files_of_earlier_row_are_dropped(self):
+    first = self.shard((repo('a', ['numpy']), [file('old.py', 5, ['numpy'])]), (repo('b'), [file('b.py', 6, [])]))
+    second = self.shard((repo('a', ['flask']), [file('new.py', 7, ['flask'])]))
+    reader = self.merge([first, second])
+    self.assertEqual(reader.column('repos', 'repository_url'), ['b', 'a'])
+    self.assertEqual(self.files_of(reader), [('b', 'b.py', []), ('a', 'new.py', ['flask'])])
+
+  def test_same_repository_in_one_shard(self):
+    path = self.shard((repo('a', error='timeout'), None), (repo('b'), [file('b.py', 6, [])]), (repo('a', ['numpy']), [file('a.py', 5, ['numpy'])]))
+    reader = self.merge([path])
+    self.assertEqual(reader.column('repos', 'repository_url'), ['b', 'a'])
+    self.assertEqual(self.files_of(reader), [('b', 'b.py', []), ('a', 'a.py', ['numpy'])])
+
+  def test_merged_shard_can_be_merged(self):
+    first = self.shard((repo('a', ['numpy']), [file('a.py', 5, ['numpy'])]), (repo('b', error='timeout'), None))
+    second = self.shard((repo('b', ['flask']), [file('b.py', 6, ['flask'])]))
+    merged = os.path.join(self.directory.name, 'merged.rcol')
+    merge_shards([first, second], merged)
+    third = self.shard((repo('c', ['numpy']), [file('c.py', 7, ['numpy'])]))
+    reader = self.merge([merged, third])
+    self.assertEqual(self.files_of(reader), [('a', 'a.py', ['numpy']), ('b', 'b.py', ['flask']), ('c', 'c.py', ['numpy'])])
+
+if __name__=='__main__':
+  unittest.main()
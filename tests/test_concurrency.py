@@ -0,0 +1,115 @@
+import asyncio
+import unittest
+
+from concurrency import AdaptiveLimit, ConcurrencyController
+
+def run(coroutine):
+  return asyncio.run(coroutine)
+
+async def settle():
+  """ Lets every waiting task run """
+  for _ in range(5):
+    await asyncio.sleep(0)
+
+class AdaptiveLimitTest(unittest.TestCase):
+  def test_limit(self):
+    async def test():
+      limit = AdaptiveLimit(2)
+      await limit.acquire()
+      await limit.acquire()
+      waiter = asyncio.ensure_future(limit.acquire())
+      await settle()
+      self.assertFalse(waiter.done())
+      await limit.release()
+      await settle()
+      self.assertTrue(waiter.done())
+      self.assertEqual(limit.active, 2)
+    run(test())
+
+  def test_growing_wakes_waiters(self):
+    async def test():
+      limit = AdaptiveLimit(1)
+      await limit.acquire()
+      waiters = [asyncio.ensure_future(limit.acquire()) for _ in range(2)]
+      await settle()
+      self.assertFalse(any(waiter.done() for waiter in waiters))
+      await limit.resize(3)
+      await settle()
+      self.assertTrue(all(waiter.done() for waiter in waiters))
+      self.assertEqual(limit.active, 3)
+    run(test())
+
+  def test_shrinking_waits_for_active(self):
+    async def test():
+      limit = AdaptiveLimit(3)
+      for _ in range(3):
+        await limit.acquire()
+      await limit.resize(1)
+      self.assertEqual(limit.active, 3)
+      waiter = asyncio.ensure_future(limit.acquire())
+      await limit.release()
+      await limit.release()
+      await settle()
+      self.assertFalse(waiter.done())
+      await limit.release()
+      await settle()
+      self.assertTrue(waiter.done())
+    run(test())
+
+  def test_paused(self):
+    async def test():
+      limit = AdaptiveLimit(2)
+      await limit.resize(2, paused=True)
+      waiter = asyncio.ensure_future(limit.acquire())
+      await settle()
+      self.assertFalse(waiter.done())
+      await limit.resize(2)
+      await settle()
+      self.assertTrue(waiter.done())
+    run(test())
+
+  def test_context_manager(self):
+    async def test():
+      limit = AdaptiveLimit(1)
+      async with limit:
+        self.assertEqual(limit.active, 1)
+      self.assertEqual(limit.active, 0)
+    run(test())
+
+class DecideTest(unittest.TestCase):
+  def setUp(self):
+    self.controller = ConcurrencyController(None, None, lambda: 0, max_clones=8, max_analyzers=4, max_pending=10, min_free_disk=100, hold=2)
+
+  def decide(self, cpu=0.5, network=100.0, free_disk=1000, pending=0, clones=2, active_clones=2, analyses=2):
+    return self.controller.decide({'cpu': cpu, 'network': network, 'free_disk': free_disk}, pending, clones, active_clones, analyses)
+
+  def test_adds_clone_while_throughput_grows(self):
+    self.assertEqual(self.decide(network=100.0), (3, False, 2))
+    self.assertEqual(self.decide(network=200.0, clones=3, active_clones=3), (4, False, 2))
+
+  def test_removes_clone_and_holds(self):
+    self.decide(network=100.0)
+    self.assertEqual(self.decide(network=101.0, clones=3, active_clones=3), (2, False, 2))
+    # no clone added for hold intervals
+    self.assertEqual(self.decide(network=101.0), (2, False, 2))
+    self.assertEqual(self.decide(network=101.0), (2, False, 2))
+    self.assertEqual(self.decide(network=101.0), (3, False, 2))
+
+  def test_no_clone_added_while_slots_are_free(self):
+    self.assertEqual(self.decide(active_clones=1), (2, False, 2))
+
+  def test_pauses_on_disk_and_pending(self):
+    self.assertEqual(self.decide(free_disk=50), (2, True, 2))
+    self.assertEqual(self.decide(pending=10, cpu=0.9), (2, True, 2))
+
+  def test_halves_clones_when_analysis_falls_behind(self):
+    self.assertEqual(self.decide(cpu=0.92, pending=5, clones=6, active_clones=6, analyses=4), (3, False, 4))
+
+  def test_analyses(self):
+    self.assertEqual(self.decide(cpu=0.5, pending=1, analyses=2)[2], 3)
+    self.assertEqual(self.decide(cpu=0.5, pending=1, analyses=4)[2], 4)
+    self.assertEqual(self.decide(cpu=0.99, pending=0, analyses=2)[2], 1)
+    self.assertEqual(self.decide(cpu=0.99, pending=0, analyses=1)[2], 1)
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,93 @@
+import queue
+import threading
+import time
+import unittest
+
+from coordinator import BATCH_DONE, BatchCoordinator
+
+class FakeWorker:
+  """ Stdin and stdout of a worker, it prints url indexes of every batch after delay """
+  def __init__(self, delay=0.02, first_delay=None, dies=False):
+    self.delay = delay
+    self.first_delay = first_delay
+    self.dies = dies
+    self.batches = []
+    self.output = queue.Queue()
+
+  def write(self, text):
+    start, count = map(int, text.split())
+    self.batches.append(start)
+    if self.dies:
+      # worker exits during its batch
+      self.output.put('')
+      return
+    delay = self.first_delay if self.first_delay is not None and len(self.batches)==1 else self.delay
+    threading.Thread(target=self.print_batch, args=(start, count, delay)).start()
+
+  def print_batch(self, start, count, delay):
+    time.sleep(delay)
+    for i in range(start, start+count):
+      self.output.put(f'{i}\n')
+    self.output.put(BATCH_DONE+'\n')
+
+  def flush(self):
+    pass
+
+  def close(self):
+    pass
+
+  def readline(self):
+    return self.output.get()
+
+class BatchCoordinatorTest(unittest.TestCase):
+  def run_workers(self, coordinator, workers):
+    threads = [threading.Thread(target=coordinator.run_worker, args=(num+1, worker, worker)) for num, worker in enumerate(workers)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join(30)
+      self.assertFalse(thread.is_alive())
+
+  def coordinator(self, count, batch_size, **kwargs):
+    self.results = []
+    self.calls = []
+    def on_results(worker, lines):
+      self.calls.append(worker)
+      self.results.extend(int(line) for line in lines)
+    return BatchCoordinator(1, count, batch_size, on_results, **kwargs)
+
+  def test_batch_of_dead_worker_is_reassigned(self):
+    coordinator = self.coordinator(50, 10)
+    dead = FakeWorker(dies=True)
+    alive = FakeWorker()
+    self.run_workers(coordinator, [dead, alive])
+    self.assertEqual(len(dead.batches), 1)
+    self.assertIn(dead.batches[0], alive.batches)
+    self.assertEqual(sorted(self.results), list(range(1, 51)))
+    self.assertEqual(coordinator.results_count, {2: 50})
+
+  def test_straggler_runs_again(self):
+    coordinator = self.coordinator(200, 10, straggler_factor=3)
+    slow = FakeWorker(first_delay=1)
+    fast = FakeWorker()
+    self.run_workers(coordinator, [slow, fast])
+    straggler = slow.batches[0]
+    # fast worker takes straggler while other batches are still pending
+    self.assertIn(straggler, fast.batches)
+    self.assertLess(fast.batches.index(straggler), len(fast.batches)-1)
+    self.assertEqual(sorted(self.results), list(range(1, 201)))
+
+  def test_results_of_batch_run_twice_are_used_once(self):
+    coordinator = self.coordinator(10, 10)
+    first = FakeWorker(delay=0.3)
+    second = FakeWorker(delay=0.3)
+    self.run_workers(coordinator, [first, second])
+    # idle worker runs the only batch again
+    self.assertEqual(first.batches, [1])
+    self.assertEqual(second.batches, [1])
+    self.assertEqual(len(self.calls), 1)
+    self.assertEqual(sorted(self.results), list(range(1, 11)))
+    self.assertEqual(sum(coordinator.results_count.values()), 10)
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+from script import DuplicateIndex, RepoAnalyzer
+
+BLOCK = ['def f(x):\n', '  y = x+1\n', '  z = y*2\n', '  return z\n']
+
+class CountDuplicatesTest(unittest.TestCase):
+  def setUp(self):
+    self.analyzer = RepoAnalyzer(set())
+
+  def count(self, lines):
+    return self.analyzer.count_duplicates(lines, len(lines))
+
+  def test_unique_lines(self):
+    lines = [f'a{i} = {i}\n' for i in range(20)]
+    self.assertEqual(self.count(lines), 0)
+
+  def test_same_lines_are_counted_once(self):
+    self.assertEqual(self.count(['pass\n']*1000), 1000)
+
+  def test_repeated_block(self):
+    self.assertEqual(self.count(BLOCK*20), 80)
+
+  def test_block_and_other_lines(self):
+    lines = BLOCK+['x = 1\n', 'y = 2\n']+BLOCK
+    self.assertEqual(self.count(lines), 8)
+
+  def test_short_file(self):
+    self.assertEqual(self.count(['pass\n']*3), 0)
+
+  def test_percent_is_bounded(self):
+    with tempfile.TemporaryDirectory() as directory:
+      for name, lines in (('same', ['pass\n']*1000), ('block', BLOCK*20), ('mixed', (BLOCK+['x = 1\n'])*7)):
+        path = os.path.join(directory, name+'.py')
+        with open(path, 'w') as f:
+          f.writelines(lines)
+        for engine in ('lines', 'stream'):
+          analyzer = RepoAnalyzer(set(), engine=engine)
+          percent = analyzer.analyze_file(path)[0]
+          self.assertGreaterEqual(percent, 0, (name, engine))
+          self.assertLessEqual(percent, 100, (name, engine))
+
+class DuplicateIndexTest(unittest.TestCase):
+  def test_no_files(self):
+    self.assertEqual(DuplicateIndex().duplicate_percent(), 0)
+
+  def test_block_in_two_files(self):
+    index = DuplicateIndex()
+    other = [f'a{i} = {i}\n' for i in range(4)]
+    index.add_file(BLOCK+other, 8)
+    index.add_file(BLOCK, 4)
+    self.assertEqual(index.duplicate_percent(), 8*100/12)
+
+  def test_block_repeated_in_one_file(self):
+    index = DuplicateIndex()
+    index.add_file(BLOCK*2, 8)
+    index.add_file([f'a{i} = {i}\n' for i in range(4)], 4)
+    self.assertEqual(index.duplicate_percent(), 0)
+
+  def test_first_line_indentation_is_ignored(self):
+    index = DuplicateIndex()
+    index.add_file(BLOCK, 4)
+    index.add_file(['    '+BLOCK[0]]+BLOCK[1:], 4)
+    self.assertEqual(index.duplicate_percent(), 100)
+
+  def test_overlapping_blocks_are_counted_once(self):
+    index = DuplicateIndex()
+    lines = [f'a{i} = {i}\n' for i in range(6)]
+    index.add_file(lines, 6)
+    index.add_file(lines, 6)
+    self.assertEqual(index.duplicate_percent(), 100)
+
+if __name__=='__main__':
+  unittest.main()
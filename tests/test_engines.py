@@ -0,0 +1,72 @@
+import glob
+import os
+import unittest
+
+from script import DuplicateIndex, RepoAnalyzer, VariableScopes
+
+FIXTURES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'fixtures', '*.py')))
+
+class EngineParityTest(unittest.TestCase):
+  def setUp(self):
+    self.analyzer = RepoAnalyzer(set())
+
+  def test_fixtures_are_found(self):
+    self.assertGreaterEqual(len(FIXTURES), 5)
+
+  def test_engines_return_same_data(self):
+    for path in FIXTURES:
+      with self.subTest(path=os.path.basename(path)):
+        self.assertEqual(self.analyzer.get_data_for_file_stream(path), self.analyzer.get_data_for_file_lines(path))
+
+  def test_engines_add_same_blocks(self):
+    indexes = []
+    for engine in (self.analyzer.get_data_for_file_lines, self.analyzer.get_data_for_file_stream):
+      index = DuplicateIndex()
+      for path in FIXTURES:
+        engine(path, index)
+      indexes.append(index)
+    self.assertEqual(indexes[0].files, indexes[1].files)
+
+  def test_duplicates_fixture(self):
+    path = os.path.join(os.path.dirname(__file__), 'fixtures', 'duplicates.py')
+    data = self.analyzer.get_data_for_file_stream(path)
+    # lines, functions and parameters
+    self.assertEqual(data[1:4], (15, 3, 3))
+    self.assertEqual(data[0], 12*100/15)
+
+class VariableScopesTest(unittest.TestCase):
+  def test_variable_is_defined_once(self):
+    scopes = VariableScopes()
+    self.assertTrue(scopes.add('a', 0))
+    self.assertFalse(scopes.add('a', 2))
+
+  def test_leaving_scope_deletes_its_variables(self):
+    scopes = VariableScopes()
+    scopes.add('a', 0)
+    scopes.add('b', 2)
+    scopes.add('c', 4)
+    scopes.leave_scopes(2)
+    self.assertEqual(scopes.variables, {'a', 'b'})
+    self.assertTrue(scopes.add('c', 2))
+    scopes.leave_scopes(0)
+    self.assertEqual(scopes.variables, {'a'})
+
+  def test_scope_between_existing_scopes(self):
+    scopes = VariableScopes()
+    scopes.add('a', 0)
+    scopes.add('c', 4)
+    scopes.add('b', 2)
+    self.assertEqual(scopes.levels, [0, 2, 4])
+    scopes.leave_scopes(2)
+    self.assertEqual(scopes.variables, {'a', 'b'})
+
+  def test_same_indentation_shares_scope(self):
+    scopes = VariableScopes()
+    scopes.add('a', 2)
+    scopes.add('b', 2)
+    self.assertEqual(scopes.levels, [2])
+    scopes.leave_scopes(0)
+    self.assertEqual(scopes.variables, set())
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,81 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+from file_filter import FileFilter, skipped_counts
+from script import RepoAnalyzer
+
+def write(path, content):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, 'w') as f:
+    f.write(content)
+
+class FileFilterTest(unittest.TestCase):
+  def setUp(self):
+    self.filter = FileFilter(max_bytes=100, max_line_length=50, header_lines=2, head_bytes=200)
+
+  def test_skip_directory(self):
+    for name in ('.git', 'node_modules', 'site-packages', 'vendor'):
+      self.assertTrue(self.filter.skip_directory(name), name)
+    self.assertFalse(self.filter.skip_directory('src'))
+
+  def test_virtual_environment_of_any_name(self):
+    with tempfile.TemporaryDirectory() as directory:
+      env = os.path.join(directory, 'myenv')
+      write(os.path.join(env, 'pyvenv.cfg'), 'home = /usr/bin\n')
+      self.assertTrue(self.filter.skip_directory('myenv', env))
+      self.assertFalse(self.filter.skip_directory('myenv'))
+
+  def test_too_large(self):
+    self.assertFalse(self.filter.too_large(100))
+    self.assertTrue(self.filter.too_large(101))
+    self.assertFalse(FileFilter(max_bytes=None).too_large(10**9))
+
+  def test_generated(self):
+    self.assertTrue(self.filter.generated(b'# Code generated by protoc. DO NOT EDIT.\nx = 1\n'))
+    self.assertTrue(self.filter.generated(b'x = 1\n' + b'a'*51 + b'\n'))
+    self.assertFalse(self.filter.generated(b'x = 1\n\n# do not edit\n'))
+    self.assertFalse(self.filter.generated(b'def f():\n  return 1\n'))
+
+  def test_skip_file_counts(self):
+    skipped = skipped_counts()
+    with tempfile.TemporaryDirectory() as directory:
+      small = os.path.join(directory, 'small.py')
+      write(small, 'x = 1\n')
+      generated = os.path.join(directory, 'generated.py')
+      write(generated, '# @generated\nx = 1\n')
+      self.assertFalse(self.filter.skip_file(small, 6, skipped))
+      self.assertTrue(self.filter.skip_file(generated, 19, skipped))
+      self.assertTrue(self.filter.skip_file(small, 1000, skipped))
+    self.assertEqual(skipped, {'files': 2, 'bytes': 1019, 'directories': 0})
+
+class SkippedDirectoriesTest(unittest.TestCase):
+  """ Checked out and bare clones of same repository count same directories """
+  def test_checkout_and_bare_counts(self):
+    with tempfile.TemporaryDirectory() as directory:
+      repo = os.path.join(directory, 'repo')
+      write(os.path.join(repo, 'main.py'), 'import app\n')
+      write(os.path.join(repo, 'app', 'core.py'), 'x = 1\n')
+      write(os.path.join(repo, 'vendor', 'lib.py'), 'y = 1\n')
+      write(os.path.join(repo, 'app', 'node_modules', 'x.py'), 'z = 1\n')
+      write(os.path.join(repo, 'env', 'pyvenv.cfg'), 'home = /usr/bin\n')
+      write(os.path.join(repo, 'env', 'lib', 'site.py'), 'w = 1\n')
+      git = ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', '-C', repo]
+      subprocess.run(['git', 'init', '-q', repo], check=True)
+      subprocess.run(git + ['add', '.'], check=True)
+      subprocess.run(git + ['commit', '-q', '-m', 'files'], check=True)
+      bare = os.path.join(directory, 'bare.git')
+      subprocess.run(['git', 'clone', '-q', '--bare', repo, bare], check=True)
+
+      analyzer = RepoAnalyzer(set(), file_filter=FileFilter())
+      checkout_skipped = skipped_counts()
+      files, _ = analyzer.all_required_files(repo, checkout_skipped)
+      bare_skipped = skipped_counts()
+      blobs, _ = analyzer.all_required_blobs(bare, bare_skipped)
+    self.assertEqual(checkout_skipped['directories'], 3)
+    self.assertEqual(bare_skipped['directories'], 3)
+    self.assertEqual(sorted(os.path.relpath(path, repo) for path in files), sorted(path for path, _ in blobs))
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+from git_store import BlobReader, BlobTooLarge, fetch_blobs, tree_files
+from tests.repos import make_repo
+
+FILES = {'main.py': 'import os\n', 'pkg/util.py': 'x = 1\n', 'README.md': 'readme\n'}
+
+class GitStoreTest(unittest.TestCase):
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.directory = directory.name
+    self.url = make_repo(os.path.join(self.directory, 'src'), FILES)
+
+  def clone(self, *options):
+    git_dir = os.path.join(self.directory, 'clone')
+    subprocess.run(['git', 'clone', '-q', '--bare', *options, self.url, git_dir], check=True)
+    return git_dir
+
+  def present_objects(self, git_dir):
+    """ Returns hashes of objects on disk, listing them does not download missing ones """
+    output = subprocess.check_output(['git', '--git-dir', git_dir, 'cat-file', '--batch-check', '--batch-all-objects'], universal_newlines=True)
+    return {line.split()[0] for line in output.splitlines()}
+
+  def test_tree_files(self):
+    python_files, directories = tree_files(self.clone())
+    self.assertEqual(sorted(path for path, _ in python_files), ['main.py', 'pkg/util.py'])
+    self.assertEqual(directories, {'pkg', 'main', 'util'})
+
+  def test_read_blobs(self):
+    git_dir = self.clone()
+    python_files, _ = tree_files(git_dir)
+    with BlobReader(git_dir) as reader:
+      contents = {path: reader.read(sha) for path, sha in python_files}
+    self.assertEqual(contents, {'main.py': b'import os\n', 'pkg/util.py': b'x = 1\n'})
+
+  def test_missing_and_too_large_objects(self):
+    git_dir = self.clone()
+    shas = dict(tree_files(git_dir)[0])
+    with BlobReader(git_dir) as reader:
+      with self.assertRaises(ValueError):
+        reader.read('0'*40)
+      with self.assertRaises(BlobTooLarge) as raised:
+        reader.read(shas['main.py'], max_size=3)
+      self.assertEqual(raised.exception.size, len(FILES['main.py']))
+      # reader is still usable after both
+      self.assertEqual(reader.read(shas['pkg/util.py']), b'x = 1\n')
+
+  def test_fetch_blobs_of_partial_clone(self):
+    git_dir = self.clone('--filter=blob:none')
+    python_files, _ = tree_files(git_dir)
+    shas = [sha for _, sha in python_files]
+    self.assertFalse(set(shas) & self.present_objects(git_dir))
+    self.assertEqual(fetch_blobs(git_dir, shas), 0)
+    self.assertLessEqual(set(shas), self.present_objects(git_dir))
+
+if __name__=='__main__':
+  unittest.main()
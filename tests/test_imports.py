@@ -0,0 +1,38 @@
+import unittest
+
+from script import RepoAnalyzer
+
+class ImportsTest(unittest.TestCase):
+  def setUp(self):
+    self.analyzer = RepoAnalyzer(frozenset(['os', 'sys', 'json']))
+
+  def modules(self, *lines):
+    return self.analyzer.imported_modules(lines)
+
+  def test_absolute_imports(self):
+    self.assertEqual(self.modules('import numpy', 'from pandas.core import frame'), ['numpy', 'pandas'])
+
+  def test_relative_imports_are_skipped(self):
+    self.assertEqual(self.modules('from . import models', 'from .utils import helper', 'from ..core.base import Base'), [])
+
+  def test_several_imports_on_one_line(self):
+    self.assertEqual(self.modules('import numpy, scipy.stats', 'import requests; from flask import Flask'), ['numpy', 'scipy', 'requests', 'flask'])
+
+  def test_import_as(self):
+    self.assertEqual(self.modules('import a.b as c', 'from x.y import z as w'), ['a', 'x'])
+
+  def test_fallback_for_invalid_statements(self):
+    # python 2 module named async, and statement which goes on in next line, are not valid python 3
+    self.assertEqual(self.modules('import async, tornado.web as web', 'from foo.bar import (a,'), ['async', 'tornado', 'foo'])
+    self.assertEqual(self.modules('from .compat import (a,', 'from . import (a,'), [])
+
+  def test_lines_without_import_statements(self):
+    self.assertEqual(self.modules('important = 1', 'x = "import os"', 'fromage = 2'), [])
+
+  def test_external_libraries(self):
+    lines = ['import os, numpy', 'from utils import helper', 'import settings', 'from requests.adapters import HTTPAdapter']
+    # utils is a module of repository, os is in standard library
+    self.assertEqual(self.analyzer.external_libraries(lines, {'utils', 'tests'}), ['numpy', 'requests'])
+
+if __name__=='__main__':
+  unittest.main()
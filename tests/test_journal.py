@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+import unittest
+
+from script import Journal
+
+class JournalTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+    self.path = os.path.join(self.directory.name, 'instance1.journal')
+
+  def journal(self, resume=False):
+    journal = Journal(self.path, resume)
+    self.addCleanup(journal.file.close)
+    return journal
+
+  def test_resume(self):
+    journal = self.journal()
+    journal.write('a', 'done', {'repository_url': 'a', 'number of lines': 3})
+    journal.write('b', 'failed', {'repository_url': 'b', 'error': 'clone failed'}, 'clone failed')
+    journal.write('c', 'skipped', {'repository_url': 'c', 'error': 'invalid url'}, 'invalid url')
+    journal.file.close()
+    resumed = self.journal(resume=True)
+    self.assertEqual(resumed.completed('a')['data'], {'repository_url': 'a', 'number of lines': 3})
+    self.assertEqual(resumed.completed('c')['reason'], 'invalid url')
+    # failed urls are processed again
+    self.assertIsNone(resumed.completed('b'))
+    self.assertIsNone(resumed.completed('d'))
+
+  def test_last_entry_of_url_wins(self):
+    journal = self.journal()
+    journal.write('a', 'failed', None, 'timeout')
+    journal.write('a', 'done', {'repository_url': 'a'})
+    journal.write('b', 'done', {'repository_url': 'b'})
+    journal.write('b', 'failed', None, 'error')
+    journal.file.close()
+    resumed = self.journal(resume=True)
+    self.assertIsNotNone(resumed.completed('a'))
+    self.assertIsNone(resumed.completed('b'))
+
+  def test_incomplete_last_line(self):
+    journal = self.journal()
+    journal.write('a', 'done', {'repository_url': 'a'})
+    journal.file.close()
+    with open(self.path, 'a') as f:
+      f.write('{"url": "b", "status": "do')
+    resumed = self.journal(resume=True)
+    self.assertIsNotNone(resumed.completed('a'))
+    self.assertIsNone(resumed.completed('b'))
+
+  def test_resume_appends(self):
+    journal = self.journal()
+    journal.write('a', 'done', {'repository_url': 'a'})
+    journal.file.close()
+    resumed = self.journal(resume=True)
+    resumed.write('b', 'done', {'repository_url': 'b'})
+    resumed.file.close()
+    with open(self.path, 'r') as f:
+      self.assertEqual([json.loads(line)['url'] for line in f], ['a', 'b'])
+
+  def test_new_run_starts_empty(self):
+    journal = self.journal()
+    journal.write('a', 'done', {'repository_url': 'a'})
+    journal.file.close()
+    fresh = self.journal()
+    self.assertIsNone(fresh.completed('a'))
+    fresh.file.close()
+    self.assertEqual(os.path.getsize(self.path), 0)
+
+if __name__=='__main__':
+  unittest.main()
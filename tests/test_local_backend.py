@@ -0,0 +1,52 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+from ec2 import ManageInstances
+from instance_backends import LocalBackend
+from tests.repos import make_repo
+
+class LocalBackendTest(unittest.TestCase):
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    cwd = os.getcwd()
+    os.chdir(directory.name)
+    self.addCleanup(os.chdir, cwd)
+    # index 0 is before range of instance 1
+    self.urls = ['unused'] + [make_repo(os.path.join('src', name), {'main.py': 'import requests\nx = 1\n'}) for name in ('r1', 'r2', 'r3')]
+    with open('url_list.csv', 'w') as f:
+      f.write(','.join(self.urls))
+    # python is run from a path with a space
+    os.makedirs('python bin')
+    self.python = os.path.join(os.path.abspath('python bin'), 'python')
+    os.symlink(sys.executable, self.python)
+
+  def run_fleet(self, num_instances, size, batch_size=None):
+    backend = LocalBackend('fleet')
+    backend.python = self.python
+    manager = ManageInstances(num_instances, size, backend=backend)
+    with contextlib.redirect_stdout(io.StringIO()):
+      _, count = manager.run(batch_size)
+    with open('result.json') as f:
+      results = json.load(f)
+    return count, sorted(result['repository_url'] for result in results)
+
+  def test_fixed_ranges(self):
+    count, urls = self.run_fleet(1, 3)
+    self.assertEqual(count, 3)
+    self.assertEqual(urls, sorted(self.urls[1:]))
+    self.assertTrue(os.path.exists(os.path.join('fleet', 'instance1', 'instance1.journal')))
+    self.assertTrue(os.path.exists('instance1.metrics.json'))
+
+  def test_batches(self):
+    count, urls = self.run_fleet(3, 1, batch_size=1)
+    self.assertEqual(count, 3)
+    self.assertEqual(urls, sorted(self.urls[1:]))
+
+if __name__=='__main__':
+  unittest.main()
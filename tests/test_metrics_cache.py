@@ -0,0 +1,73 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+from metrics_cache import MetricsCache, file_sha
+
+class MetricsCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+    self.path = os.path.join(self.directory.name, 'cache.db')
+    self.cache = MetricsCache(self.path)
+    self.addCleanup(self.cache.close)
+
+  def last_used(self, sha):
+    return self.cache.connection().execute('SELECT last_used FROM metrics WHERE sha=?', (sha,)).fetchone()[0]
+
+  def test_get_and_put(self):
+    self.assertIsNone(self.cache.get('a'))
+    self.cache.put('a', [1.5, 10, ['os']])
+    self.assertEqual(self.cache.get('a'), [1.5, 10, ['os']])
+    self.cache.flush()
+    self.assertEqual(self.cache.stats(), (1, 1))
+
+  def test_last_use_is_written_on_flush(self):
+    self.cache.put('a', [1])
+    self.cache.put('b', [2])
+    before = self.last_used('a')
+    self.cache.get('a')
+    self.assertEqual(self.last_used('a'), before)
+    self.cache.flush()
+    self.assertGreater(self.last_used('a'), self.last_used('b'))
+
+  def test_last_use_is_written_once(self):
+    self.cache.put('a', [1])
+    self.cache.get('a')
+    self.cache.flush()
+    used = self.last_used('a')
+    self.cache.put('b', [2])
+    self.cache.get('a')
+    self.cache.flush()
+    self.assertEqual(self.last_used('a'), used)
+    self.assertEqual(self.cache.stats(), (2, 0))
+
+  def test_evicts_least_recently_used(self):
+    self.cache.put('a', 'x'*100)
+    self.cache.put('b', 'x'*100)
+    self.cache.get('a')
+    self.cache.flush()
+    self.cache.max_bytes = self.cache.size()-1
+    self.cache.evict()
+    self.assertIsNotNone(self.cache.get('a'))
+    self.assertIsNone(self.cache.get('b'))
+
+  def test_copy_for_another_process(self):
+    self.cache.put('a', [1])
+    self.cache.get('a')
+    copy = pickle.loads(pickle.dumps(self.cache))
+    self.addCleanup(copy.close)
+    self.assertEqual(copy.used, set())
+    self.assertEqual(copy.get('a'), [1])
+    self.assertEqual(copy.used, {'a'})
+
+  def test_file_sha_is_git_blob_hash(self):
+    path = os.path.join(self.directory.name, 'file.py')
+    with open(path, 'wb') as f:
+      f.write(b'hello\n')
+    # git hash-object of same content
+    self.assertEqual(file_sha(path), 'ce013625030ba8dba906f756967f9e9ca394464a')
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,75 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from script import Journal, ProcessInstance
+from tests.repos import make_repo
+
+def analyze_or_crash(analyzer_args, url, python_files, directories, git_dir=None, known_files=None, skipped=None):
+  """ Analysis in a worker process which dies on repositories named crash, like a process killed by oom """
+  if url.endswith('crash'):
+    os._exit(1)
+  time.sleep(0.2)
+  return {'repository_url': url, 'number of lines': len(python_files)}, {}, 0.2, None
+
+class PipelineTest(unittest.TestCase):
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    cwd = os.getcwd()
+    os.chdir(directory.name)
+    self.addCleanup(os.chdir, cwd)
+    names = [f'r{num}' for num in range(8)]
+    names.insert(3, 'crash')
+    # index 0 is before range of instance 1
+    self.urls = ['unused'] + [make_repo(os.path.join('src', name), {'main.py': 'x = 1\n'}) for name in names]
+    with open('url_list.csv', 'w') as f:
+      f.write(','.join(self.urls))
+
+  def test_dead_analyzer_fails_only_its_repository(self):
+    journal = Journal('instance1.journal')
+    manager = ProcessInstance(1, len(self.urls)-1, 2, journal=journal)
+    analysis = (manager.process_pool(2), analyze_or_crash)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(manager.process_pipeline(2, 2, analysis)))
+    thread.start()
+    thread.join(120)
+    self.assertFalse(thread.is_alive(), 'pipeline did not finish')
+    result[0][0].shutdown()
+    journal.file.close()
+    with open('instance1.journal', 'r') as f:
+      statuses = {entry['url']: entry['status'] for entry in map(json.loads, f)}
+    self.assertEqual(statuses, {url: 'failed' if url.endswith('crash') else 'done' for url in self.urls[1:]})
+    # clones are deleted
+    self.assertEqual([name for name in os.listdir('.') if os.path.isdir(name)], ['src'])
+
+class SameNameTest(unittest.TestCase):
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    cwd = os.getcwd()
+    os.chdir(directory.name)
+    self.addCleanup(os.chdir, cwd)
+    # repositories of different owners with same name
+    self.urls = ['unused'] + [make_repo(os.path.join('src', owner, 'utils'), {'main.py': 'x = 1\n'*lines}) for owner, lines in (('a', 1), ('b', 2))]
+    with open('url_list.csv', 'w') as f:
+      f.write(','.join(self.urls))
+
+  def test_clones_at_once(self):
+    for mode in ('threads', 'pipeline', 'async'):
+      with self.subTest(mode=mode):
+        manager = ProcessInstance(1, 2, 2)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+          manager.run(mode=='pipeline', 1, 2 if mode=='async' else None)
+        results = {result['repository_url']: result['number of lines'] for result in map(json.loads, output.getvalue().splitlines())}
+        self.assertEqual(results, {self.urls[1]: 1, self.urls[2]: 2})
+        self.assertEqual([name for name in os.listdir('.') if os.path.isdir(name)], ['src'])
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,18 @@
+import sys
+import unittest
+from unittest import mock
+
+from script import running_python_libraries
+
+class RunningPythonLibrariesTest(unittest.TestCase):
+  def test_without_stdlib_module_names(self):
+    """ Python before 3.10 has no sys.stdlib_module_names """
+    with mock.patch.object(sys, 'stdlib_module_names', None, create=True):
+      del sys.stdlib_module_names
+      libraries = running_python_libraries()
+    for module in ('os', 'json', 'sys', 'asyncio', 'math', 'array'):
+      self.assertIn(module, libraries)
+    self.assertNotIn('script', libraries)
+
+if __name__=='__main__':
+  unittest.main()
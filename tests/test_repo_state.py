@@ -0,0 +1,99 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from repo_state import RepoState
+from script import ProcessInstance
+from tests.repos import commit, make_repo
+
+class RepoStateTest(unittest.TestCase):
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.directory = directory.name
+
+  def state(self, name):
+    state = RepoState(os.path.join(self.directory, name))
+    self.addCleanup(state.close)
+    return state
+
+  def test_save(self):
+    state = self.state('state.db')
+    self.assertIsNone(state.repo('a'))
+    state.save('a', 'c1', {'number of lines': 2}, {'x.py': ('s1', [1]), 'y.py': ('s2', [2])})
+    state.save('a', 'c2', {'number of lines': 1}, {'x.py': ('s3', [3])})
+    self.assertEqual(state.repo('a'), ('c2', {'number of lines': 1}))
+    # files of earlier commit are replaced
+    self.assertEqual(state.files('a'), {'s3': [3]})
+    self.assertEqual(state.file_rows('a'), [('x.py', 's3', [3])])
+
+  def test_merge(self):
+    main = self.state('main.db')
+    other = self.state('other.db')
+    main.save('a', 'old', {'n': 1}, {'x.py': ('s1', [1])})
+    main.save('b', 'b1', {'n': 2}, {'y.py': ('s2', [2])})
+    other.save('c', 'c1', {'n': 3}, {'z.py': ('s3', [3])})
+    other.save('a', 'new', {'n': 4}, {'w.py': ('s4', [4])})
+    # copy of b analyzed earlier does not replace b
+    with mock.patch('repo_state.time', return_value=0):
+      other.save('b', 'b0', {'n': 0}, {})
+    other.checkpoint()
+    main.merge(other.path)
+    self.assertEqual(main.repo('a'), ('new', {'n': 4}))
+    self.assertEqual(main.file_rows('a'), [('w.py', 's4', [4])])
+    self.assertEqual(main.repo('b'), ('b1', {'n': 2}))
+    self.assertEqual(main.files('b'), {'s2': [2]})
+    self.assertEqual(main.repo('c'), ('c1', {'n': 3}))
+
+class IncrementalRunTest(unittest.TestCase):
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    cwd = os.getcwd()
+    os.chdir(directory.name)
+    self.addCleanup(os.chdir, cwd)
+    self.source = os.path.join('src', 'repo')
+    self.url = make_repo(self.source, {'a.py': 'import json\nx = 1\n', 'b.py': 'import requests\ndef f(a, b):\n  return a\n'})
+    # index 0 is before range of instance 1
+    with open('url_list.csv', 'w') as f:
+      f.write(f'unused,{self.url}')
+
+  def run_instance(self, state):
+    """ Returns printed result and paths of analyzed files of one run """
+    manager = ProcessInstance(1, 1, 1, state=state)
+    analyzed = []
+    original = ProcessInstance.profiled_file_data
+    def profiled_file_data(self, file, *args):
+      analyzed.append(str(file))
+      return original(self, file, *args)
+    output = io.StringIO()
+    with mock.patch.object(ProcessInstance, 'profiled_file_data', profiled_file_data), contextlib.redirect_stdout(output):
+      manager.process(1)
+    result = json.loads(output.getvalue())
+    result['libraries'].sort()
+    return result, sorted(analyzed)
+
+  def test_only_changes_are_analyzed(self):
+    state = RepoState('state.db')
+    self.addCleanup(state.close)
+    first, analyzed = self.run_instance(state)
+    self.assertEqual(analyzed, ['a.py', 'b.py'])
+    # unchanged repository is not cloned
+    with mock.patch.object(ProcessInstance, 'clone_repo', side_effect=AssertionError('cloned')):
+      unchanged, analyzed = self.run_instance(state)
+    self.assertEqual(unchanged, first)
+    self.assertEqual(analyzed, [])
+    commit(self.source, {'b.py': 'import requests\nimport numpy\ndef f(a, b, c):\n  return a\n'})
+    changed, analyzed = self.run_instance(state)
+    self.assertEqual(analyzed, ['b.py'])
+    self.assertNotEqual(changed, first)
+    # same result as a run without state
+    full, _ = self.run_instance(None)
+    self.assertEqual(changed, full)
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,70 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from result_sink import ResultSink
+
+class ResultSinkTest(unittest.TestCase):
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.directory = directory.name
+    self.result = os.path.join(self.directory, 'result.json')
+
+  def sink(self, compression=None):
+    return ResultSink(os.path.join(self.directory, 'results'), compression, fsync_every=3)
+
+  def write_records(self, sink, source, numbers):
+    writer = sink.writer(source)
+    for number in numbers:
+      self.assertTrue(writer.write(json.dumps({'repository_url': f'{source}/{number}'}) + '\n'))
+    return writer
+
+  def urls(self, records):
+    return [record['repository_url'] for record in records]
+
+  def test_merge(self):
+    sink = self.sink()
+    self.write_records(sink, 'instance1', range(3))
+    writer = self.write_records(sink, 'instance2', range(2))
+    self.assertFalse(writer.write('Command executed\n'))
+    self.assertEqual(sink.merge(self.result), 5)
+    with open(self.result) as f:
+      records = json.load(f)
+    self.assertEqual(self.urls(records), ['instance1/0', 'instance1/1', 'instance1/2', 'instance2/0', 'instance2/1'])
+
+  def test_gzip_part(self):
+    sink = self.sink('gzip')
+    writer = self.write_records(sink, 'instance1', range(4))
+    sink.close()
+    with gzip.open(writer.path, 'rt') as f:
+      self.assertEqual(self.urls(map(json.loads, f)), [f'instance1/{i}' for i in range(4)])
+    self.assertEqual(sink.merge(self.result), 4)
+    with gzip.open(self.result + '.gz', 'rt') as f:
+      self.assertEqual(len(json.load(f)), 4)
+
+  def test_part_of_crashed_writer(self):
+    for compression in (None, 'gzip'):
+      with self.subTest(compression=compression):
+        sink = self.sink(compression)
+        self.write_records(sink, 'instance1', range(2))
+        writer = self.write_records(sink, 'instance2', range(1000))
+        writer.file.write(b'{"repository_url": "instance2/trun')
+        # records synced to disk so far, as if writer died before closing its file
+        writer.sync()
+        with open(writer.path, 'rb') as f:
+          data = f.read()
+        sink.close()
+        with open(writer.path, 'wb') as f:
+          f.write(data)
+        count = sink.merge(self.result)
+        with open(self.result + ('.gz' if compression else ''), 'rb') as f:
+          records = json.loads(gzip.decompress(f.read()) if compression else f.read())
+        self.assertEqual(count, len(records))
+        # truncated record is left out
+        self.assertEqual(self.urls(records), [f'instance1/{i}' for i in range(2)] + [f'instance2/{i}' for i in range(1000)])
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,82 @@
+import json
+import math
+import os
+import random
+import tempfile
+import unittest
+
+from stage_metrics import InstanceMetrics, RepoTimer, RunningSummary, fleet_summary
+
+def timer(url, clone, lines=10):
+  repo_timer = RepoTimer(url)
+  repo_timer.durations = {'clone': clone, 'analyze': clone/2}
+  repo_timer.lines = lines
+  return repo_timer
+
+def exact_percentile(values, fraction):
+  values = sorted(values)
+  return values[min(len(values)-1, max(0, math.ceil(fraction*len(values))-1))]
+
+class StageMetricsTest(unittest.TestCase):
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    cwd = os.getcwd()
+    os.chdir(directory.name)
+    self.addCleanup(os.chdir, cwd)
+
+  def records(self, path='instance1.repos.ndjson'):
+    with open(path) as f:
+      return [json.loads(line)['url'] for line in f]
+
+  def test_records_are_appended(self):
+    metrics = InstanceMetrics(1, write_interval=0)
+    metrics.add(timer('a', 1), 'done')
+    self.assertEqual(self.records(), ['a'])
+    metrics.add(timer('b', 2), 'failed')
+    self.assertEqual(self.records(), ['a', 'b'])
+    self.assertEqual(metrics.pending, [])
+    with open('instance1.metrics.json') as f:
+      summary = json.load(f)['summary']
+    self.assertEqual((summary['repos'], summary['failed'], summary['lines']), (2, 1, 20))
+    self.assertEqual(summary['stages']['clone']['max'], 2)
+    # first write of a new run replaces records of earlier run
+    metrics = InstanceMetrics(1)
+    metrics.add(timer('c', 1), 'done')
+    metrics.write()
+    self.assertEqual(self.records(), ['c'])
+
+  def test_percentiles(self):
+    generator = random.Random(1)
+    durations = [generator.lognormvariate(0, 2) for _ in range(2000)]
+    running = RunningSummary()
+    for duration in durations:
+      running.add({'status': 'done', 'bytes': 0, 'files': 0, 'lines': 0, 'stages': {'clone': duration}})
+    stats = running.summary()['stages']['clone']
+    self.assertEqual(stats['count'], len(durations))
+    self.assertEqual(stats['max'], max(durations))
+    for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+      exact = exact_percentile(durations, fraction)
+      self.assertGreaterEqual(stats[name], exact)
+      self.assertLessEqual(stats[name], exact*1.05)
+
+  def test_fleet_summary(self):
+    paths = []
+    for instance in (1, 2):
+      os.makedirs(f'instance{instance}')
+      os.chdir(f'instance{instance}')
+      metrics = InstanceMetrics(instance)
+      for num in range(3):
+        metrics.add(timer(f'{instance}/{num}', num+1), 'done')
+      metrics.write()
+      os.chdir('..')
+      paths.append(os.path.join(f'instance{instance}', f'instance{instance}.metrics.json'))
+    summary = fleet_summary(paths + ['missing.metrics.json'])
+    self.assertEqual(summary['repos'], 6)
+    self.assertEqual(summary['lines'], 60)
+    self.assertEqual(sorted(summary['instances']), [1, 2])
+    self.assertEqual(summary['stages']['clone']['count'], 6)
+    self.assertEqual(summary['stages']['clone']['max'], 3)
+
+if __name__=='__main__':
+  unittest.main()
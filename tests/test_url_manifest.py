@@ -0,0 +1,103 @@
+import csv
+import os
+import tempfile
+import types
+import unittest
+
+from ec2 import ManageInstances
+from script import ProcessInstance
+from url_manifest import UrlManifest, build_manifest, is_manifest, unpack_manifest
+
+URLS = [f'https://github.com/user{i}/repo{i}' for i in range(23)] + ['https://github.com/usér/répo']
+
+class UrlManifestTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+    self.csv_path = os.path.join(self.directory.name, 'url_list.csv')
+    # one row has several urls, like url_list.csv
+    with open(self.csv_path, 'w', newline='') as f:
+      writer = csv.writer(f)
+      writer.writerow(URLS[:10])
+      for url in URLS[10:]:
+        writer.writerow([url])
+    self.path = os.path.join(self.directory.name, 'url_list.manifest')
+    self.assertEqual(build_manifest(self.csv_path, self.path), len(URLS))
+    self.manifest = UrlManifest(self.path)
+    self.addCleanup(self.manifest.close)
+
+  def test_is_manifest(self):
+    self.assertTrue(is_manifest(self.path))
+    self.assertFalse(is_manifest(self.csv_path))
+    self.assertFalse(is_manifest(os.path.join(self.directory.name, 'missing')))
+
+  def test_compressed_manifest(self):
+    path = self.path + '.gz'
+    self.assertEqual(build_manifest(self.csv_path, path), len(URLS))
+    self.assertTrue(is_manifest(path))
+    self.assertLess(os.path.getsize(path), os.path.getsize(self.path))
+    os.remove(self.path)
+    self.assertEqual(unpack_manifest(path), self.path)
+    manifest = UrlManifest(self.path)
+    self.addCleanup(manifest.close)
+    self.assertEqual([manifest[i] for i in range(len(URLS))], URLS)
+
+  def test_urls_by_index(self):
+    self.assertEqual(len(self.manifest), len(URLS))
+    self.assertEqual([self.manifest[i] for i in range(len(URLS))], URLS)
+    with self.assertRaises(IndexError):
+      self.manifest[len(URLS)]
+    with self.assertRaises(IndexError):
+      self.manifest[-1]
+
+  def test_load_slice(self):
+    self.manifest.load(5, 12)
+    self.assertEqual(sorted(self.manifest.urls), list(range(5, 12)))
+    self.assertEqual([self.manifest[i] for i in range(5, 12)], URLS[5:12])
+    # a new slice replaces urls read before
+    self.manifest.load(20, 30)
+    self.assertEqual(sorted(self.manifest.urls), list(range(20, len(URLS))))
+    self.assertEqual(self.manifest[len(URLS)-1], URLS[-1])
+
+  def test_empty_slice(self):
+    self.manifest.load(30, 40)
+    self.assertEqual(self.manifest.urls, {})
+
+class InstanceSlicesTest(unittest.TestCase):
+  """ Every instance reads same urls from its url file as from whole url_list.csv """
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    cwd = os.getcwd()
+    os.chdir(directory.name)
+    self.addCleanup(os.chdir, cwd)
+    with open('url_list.csv', 'w', newline='') as f:
+      csv.writer(f).writerow(URLS)
+
+  def instance_urls(self, batches):
+    manager = ManageInstances.__new__(ManageInstances)
+    manager.num_instances = 3
+    manager.size = 7
+    manager.url_files = {}
+    manager.write_url_files(batches)
+    for instance_num, (urls_file, urls_start) in manager.url_files.items():
+      instance = types.SimpleNamespace(urls_file=urls_file, urls_start=urls_start)
+      ProcessInstance.get_urls(instance)
+      # same range as ProcessInstance
+      indexes = range(instance_num*manager.size+1, instance_num*manager.size+manager.size+1)
+      if batches:
+        instance.urls.load(indexes[0], indexes[-1]+1)
+      yield [instance.urls[i] for i in indexes], [URLS[i] for i in indexes]
+      if batches:
+        instance.urls.close()
+
+  def test_csv_slices(self):
+    for urls, expected in self.instance_urls(batches=False):
+      self.assertEqual(urls, expected)
+
+  def test_manifest(self):
+    for urls, expected in self.instance_urls(batches=True):
+      self.assertEqual(urls, expected)
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,113 @@
+import argparse
+import array
+import csv
+import gzip
+import os
+import shutil
+import struct
+import sys
+import threading
+
+MAGIC = b'URLMANI1'
+
+def build_manifest(csv_path, path):
+  """
+  Writes urls of csv file to a manifest, with same indexes as script.py gives them. Manifest has number
+  of urls, byte offset of every url and end of last one, and then the urls. It is gzip compressed if path
+  ends with .gz, to be sent to instances, which read it with unpack_manifest. Returns number of urls.
+  """
+  with open(csv_path, 'r') as f:
+    urls = [url.encode('utf8') for row in csv.reader(f) for url in row]
+  offsets = array.array('Q', [0])
+  for url in urls:
+    offsets.append(offsets[-1]+len(url))
+  if sys.byteorder!='little':
+    offsets.byteswap()
+  with (gzip.open if path.endswith('.gz') else open)(path + '.tmp', 'wb') as f:
+    f.write(MAGIC + struct.pack('<Q', len(urls)))
+    offsets.tofile(f)
+    for url in urls:
+      f.write(url)
+  # replace after writing, manifest can be read by running workers
+  os.replace(path + '.tmp', path)
+  return len(urls)
+
+def is_manifest(path):
+  """ Returns True if path is a manifest, or a gzip compressed manifest if it ends with .gz """
+  try:
+    with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as f:
+      return f.read(len(MAGIC))==MAGIC
+  except (OSError, EOFError):
+    return False
+
+def unpack_manifest(path):
+  """ Decompresses gzip compressed manifest next to it, as urls are read by seeking. Returns path of manifest """
+  unpacked = path[:-len('.gz')]
+  with gzip.open(path, 'rb') as source, open(unpacked + '.tmp', 'wb') as f:
+    shutil.copyfileobj(source, f, 1024*1024)
+  os.replace(unpacked + '.tmp', unpacked)
+  return unpacked
+
+class UrlManifest:
+  """
+  Urls of a manifest by index, read from disk without reading whole manifest. load reads a range of urls
+  at once with two reads, other urls are read one by one when they are used.
+  """
+  def __init__(self, path):
+    self.path = path
+    self.file = open(path, 'rb')
+    if self.file.read(len(MAGIC))!=MAGIC:
+      raise ValueError(f'{path} is not a url manifest')
+    self.count, = struct.unpack('<Q', self.file.read(8))
+    self.data_start = len(MAGIC)+8+(self.count+1)*8
+    self.urls = {}
+    self.lock = threading.Lock()
+
+  def __len__(self):
+    return self.count
+
+  def offsets(self, start, stop):
+    """ Returns byte offsets of urls from start to stop, and end of last one """
+    offsets = array.array('Q')
+    self.file.seek(len(MAGIC)+8+start*8)
+    offsets.frombytes(self.file.read((stop-start+1)*8))
+    if sys.byteorder!='little':
+      offsets.byteswap()
+    return offsets
+
+  def load(self, start, stop):
+    """ Reads urls from start to stop in place of urls read before """
+    start, stop = max(0, start), min(stop, self.count)
+    urls = {}
+    if start<stop:
+      with self.lock:
+        offsets = self.offsets(start, stop)
+        self.file.seek(self.data_start+offsets[0])
+        data = self.file.read(offsets[-1]-offsets[0])
+      for i in range(stop-start):
+        urls[start+i] = data[offsets[i]-offsets[0]:offsets[i+1]-offsets[0]].decode('utf8')
+    self.urls = urls
+
+  def __getitem__(self, i):
+    if i<0 or i>=self.count:
+      raise IndexError(i)
+    url = self.urls.get(i)
+    if url is None:
+      # threads share file position
+      with self.lock:
+        offsets = self.offsets(i, i+1)
+        self.file.seek(self.data_start+offsets[0])
+        url = self.file.read(offsets[1]-offsets[0]).decode('utf8')
+      self.urls[i] = url
+    return url
+
+  def close(self):
+    self.file.close()
+
+# python3 url_manifest.py url_list.csv url_list.manifest, or url_list.manifest.gz
+if __name__=='__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('csv_file')
+  parser.add_argument('manifest')
+  args = parser.parse_args()
+  print(f'{build_manifest(args.csv_file, args.manifest)} urls')